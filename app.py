@@ -11,8 +11,12 @@ The user can also select the haplogroup to animate and the script will animate t
 Website Link:https://nikhilesh-vasanthakumar-haplotracker-haplogroup-tracker-wqf8g7.streamlit.app/
 
 User Defined Functions:
-    common_code(mtgeo): This function is used to plot the haplogroups on the map based on the user input.
+    common_code(mtgeo, mode): This function is used to plot the haplogroups on the map based on the user input.
     The function takes the data as input and returns the map with the haplogroups plotted on it and the user can select the group to be animated.
+    selection_maps(mtgeo, mode, clades, option): Draws the map, the movement animation and the PRS line of the selected haplogroups.
+    It runs as its own fragment (st.fragment), so the map widgets only rerun this part; each tab section is a fragment as well.
+    plotly_chart(name, fig): Shows a figure, recording the time and the JSON size of the chart in the profiler.
+    Stages of each rerun are timed by a per-session profiler (profiling.py), shown in the sidebar panel when enabled.
     Onlyfemale_mtdna(): This function is used to filter the data to only include the females mtdna and then call the common_code function to plot the haplogroups on the map.
     Onlymale_mtdna(): This function is used to filter the data to only include the males mtdna and then call the common_code function to plot the haplogroups on the map.
     Combined_mtdna():This function is used to filter the data to only include  mtdna and then call the common_code function to plot the haplogroups on the map.
@@ -37,21 +41,31 @@ User Guide:
 #Importing the required libraries
 #import matplotlib.pyplot as plt
 #import seaborn as sns
-import tap
 import pandas as pd
-from pandas.api.types import (
-    is_categorical_dtype,
-    is_datetime64_any_dtype,
-    is_numeric_dtype,
-    is_object_dtype,
-)
 import plotly.express as px
 import streamlit as st
 import plotly.graph_objects as go
 #from itables.streamlit import interactive_table
 #from PIL import Image
+import io
 import os
+import re
 from pathlib import Path
+import dataset
+import figure_cache
+import filters
+import profiling
+import table_view
+import cube
+import delta
+import dispersal
+import haplogroups
+import pca
+import render
+import resampling
+import spatial
+import figures
+import trajectory
 #Adding a browser title
 st.set_page_config(page_title="Ancient DNA and Schizophrenia with Haplo Tracker",page_icon=":dna:",layout="wide",initial_sidebar_state="collapsed")
 
@@ -65,14 +79,19 @@ hide_streamlit_style = """
             """
 st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 
+#Opt-in instrumentation of the stages of each rerun (HAPLO_PROFILE=1 or ?profile=1 turn it on by default)
+profiler = st.session_state.setdefault("profiler", profiling.Profiler())
+profiler.enabled = st.sidebar.toggle("Performance panel", value=bool(os.environ.get(profiling.ENV_VAR)) or "profile" in st.query_params)
+profiler.start_rerun()
 
 
-def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+def filter_dataframe(df: pd.DataFrame, engine: filters.FilterEngine = None) -> pd.DataFrame:
     """
     Adds a UI on top of a dataframe to let viewers filter columns
 
     Args:
         df (pd.DataFrame): Original dataframe
+        engine (filters.FilterEngine): Precomputed indexes over df (built on the fly if None)
 
     Returns:
         pd.DataFrame: Filtered dataframe
@@ -82,18 +101,9 @@ def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     if not modify:
         return df
 
-    df = df.copy()
-
-    # Try to convert datetimes into a standard format (datetime, no timezone)
-    for col in df.columns:
-        if is_object_dtype(df[col]):
-            try:
-                df[col] = pd.to_datetime(df[col])
-            except Exception:
-                pass
-
-        if is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].dt.tz_localize(None)
+    if engine is None:
+        engine = filters.FilterEngine(df)
+    masks = []
 
     modification_container = st.container()
 
@@ -102,17 +112,19 @@ def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
         for column in to_filter_columns:
             left, right = st.columns((1, 20))
             left.write("↳")
-            # Treat columns with < 10 unique values as categorical
-            if is_categorical_dtype(df[column]) or df[column].nunique() < 10:
+            kind = engine.kind(column)
+            # Treat columns with < 10 unique values as categorical (Country and mtdna are
+            # stored as categoricals too, but are filtered as text)
+            if kind == filters.CATEGORICAL:
+                values = engine.values(column)
                 user_cat_input = right.multiselect(
                     f"Values for {column}",
-                    df[column].unique(),
-                    default=list(df[column].unique()),
+                    values,
+                    default=values,
                 )
-                df = df[df[column].isin(user_cat_input)]
-            elif is_numeric_dtype(df[column]):
-                _min = float(df[column].min())
-                _max = float(df[column].max())
+                masks.append(engine.category_mask(column, user_cat_input))
+            elif kind == filters.NUMERIC:
+                _min, _max = map(float, engine.bounds(column))
                 step = (_max - _min) / 100
                 user_num_input = right.slider(
                     f"Values for {column}",
@@ -121,69 +133,154 @@ def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
                     (_min, _max),
                     step=step,
                 )
-                df = df[df[column].between(*user_num_input)]
-            elif is_datetime64_any_dtype(df[column]):
+                masks.append(engine.range_mask(column, *user_num_input))
+            elif kind == filters.DATETIME:
                 user_date_input = right.date_input(
                     f"Values for {column}",
-                    value=(
-                        df[column].min(),
-                        df[column].max(),
-                    ),
+                    value=engine.bounds(column),
                 )
                 if len(user_date_input) == 2:
                     user_date_input = tuple(map(pd.to_datetime, user_date_input))
                     start_date, end_date = user_date_input
-                    df = df.loc[df[column].between(start_date, end_date)]
+                    masks.append(engine.range_mask(column, start_date, end_date))
             else:
                 user_text_input = right.text_input(
                     f"Substring or regex in {column}",
                 )
                 if user_text_input:
-                    df = df[df[column].str.contains(user_text_input)]
-
-    return df
-
-
-
-#Reading the data
-data=pd.read_csv("Data/data_pca.csv", sep=",")
-
-data=data.rename(columns={'Continente':'Region', 'Período Histórico': 'Historical Period', 'PRS_20PCs': 'PRS_SCZ'})
-
-# Selecting the required columns from the data
-data=data[["Molecular Sex","Lat.","Long.","Region","mtDNA haplogroup if >2x or published",
-           "Date mean in BP in years before 1950 CE [OxCal mu for a direct radiocarbon date, and average of range for a contextual date]",
-           "Political Entity", "PRS_SCZ", "Historical Period"]]
-
-mapa_paises_continentes = {
-    'Nigeria': 'África', 'USA': 'América', 'Russia': 'Ásia', 'Puerto Rico': 'América', 'Spain': 'Europa',
-    'United Kingdom': 'Europa', 'India': 'Ásia', 'Sri Lanka': 'Ásia', 'Turkmenistan': 'Ásia', 'Uzbekistan': 'Ásia',
-    'Pakistan': 'Ásia', 'China': 'Ásia', 'Tajikistan': 'Ásia', 'Kazakhstan': 'Ásia', 'Kyrgyzstan': 'Ásia',
-    'Peru': 'América', 'Mexico': 'América', 'Bahamas': 'América', 'Finland': 'Europa', 'Venezuela': 'América',
-    'Canada': 'América', 'Iceland': 'Europa', 'Greenland': 'América', 'Nepal': 'Ásia', 'Norway': 'Europa',
-    'Cuba': 'América', 'Haiti': 'América', 'Belize': 'América', 'Dominican Republic': 'América', 'Jordan': 'Ásia',
-    'France': 'Europa', 'Chile': 'América', 'Ireland': 'Europa', 'Argentina': 'América', 'Morocco': 'África',
-    'Hungary': 'Europa', 'Guadeloupe': 'América', 'Tonga': 'Oceania', 'French Polynesia': 'Oceania', 'Sudan': 'África'
-}
-
-# Atualizar a coluna 'Continente' com base no mapeamento direto
-for pais, continente in mapa_paises_continentes.items():
-    data.loc[(data['Region'] == 'Indeterminado') & (data['Political Entity'] == pais), 'Region'] = continente
-
-# Renaming the columns for ease of use
-data=data.rename(columns={'Lat.':'Lat','Long.':'Long',
-                          'Molecular Sex':'Sex',
-                          'Political Entity':'Country',
-                          'mtDNA haplogroup if >2x or published':'mtdna',
-                          'Historical Period':'Period',
-                          'Date mean in BP in years before 1950 CE [OxCal mu for a direct radiocarbon date, and average of range for a contextual date]':'Date'})
-
-data=data.drop(data[data.Lat==".."].index) #dropping the rows with missing values
-data["Lat"] = data["Lat"].astype(float)
-data["Long"] = data["Long"].astype(float)
-#data["PRS_SCZ"] = data["PRS_SCZ"].str.replace(",", ".").astype(float) 
-#data=data.drop(data[data.Region=="Indeterminado"].index) 
-data["mtdna"] = data["mtdna"].str.replace('n/a (<2x)', "..")
+                    try:
+                        masks.append(engine.text_mask(column, user_text_input))
+                    except re.error as e:
+                        right.error("Invalid regex: {}".format(e))
+
+    return engine.apply(masks)
+
+
+@st.cache_resource(max_entries=1)
+def get_filter_engine(version, _frame):
+    return filters.FilterEngine(_frame)
+
+
+@st.cache_resource
+def get_derived():
+    return delta.DerivedCache()   #latest cube and spatial indexes, updated with the delta of an incremental refresh
+
+
+def get_cube(version, _frame):
+    return get_derived().get("cube", shared, lambda: cube.AggregateCube(_frame),
+                             lambda previous, change: previous.updated(change.removed, _frame.iloc[change.added]))
+
+
+@st.cache_data(max_entries=32, show_spinner="Computing trend...")
+def get_trajectory(version, key, x, window, stat, _frame):
+    #key identifies the samples in _frame (mode, and the selected haplogroups in HaploTracker)
+    return trajectory.rolling_trajectory(_frame, x=x, window=window, stat=stat)
+
+
+@st.cache_data(max_entries=32, show_spinner="Linking samples...")
+def get_movement_links(version, mode, clade, max_gap, _frame):
+    #_frame holds the samples of the clade in the mode, so the links are reused on figure cache hits
+    return dispersal.movement_links(_frame, max_gap=max_gap)
+
+
+@st.cache_resource
+def get_resampling_pool():
+    return resampling.make_pool()   #one process pool per server, so its workers import numpy and pandas once
+
+
+@st.cache_data(max_entries=2, show_spinner="Loading principal components...")
+def get_pcs(path, signature):
+    #signature is the (mtime, size) of the PCs file written by pca.py
+    return pca.load_pcs(path)
+
+
+def get_spatial_index(version, mode, _frame):
+    return get_derived().get(("spatial", mode), shared, lambda: spatial.SpatialIndex(_frame),
+                             lambda previous, change: previous.updated(_frame, change))
+
+
+@st.cache_resource(max_entries=4)
+def get_clade_trie(version, mode, _frame):
+    return haplogroups.CladeTrie(_frame["mtdna"])
+
+
+@st.cache_resource(max_entries=1)
+def get_table_view(version, _frame):
+    return table_view.TableView(_frame)
+
+
+def paginated_table(view: table_view.TableView, subset: pd.DataFrame):
+    """
+    Shows a subset of the dataset one page at a time, sorted on the server
+
+    Args:
+        view (table_view.TableView): Sort permutations of the full dataset
+        subset (pd.DataFrame): Rows to show (e.g. the output of filter_dataframe)
+    """
+    rows = view.positions(subset)
+    sort_col, dir_col, size_col, page_col = st.columns(4)
+    sort_by = sort_col.selectbox("Sort by", ["(none)"] + list(view.df.columns))
+    ascending = dir_col.radio("Order", ["Ascending", "Descending"], horizontal=True) == "Ascending"
+    page_size = size_col.selectbox("Rows per page", table_view.PAGE_SIZES)
+    pages = max(1, -(-len(rows) // page_size))
+    page = page_col.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+
+    ordered = view.order(rows, None if sort_by == "(none)" else sort_by, ascending)
+    start = (page - 1) * page_size
+    st.dataframe(view.page(ordered, page, page_size), hide_index=True)
+    st.caption(f"Rows {min(start + 1, len(rows))}-{min(start + page_size, len(rows))} of {len(rows)}")
+
+    #The export is only encoded when asked for, not on every rerun
+    export_format = st.radio("Export format", ["CSV", "Parquet"], horizontal=True)
+    if st.button("Prepare download"):
+        if export_format == "CSV":
+            #the csv batches are written to the buffer as they are encoded instead of being held in a list and joined
+            payload, mime = io.BytesIO(), "text/csv"
+            payload.writelines(view.export_csv(ordered))
+        else:
+            payload, mime = view.export_parquet(ordered), "application/vnd.apache.parquet"
+        st.download_button("Download filtered data", payload, file_name=f"aadr_filtered.{export_format.lower()}", mime=mime)
+
+
+
+#Reading the data: a single read-only copy is shared by all sessions until Data/data_pca.csv changes
+pd.set_option("mode.copy_on_write", True)
+
+@st.cache_resource(show_spinner="Loading dataset...", max_entries=1)
+def load_data(source, signature, scores=None, scores_signature=None):
+    #a new release is applied to the cache as a delta by Genetic ID (see delta.py)
+    return dataset.load_shared_dataset(source, scores=scores, incremental=True)
+
+#PRS rescored by prs.py (Data/prs_scz.csv, or ADNA_SCORES) replace those of the source
+scores = dataset.scores_path()
+scores_signature = dataset.source_signature(scores) if scores is not None else None
+with profiler.span("load_data") as record:
+    shared = load_data(dataset.DATA_PATH, dataset.source_signature(dataset.DATA_PATH), scores, scores_signature)
+    data = shared.frame
+    record["rows"] = len(data)
+with profiler.span("aggregate_cube"):
+    aggregates = get_cube(shared.version, data) #counts per Sex x Region x Period x mtdna, built once
+
+
+@st.cache_resource
+def get_figure_cache():
+    return figure_cache.FigureCache()   #shared by all sessions, bounded by the size of the stored figures
+
+
+def prerendered(name, build):
+    #Figures are served from the shared LRU cache, then from the files rendered by render.py, and built live otherwise
+    with profiler.span("figure:" + name.split("?")[0], figure_name=name) as record:
+        record["source"] = "cache"
+        def load_or_build():
+            fig = render.load_figure(shared.version, name)
+            record["source"] = "built" if fig is None else "prerendered"
+            return build() if fig is None else fig
+        return get_figure_cache().get_or_build((shared.version, name), load_or_build)
+
+
+def plotly_chart(name, fig):
+    with profiler.span("plotly_chart:" + name, figure=fig):
+        st.plotly_chart(fig)
     
 #Creating a title for the app
 title_text = "Ancient DNA and Schizophrenia"
@@ -192,7 +289,7 @@ subtitle = "Polygenic risk for schizophrenia: from the Paleolithic to the post-N
 st.title(title_text)
 
 tab1, tab2, tab3 = st.tabs(["Home", "Exploratory Data Analysis", "HaploTracker"])
-with tab1:
+with tab1, profiler.span("tab:Home"):
     st.subheader(subtitle)
     url = "https://github.com/Nikhilesh-Vasanthakumar/Haplotracker"
     st.markdown('''This study investigated the evolutionary dynamics of polygenic risk PRS_SCZs (PRS) for schizophrenia in ancient human populations, 
@@ -218,358 +315,224 @@ If you have some question, feedback, or request, contact the corresponding autho
 
 #### Data
  ''')
-    st.dataframe(filter_dataframe(data))
+    @st.fragment
+    @profiler.trace()
+    def data_explorer():   #filters, sorting and paging only rerun the table
+        with profiler.span("filter_dataframe") as record:
+            subset = filter_dataframe(data, get_filter_engine(shared.version, data))
+            record["rows"] = len(subset)
+        with profiler.span("paginated_table"):
+            paginated_table(get_table_view(shared.version, data), subset)
+    data_explorer()
     
     
-with tab2:
+with tab2, profiler.span("tab:Exploratory Data Analysis"):
     st.subheader("Exploratory Data Analysis")
     col1,col2=st.columns(2)
     with col1: 
-        period_order = ['Paleolítico', 'Mesolítico', 'Neolítico', 'Pós-Neolítico', "Total"]
-        df_cros = pd.crosstab(data['Region'], data['Period']) #, colnames=period_order)
-        df_cros['Total'] = df_cros.sum(axis=1)
-        df_cros.columns = period_order
-        fig02 = px.imshow(df_cros, text_auto=True)
-        st.plotly_chart(fig02)
+        fig02 = prerendered(render.figure_name("heatmap"), lambda: figures.region_period_heatmap(aggregates))
+        plotly_chart("EDA/heatmap", fig02)
 
     with col2:
         # Tab 02 - Figure 03 - Barplot
-        periods=['Paleolítico', 'Mesolítico', 'Neolítico', 'Pós-Neolítico']
-        fig03 = px.histogram(data, x="Period", color="Region", text_auto=False)
-        fig03.update_xaxes(categoryorder='array', categoryarray=periods)
-        #fig03.update_layout(xaxis={'categoryorder': order})
-        st.plotly_chart(fig03)
-
-    x = "Period"
-    y = "PRS_SCZ"
-    fig00 = tap.plot_stats(data, x, y, order=periods, type_correction="bonferroni", type_test="dunn") 
-    st.plotly_chart(fig00)
-
-    x = "Region"
-    y = "PRS_SCZ"
-    order = ['África','Ásia','Europa','América', 'Oceania']
-    pairs=[("África", "Ásia"), ("África", "América"), ("África", "Europa"), ('América','Ásia'), 
-           ('América','Europa'), ('América','Oceania')           ]
-    fig01 = tap.plot_stats(data, x, y, type_correction="bonferroni", order=order) # , pairs=pairs
-    st.plotly_chart(fig01)
+        periods = figures.periods
+        fig03 = prerendered(render.figure_name("period_bar"), lambda: figures.period_region_bar(aggregates))
+        plotly_chart("EDA/period_bar", fig03)
+
+    fig00 = prerendered(render.figure_name("period_tests"), lambda: figures.period_tests_figure(data))
+    plotly_chart("EDA/period_tests", fig00)
+
+    order = figures.regions
+    fig01 = prerendered(render.figure_name("region_tests"), lambda: figures.region_tests_figure(data))
+    plotly_chart("EDA/region_tests", fig01)
+
+    #Permutation tests and bootstrap effect sizes, cached on disk per dataset fingerprint
+    @st.fragment
+    @profiler.trace()
+    def permutation_tests():
+        with st.expander("Permutation tests and effect sizes"):
+            run_col, resamples_col = st.columns(2)
+            run_resampling = run_col.checkbox("Run permutation tests")
+            n_resamples = resamples_col.selectbox("Resamples", [1000, 10000, 100000], index=1)
+            if run_resampling:
+                pool = get_resampling_pool()
+                with st.spinner("Resampling..."), profiler.span("compare_groups", n_resamples=n_resamples):
+                    st.dataframe(resampling.compare_groups(data, "Period", order=periods, n_resamples=n_resamples, pool=pool), hide_index=True)
+                    st.dataframe(resampling.compare_groups(data, "Region", order=order, n_resamples=n_resamples, pool=pool), hide_index=True)
+    permutation_tests()
     
       
-    data_sorted = data.sort_values(by='Date')
-    fig04 = px.line(data_sorted, x='Date', y='PRS_SCZ', markers=True, color='Region')
-
-    colors = [px.colors.qualitative.Pastel[3], px.colors.qualitative.Pastel[4],  px.colors.qualitative.Pastel[5], 
-              px.colors.qualitative.Pastel[7]]
-    shapes = []
-    bgs = [[0, 4000], 
-           [4000, 8000], 
-           [8000, 13000], 
-           [13000, max(data_sorted.Date)+1000]]
-    for i, b in enumerate(bgs):
-        shapes.append(dict(type="rect",
-                    xref="x",
-                    yref="paper",
-                    x0=b[0],
-                    y0=0,
-                    x1=b[1],
-                    y1=1,
-                    fillcolor=colors[i],
-                    opacity=0.3,
-                    layer="below",
-                    line_width=0))
-        fig04.add_annotation(text=periods[3-i], textangle=315, 
-                  x=(b[0]+b[1])/2, y=min(data_sorted.PRS_SCZ), showarrow=False,)
-
-    fig04.update_layout(#xaxis=dict(showgrid=False),
-                    shapes=shapes)
-
-    fig04.update_layout(xaxis = dict(autorange="reversed") )
-
-    st.plotly_chart(fig04)
+    #PRS over time: WebGL traces, downsampled per Region unless the BP window is narrow
+    @st.fragment
+    @profiler.trace()
+    def prs_over_time():   #the date window and trend widgets only rerun this chart
+        date_min, date_max = int(data['Date'].min()), int(data['Date'].max())
+        bp_window = st.slider("Date window (years BP)", date_min, date_max, (date_min, date_max))
+        trend_col, window_col, stat_col = st.columns(3)
+        show_trend = trend_col.checkbox("Show rolling trend", value=True)
+        trend_window = window_col.slider("Rolling window (years)", 500, 10000, trajectory.WINDOW, step=500)
+        trend_stat = stat_col.radio("Statistic", ["mean", "median"], horizontal=True)
+        x_range = None if bp_window == (date_min, date_max) else bp_window
+        fig04 = prerendered(render.figure_name("prs_time", x_range=x_range, trend=show_trend, window=trend_window, stat=trend_stat),
+                            lambda: figures.prs_time_figure(data, x='Date', y='PRS_SCZ', color='Region', x_range=x_range,
+                                                            trajectory=get_trajectory(shared.version, "MtDNA", 'Date', trend_window, trend_stat, data) if show_trend else None))
+
+        plotly_chart("EDA/prs_time", fig04)
+    prs_over_time()
+
+    #Ancestry PCs computed by pca.py from the genotypes (ADNA_PCS)
+    @st.fragment
+    @profiler.trace()
+    def pca_plot():
+        if not pca.PCS_PATH.exists():
+            st.info(f"Principal components not found: run pca.py to write {pca.PCS_PATH}")
+            return
+        pca_color = st.radio("Colour the principal components by", ["Region", "Period"], horizontal=True)
+        signature = dataset.source_signature(pca.PCS_PATH)
+        fig05 = prerendered(render.figure_name("pca", color=pca_color, pcs="%d-%d" % signature),
+                            lambda: figures.pca_figure(data.merge(get_pcs(pca.PCS_PATH, signature), on="Genetic ID"), pca_color))
+        plotly_chart("EDA/pca", fig05)
+    pca_plot()
 
     
 
 
-with tab3:
+with tab3, profiler.span("tab:HaploTracker"):
     st.subheader("HaploTracker Analysis")
     st.write("This application is adapted from the tool [Haplotracker](%s) (MIT license)." % url) 
     #Creating a dataframe with the required columns and renaming the columns
-    col1,col2=st.columns(2)
-    with col1:
-        #image=Image.open('assests/LU.png')
-        #st.image(image, width=150)
-        #Creating the main function for the app    
-        def common_code(mtgeo):     
-            try:
-                # 
-                fig00 = go.Figure()
-                periods = ['Paleolítico', 'Mesolítico', 'Neolítico', 'Pós-Neolítico']
-                for p in periods:
-                    fig00.add_trace(go.Violin(x=mtgeo['Period'][mtgeo['Period'] == p],
-                                    y=mtgeo['PRS_SCZ'][mtgeo['Period'] == p],
-                                    name=p,
-                                    box_visible=True,
-                                    meanline_visible=True))
-                st.plotly_chart(fig00)
-
-
-                # Get the top 10 most frequent mtdna values
-                top_10_mtdna = mtgeo['mtdna'].value_counts().nlargest(20).index
-                # Filter the DataFrame to include only the top 10 mtdna values
-                filtered_subset = mtgeo[mtgeo['mtdna'].isin(top_10_mtdna)]
-                fig01 = px.histogram(filtered_subset, x="mtdna", color="Region", text_auto=False)
-                fig01.update_layout(xaxis={'categoryorder':'total descending'})
-                st.plotly_chart(fig01)
-                fig01 = px.histogram(filtered_subset, x="mtdna", color="Period", text_auto=False)
-                fig01.update_layout(xaxis={'categoryorder':'total descending'})
-                st.plotly_chart(fig01)
-                #creating a sidebar to select the haplogroups
-                option=st.multiselect(label="Select the haplogroup",options=mtgeo["mtdna"].unique())
-                if not option:#if no haplogroup is selected
-                    st.error("Please select atleast one haplogroup")
-                else:  #    if haplogroup is selected
-                    mtgeo["Date"]=mtgeo["Date"]+70 #adding 70 years to the date column to find age from 2020
-                    mtgeo['Lat'].astype(float) #converting the latitude column to float
-                    mtgeo['Long'].astype(float) #converting the longitude column to float
-                    select=mtgeo[mtgeo["mtdna"].isin(option)]      #selecting the haplogroups selected in the sidebar
-                    select["hover"] = select["Country"].str.cat('\t' + select["Date"].astype(str) + ' years ago') #creating a hover column
+    @st.fragment
+    @profiler.trace()
+    def haplotracker_tab():   #widgets of this tab only rerun this tab
+        col1,col2=st.columns(2)
+        with col1:
+            #image=Image.open('assests/LU.png')
+            #st.image(image, width=150)
+            @st.fragment
+            @profiler.trace()
+            def selection_maps(mtgeo, mode, clades, option):   #maps, animation and PRS line of the selected haplogroups
+                try:
+                    #the Age (date + 70 years, to find age from 2020) and hover columns are precomputed in the shared views
+                    positions=clades.positions(option)
+                    select=mtgeo.iloc[positions]      #selecting the rows below the clades selected in the sidebar
                     map_type=st.selectbox("Select map type",options=["USGS","Natural Earth"]) #selecting the map type
-                    if map_type=="Natural Earth":   #if natural earth is selected
-                            fig1 = px.scatter_geo(select, lat = 'Lat', lon = 'Long',color='mtdna',hover_name="hover",projection='natural earth',
-                                                color_discrete_sequence=px.colors.qualitative.Set1)
-                            fig1.update_geos(showland=True,landcolor="LightGreen",showocean=True, oceancolor="LightBlue",
-                                            showrivers=True, rivercolor="Blue",
-                                            projection_type="natural earth",fitbounds="locations")
-                            st.plotly_chart(fig1)
-                            select=select.sort_values(by="Date",ascending=False)  #sorting the data based on the date in descending order
-                            animate_select=st.selectbox("Select haplogroup to animate",options=option)  #Using the user input to select the haplogroup to animate
-                            animate_data = select[select["mtdna"].isin([animate_select])]
-                            fig3 = go.Figure(
-                                data=[
-                                    go.Scattermapbox(
-                                        lat=animate_data["Lat"],
-                                        lon=animate_data["Long"],
-                                        mode="lines",
-                                        line=dict(width=2, color="blue"),
-                                        name="Haplogroup Movement",
-                                        hovertext=animate_data["hover"]
-                                    ),
-                                    go.Scattermapbox(
-                                        lat=animate_data["Lat"],
-                                        lon=animate_data["Long"],
-                                        mode="lines",
-                                        line=dict(width=2, color="blue")
-                                    ),
-                                    go.Scattermapbox(
-                                        lat=animate_data["Lat"],
-                                        lon=animate_data["Long"],
-                                        mode="markers",
-                                        marker=dict(
-                                            size=6,
-                                            color="red"
-                                        ),
-                                        name="Haplogroup locations",
-                                        hovertext=animate_data["hover"]
-                                    )
-                                ],
-                                layout=go.Layout(
-                                    title_text="Movement of selected Haplogroup over history",
-                                    mapbox_style="carto-positron", # Change the mapbox_style to "carto-positron"
-                                    mapbox=dict(
-                                        accesstoken="pk.eyJ1IjoibmlraGlsZXNoMjMiLCJhIjoiY2xmMmJucGx6MDFxaTN5bnRpYW12cWxxeCJ9.KeccdtSz6Hc9F_vPrYoiNg",
-                                        bearing=0,
-                                        center=dict(
-                                            lat=select["Lat"].mean(),
-                                            lon=select["Long"].mean()),
-                                        pitch=0,
-                                        zoom=1
-                                    ),
-                                    updatemenus=[
-                                        dict(
-                                            type="buttons",
-                                            buttons=[dict(label="Play", method="animate",args=[None])]
-                                        )
-                                    ]
-                                ),
-                                frames=[
-                                    go.Frame(
-                                        data=[
-                                            go.Scattermapbox(
-                                                lat=[list(animate_data["Lat"])[k]],
-                                                lon=[list(animate_data["Long"])[k]],
-                                                mode="markers",
-                                                marker=dict(color="red", size=10),
-                                                text=list(animate_data["mtdna"])[k]
-                                            ),
-
-                                            go.Scattermapbox(
-                                                lat=list(animate_data["Lat"])[:k+1],
-                                                lon=list(animate_data["Long"])[:k+1],
-                                                mode="lines",
-                                                line=dict(width=2, color="orange"),
-                                                name="Movement"
-                                            )
-                                        ]
-                                    )
-                                    for k in range(1, len(animate_data["mtdna"]))
-                                ]
-                            )
-
-                            # Change the map style using update_layout
-                            fig3.update_layout(
-                                mapbox=dict(
-                                    style="carto-positron",
-                                    center=dict(
-                                        lat=select["Lat"].mean(),
-                                        lon=select["Long"].mean()
-                                    ),
-                                    zoom=1
-                                )
-                            )
-
-                            st.plotly_chart(fig3)
-
-                    else:       #if USGS is selected
-                            fig1 = px.scatter_mapbox(select, lat = 'Lat', lon = 'Long',color='mtdna',hover_name="hover",
-                                                color_discrete_sequence=px.colors.qualitative.Set1)   #creating a scatter plot on the map based on the haplogroups selected
-                            fig1.update_traces(marker=dict(size=10, symbol="circle"))#updating the size of the markers and the shape of the markers
-                            fig1.update_geos(showland=True,landcolor="LightGreen",showocean=True, oceancolor="LightBlue",   #updating the map features
-                                            showrivers=True, rivercolor="Blue")
-                            select=select.sort_values(by="Date",ascending=False)       #sorting the data based on the date in descending order
-                            fig1.update_layout( #updating the layout of the map
-                            mapbox_style="white-bg",            
-                            mapbox_layers=[
-                                {
-                                    "below": 'traces',
-                                    "sourcetype": "raster",
-                                    "sourceattribution": "United States Geological Survey",
-                                    "source": [
-                                        "https://basemap.nationalmap.gov/arcgis/rest/services/USGSImageryOnly/MapServer/tile/{z}/{y}/{x}"
-                                        ]
-                                    }
-                                ])
-                            st.plotly_chart(fig1)   #plotting the map
-                            select=select.sort_values(by="Date",ascending=False)  #sorting the data based on the date in descending order
-                            animate_select=st.selectbox("Select haplogroup to animate",options=option)  #Using the user input to select the haplogroup to animate
-                            animate_data = select[select["mtdna"].isin([animate_select])]       #selecting the haplogroup to animate from the data
-                            
-                            fig3 = go.Figure( #Initializing the figure
-                                data=[  #adding the data to the figure
-                                    go.Scattermapbox( #adding the scattermapbox to the figure
-                                        lat=animate_data["Lat"], #adding the latitude column to the scattermapbox
-                                        lon=animate_data["Long"],      #adding the longitude column to the scattermapbox
-                                        mode="lines",#adding the mode to the scattermapbox
-                                        line=dict(width=2, color="blue"),#adding the line properties to the scattermapbox
-                                        name="Haplogroup Movement",#adding the name to the scattermapbox
-                                        hovertext=animate_data["hover"]#adding the hover text to the scattermapbox
-                                    ),
-                                    go.Scattermapbox(#adding a second scattermapbox to the figure
-                                        lat=animate_data["Lat"],    #adding the latitude column to the scattermapbox
-                                        lon=animate_data["Long"],   #adding the longitude column to the scattermapbox
-                                        mode="lines",   #adding the mode to the scattermapbox
-                                        line=dict(width=2, color="blue")        #adding the line properties to the scattermapbox
-                                    ),
-                                    go.Scattermapbox(   #adding a third scattermapbox to the figure
-                                        lat=animate_data["Lat"],        #adding the latitude column to the scattermapbox
-                                        lon=animate_data["Long"],       #adding the longitude column to the scattermapbox
-                                        mode="markers",     #adding the mode to the scattermapbox
-                                        marker=dict(            #adding the marker properties to the scattermapbox
-                                            size=6, #adding the size of the marker
-                                            color="red"     #adding the color of the marker
-                                        ),
-                                        name="Haplogroup locations",   #adding the name to the scattermapbox
-                                        hovertext=animate_data["hover"]    #adding the hover text to the scattermapbox
-                                    )
-                                ],
-                                layout=go.Layout(  #adding the layout to the figure
-                                    title_text="Movement of mtHaplogroups over history", #adding the title to the figure
-                                    mapbox_style="white-bg",   #adding the mapbox style to the figure
-                                    mapbox_layers=[ #adding the mapbox layers to the figure
-                                        {
-                                            "below": 'traces',
-                                            "sourcetype": "raster",
-                                            "sourceattribution": "United States Geological Survey",
-                                            "source": [
-                                                "https://basemap.nationalmap.gov/arcgis/rest/services/USGSImageryOnly/MapServer/tile/{z}/{y}/{x}"
-                                            ]
-                                        }
-                                    ],
-                                    mapbox=dict( 
-                                        accesstoken="pk.eyJ1IjoibmlraGlsZXNoMjMiLCJhIjoiY2xmMmJucGx6MDFxaTN5bnRpYW12cWxxeCJ9.KeccdtSz6Hc9F_vPrYoiNg",
-                                        bearing=0,
-                                        center=dict(
-                                            lat=select["Lat"].mean(),
-                                            lon=select["Long"].mean()),
-                                        pitch=0,
-                                        zoom=1
-                                    ),
-                                    updatemenus=[ #adding the updatemenus to the figure which will be used to animate the figure
-                                        dict(
-                                            type="buttons",
-                                            buttons=[dict(label="Play",method="animate",args=[None])] 
-                                        )
-                                    ]
-                                ),
-                                frames=[ #The frames are used to animate the figure initializing the frames.
-                                    go.Frame(
-                                        data=[
-                                            go.Scattermapbox( #adding the scattermapbox "markers" to the frame to animate
-                                                lat=[list(animate_data["Lat"])[k]],
-                                                lon=[list(animate_data["Long"])[k]],
-                                                mode="markers",
-                                                marker=dict(color="red", size=10),
-                                                text=list(animate_data["mtdna"])[k]
-                                            ),
-                                            
-                                            go.Scattermapbox( #adding the scattermapbox "lines" to the frame to animate
-                                                lat=list(animate_data["Lat"])[:k+1], #adding the latitude column to the scattermapbox
-                                                lon=list(animate_data["Long"])[:k+1], #adding the longitude column to the scattermapbox
-                                                mode="lines",
-                                                line=dict(width=2, color="orange"),
-                                                name="Movement"
-                                            )
-                                        ]
-                                    )
-                                    for k in range(1, len(animate_data["mtdna"]))   #for loop to iterate through the data
-                                ]
-                            )
-                            st.plotly_chart(fig3)   #plotting the figure
-                    fig4 = px.line(select, x='Date', y='PRS_SCZ', markers=True, color='Region')
-                    #fig1.update_traces(line=dict(color = 'rgba(50,50,50,0.2)'))
-                    fig4.update_layout(
-                        xaxis = dict(autorange="reversed")
-                        )
+                    #samples are grouped in spatial clusters so the map payload stays bounded
+                    spatial_index = get_spatial_index(shared.version, mode, mtgeo)
+                    zoom = st.slider("Map zoom level", 0, spatial.MAX_ZOOM, spatial_index.auto_zoom(positions),
+                                     help="Higher levels split the clusters; at the highest level each marker is a site")
+                    fig1 = prerendered(render.figure_name("map", mode, selection=option, map_type=map_type, zoom=zoom),
+                                       lambda: figures.cluster_map(spatial_index.clusters(positions, zoom), map_type))
+                    plotly_chart(f"{mode}/map", fig1)   #plotting the map
+                    select=select.sort_values(by="Age",ascending=False)  #sorting the data based on the date in descending order
+                    animate_select=st.selectbox("Select haplogroup to animate",options=option)  #Using the user input to select the haplogroup to animate
+                    animate_data = mtgeo.iloc[clades.positions([animate_select])].sort_values(by="Age",ascending=False)       #selecting the clade to animate from the data
+                    frames_col, sampling_col = st.columns(2)
+                    max_frames = frames_col.slider("Maximum animation frames", 10, 500, figures.MAX_FRAMES, step=10)
+                    sampling = sampling_col.radio("Frame sampling", [figures.DECIMATION, figures.TIME_BINS], horizontal=True)
+                    center = dict(lat=select["Lat"].mean(), lon=select["Long"].mean())
+                    path_col, gap_col = st.columns(2)
+                    path_type = path_col.radio("Movement path", ["nearest predecessor", "date order"], horizontal=True)
+                    max_gap = gap_col.slider("Maximum gap to a predecessor (years)", 500, 20000, dispersal.MAX_GAP, step=500)
+                    predecessor = None
+                    if path_type == "nearest predecessor":   #links each sample to the nearest older sample in space and time
+                        with profiler.span("movement_links", rows=len(animate_data)):
+                            links = get_movement_links(shared.version, mode, animate_select, max_gap, animate_data)
+                        predecessor = links["predecessor"].to_numpy()
+                        if links["speed_km_per_year"].notna().any():
+                            st.caption("Median implied dispersal speed: {:.2f} km/year over {} links".format(
+                                links["speed_km_per_year"].median(), links["speed_km_per_year"].notna().sum()))
+                    fig3 = prerendered(render.figure_name("movement", mode, selection=option, animate=animate_select, map_type=map_type,
+                                                          max_frames=max_frames, sampling=sampling, path=path_type, max_gap=max_gap),
+                                       lambda: figures.movement_figure(animate_data, map_type, center, max_frames, sampling, predecessor)) #animated map, built from arrays once
+                    plotly_chart(f"{mode}/movement", fig3)   #plotting the figure
+                    fig4 = prerendered(render.figure_name("prs_time", mode, selection=option),
+                                       lambda: figures.prs_time_figure(select, x='Age', y='PRS_SCZ', color='Region', period_bands=False,
+                                                                       trajectory=get_trajectory(shared.version, (mode, tuple(option)), 'Age', trajectory.WINDOW, "mean", select)))
                     
-                    st.plotly_chart(fig4)
+                    plotly_chart(f"{mode}/prs_time", fig4)
                     st.success("The maps have been plotted successfully",icon="✅") #printing the success message
-            except Exception as e:  #exception handling
-                    st.error("An error occurred: {}".format(e)) #printing the error message
-
-
-
-        def Onlyfemale_mtdna():        #Creating various functions to plot the data based on the user mode of selection
-            mtgeo=data.loc[data["Sex"]=="F"]
-            common_code(mtgeo)#calling the common code function to plot the data
-
-        def Onlymale_mtdna():
-            mtgeo=data.loc[data["Sex"]=="M"]
-            common_code(mtgeo)
+                except Exception as e:  #exception handling
+                        st.error("An error occurred: {}".format(e)) #printing the error message
+
+            #Creating the main function for the app    
+            @profiler.trace()
+            def common_code(mtgeo, mode):     
+                try:
+                    # 
+                    fig00 = prerendered(render.figure_name("violin", mode), lambda: figures.violin_figure(mtgeo))
+                    plotly_chart(f"{mode}/violin", fig00)
+
+
+                    # Get the top 20 most frequent clades of the mode, rolled up from the aggregate cube counts
+                    with profiler.span("clade_trie"):
+                        clades = get_clade_trie(shared.version, mode, mtgeo)
+                    depth = st.slider("Clade depth", 1, max(clades.max_depth, 2), min(haplogroups.DEFAULT_DEPTH, clades.max_depth))
+                    for color in ("Region", "Period"):
+                        fig01 = prerendered(render.figure_name("top", mode, color=color, depth=depth),
+                                            lambda: figures.top_clades_figure(clades.top(aggregates.counts(['mtdna', color], mode), depth, 20), color))
+                        plotly_chart(f"{mode}/top", fig01)
+                    #creating a sidebar to select the haplogroups; a clade selects all its descendants
+                    option=st.multiselect(label="Select the haplogroup",options=clades.nodes(depth),
+                                          format_func=lambda clade: f"{clade} ({clades.count(clade)})")
+                    if not option:#if no haplogroup is selected
+                        st.error("Please select atleast one haplogroup")
+                    else:  #    if haplogroup is selected
+                        selection_maps(mtgeo, mode, clades, option)   #the maps rerun alone when their own widgets change
+                except Exception as e:  #exception handling
+                        st.error("An error occurred: {}".format(e)) #printing the error message
+
+
+
+            def Onlyfemale_mtdna():        #Creating various functions to plot the data based on the user mode of selection
+                with profiler.span("view"):
+                    mtgeo=shared.view("MtDNA-Female")
+                common_code(mtgeo, "MtDNA-Female")#calling the common code function to plot the data
+
+            def Onlymale_mtdna():
+                with profiler.span("view"):
+                    mtgeo=shared.view("MtDNA-Male")
+                common_code(mtgeo, "MtDNA-Male")
             
-        def Combined_mtdna():
-            mtgeo=data
-            common_code(mtgeo)
+            def Combined_mtdna():
+                with profiler.span("view"):
+                    mtgeo=shared.view("MtDNA")
+                common_code(mtgeo, "MtDNA")
             
-        def Onlymale_ychrom():
-            mtgeo=data.loc[data["Sex"]=="M"]
-            common_code(mtgeo)
-    with col2:
-        haplogroup_select=st.selectbox("Select a mode",options=["MtDNA","MtDNA-Male","MtDNA-Female","Y-Chromosome"]) #selecting the mode of selection
-    if not haplogroup_select:       #exception handling
-        st.error("Please select one category")  #printing the error message
-    elif haplogroup_select=="MtDNA":    #if the user selects the mtdna mode
-        Combined_mtdna()    #calling the Combined_mtdna function
-    elif haplogroup_select=="MtDNA-Male":   #if the user selects the mtdna-male mode
-        Onlymale_mtdna() #calling the Onlymale_mtdna function
-    elif haplogroup_select=="MtDNA-Female": #If the user selects the mtdna-female mode
-        Onlyfemale_mtdna() #calling the Onlyfemale_mtdna function
-    elif haplogroup_select=="Y-Chromosome": #If the user selects the y-chrom mode
-        Onlymale_ychrom()   #calling the Onlymale_ychrom function
+            def Onlymale_ychrom():
+                with profiler.span("view"):
+                    mtgeo=shared.view("Y-Chromosome")
+                common_code(mtgeo, "Y-Chromosome")
+        with col2:
+            haplogroup_select=st.selectbox("Select a mode",options=["MtDNA","MtDNA-Male","MtDNA-Female","Y-Chromosome"]) #selecting the mode of selection
+        if not haplogroup_select:       #exception handling
+            st.error("Please select one category")  #printing the error message
+        elif haplogroup_select=="MtDNA":    #if the user selects the mtdna mode
+            Combined_mtdna()    #calling the Combined_mtdna function
+        elif haplogroup_select=="MtDNA-Male":   #if the user selects the mtdna-male mode
+            Onlymale_mtdna() #calling the Onlymale_mtdna function
+        elif haplogroup_select=="MtDNA-Female": #If the user selects the mtdna-female mode
+            Onlyfemale_mtdna() #calling the Onlyfemale_mtdna function
+        elif haplogroup_select=="Y-Chromosome": #If the user selects the y-chrom mode
+            Onlymale_ychrom()   #calling the Onlymale_ychrom function
+    haplotracker_tab()
+
+
+#Closing the rerun; the panel is a fragment so the spans of later fragment reruns can be refreshed
+figure_stats = get_figure_cache()
+profiler.end_rerun(figure_cache_hits=figure_stats.hits, figure_cache_misses=figure_stats.misses,
+                   figure_cache_entries=len(figure_stats), figure_cache_bytes=figure_stats.size)
+
+@st.fragment
+def performance_panel():
+    st.caption(f"Shared figure cache: {figure_stats.hits} hits, {figure_stats.misses} misses, "
+               f"{len(figure_stats)} figures, {figure_stats.size / 1024 ** 2:.1f} MB")
+    reruns = st.number_input("Reruns shown", min_value=1, max_value=50, value=3)
+    st.button("Refresh")
+    st.dataframe(profiler.table(reruns), hide_index=True)
+    if profiler.log_path is not None:
+        st.caption(f"Spans are appended to {profiler.log_path}")
+
+if profiler.enabled:
+    with st.sidebar:
+        st.subheader("Rerun profile")
+        performance_panel()
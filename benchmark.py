@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark suite of the dashboard hot paths.
+
+Description: Times, on synthetic AADR-like tables (synthetic.py) of each requested size, the
+stages a rerun of app.py goes through: the ingest pipeline (CSV parse, cold and warm cache
+load), the filter_dataframe engine (index build, category, range and text filters), the EDA
+aggregates and charts, the pairwise test plots that replaced tap.plot_stats (cold, without the
+disk cache), and the common_code charts of the MtDNA mode (violin, top clades, clustered map,
+movement links and animation frames, PRS over time), with the JSON size of every figure.
+Each stage reports the median of --repeat runs. Results are written as JSON under
+Data/benchmarks/ and compared with the previous result (or --baseline), flagging the stages
+that got slower than --threshold.
+
+User Defined Functions:
+    run(sizes, repeat): Returns the benchmark results of every size.
+    compare(results, baseline, threshold): Returns the stages slower than the baseline.
+
+Usage:
+    python benchmark.py --rows 10000 100000 1000000 --repeat 3
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import plotly.graph_objects as go
+
+import cube
+import dataset
+import dispersal
+import figures
+import filters
+import haplogroups
+import spatial
+import stats_cache
+import synthetic
+import trajectory
+
+SIZES = [10000, 100000]
+RESULTS_DIR = Path("Data/benchmarks")
+DATA_DIR = dataset.CACHE_DIR / "synthetic"
+# Stages slower than baseline * THRESHOLD are reported as regressions
+THRESHOLD = 1.2
+# Stages faster than this are too noisy to compare
+MIN_SECONDS = 0.005
+
+
+def _measure(stage: dict, name: str, fn, repeat: int):
+    """Times fn over repeat runs, stores the median (and the figure size) and returns the last result."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    stage[name] = {"seconds": round(statistics.median(seconds), 6)}
+    if isinstance(result, go.Figure):
+        stage[name]["bytes"] = len(result.to_json())
+    return result
+
+
+def bench_size(n: int, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Runs every stage on a synthetic table of n rows
+
+    Returns:
+        dict: stage name -> seconds (median) and, for figures, bytes of the JSON
+    """
+    source = DATA_DIR / f"synthetic_{n}_{seed}.csv"
+    if not source.exists():
+        synthetic.write(n, source, seed)
+    stage = {}
+
+    # Ingest
+    _measure(stage, "ingest.build", lambda: dataset.build_dataset(source), repeat)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = lambda: dataset.load_dataset(source, Path(cache_dir) / str(time.perf_counter_ns()))
+        _measure(stage, "ingest.cold_load", cold, repeat)
+        dataset.load_dataset(source, cache_dir)
+        shared = _measure(stage, "ingest.warm_load",
+                          lambda: dataset.load_shared_dataset(source, cache_dir), repeat)
+    data = shared.frame
+
+    # filter_dataframe (each filter on a fresh engine, so it includes building its column index)
+    engine = _measure(stage, "filter.engine", lambda: filters.FilterEngine(data), repeat)
+    _measure(stage, "filter.category", lambda: filters.FilterEngine(data).category_mask("Region", ["Europa", "Ásia"]), repeat)
+    low, high = data["PRS_SCZ"].quantile([0.25, 0.75])
+    _measure(stage, "filter.range", lambda: filters.FilterEngine(data).range_mask("PRS_SCZ", low, high), repeat)
+    _measure(stage, "filter.text", lambda: filters.FilterEngine(data).text_mask("mtdna", "H1a"), repeat)
+    _measure(stage, "filter.apply", lambda: engine.apply([engine.category_mask("Region", ["Europa"]),
+                                                          engine.range_mask("PRS_SCZ", low, high)]), repeat)
+
+    # EDA tab
+    aggregates = _measure(stage, "eda.cube", lambda: cube.AggregateCube(data), repeat)
+    _measure(stage, "eda.heatmap", lambda: figures.region_period_heatmap(aggregates), repeat)
+    _measure(stage, "eda.period_bar", lambda: figures.period_region_bar(aggregates), repeat)
+    _measure(stage, "eda.trajectory", lambda: trajectory.rolling_trajectory(data, x="Date"), repeat)
+    trend = trajectory.rolling_trajectory(data, x="Date")
+    _measure(stage, "eda.prs_time", lambda: figures.prs_time_figure(data, trajectory=trend), repeat)
+
+    # Pairwise tests (formerly tap.plot_stats), without the disk cache
+    _measure(stage, "stats.period_tests", lambda: stats_cache.plot_stats(
+        data, "Period", "PRS_SCZ", order=figures.periods, type_correction="bonferroni", type_test="dunn", cache_dir=None), repeat)
+    _measure(stage, "stats.region_tests", lambda: stats_cache.plot_stats(
+        data, "Region", "PRS_SCZ", order=figures.regions, type_correction="bonferroni", cache_dir=None), repeat)
+
+    # common_code of the MtDNA mode, with the most frequent top-level clade selected
+    view = _measure(stage, "haplo.view", lambda: dataset.SharedDataset(data, shared.version).view("MtDNA"), repeat)
+    _measure(stage, "haplo.violin", lambda: figures.violin_figure(view), repeat)
+    clades = _measure(stage, "haplo.trie", lambda: haplogroups.CladeTrie(view["mtdna"]), repeat)
+    counts = aggregates.counts(["mtdna", "Region"], "MtDNA")
+    _measure(stage, "haplo.top", lambda: figures.top_clades_figure(clades.top(counts, haplogroups.DEFAULT_DEPTH, 20), "Region"), repeat)
+    clade = max(clades.children(), key=clades.count)
+    positions = _measure(stage, "haplo.select", lambda: clades.positions([clade]), repeat)
+    index = _measure(stage, "haplo.spatial_index", lambda: spatial.SpatialIndex(view), repeat)
+    zoom = index.auto_zoom(positions)
+    _measure(stage, "haplo.map", lambda: figures.cluster_map(index.clusters(positions, zoom), "USGS"), repeat)
+    animate = view.iloc[positions].sort_values(by="Age", ascending=False)
+    links = _measure(stage, "haplo.links", lambda: dispersal.movement_links(animate), repeat)
+    center = dict(lat=animate["Lat"].mean(), lon=animate["Long"].mean())
+    predecessor = links["predecessor"].to_numpy()
+    _measure(stage, "haplo.movement", lambda: figures.movement_figure(animate, "USGS", center, predecessor=predecessor), repeat)
+    steps = figures.frame_steps(len(animate))
+    _measure(stage, "haplo.frames", lambda: figures.movement_frames(animate["Lat"], animate["Long"], animate["mtdna"], steps), repeat)
+    select_trend = trajectory.rolling_trajectory(animate, x="Age")
+    _measure(stage, "haplo.prs_time", lambda: figures.prs_time_figure(animate, x="Age", period_bands=False,
+                                                                       trajectory=select_trend), repeat)
+    return stage
+
+
+def run(sizes: list = SIZES, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Runs the suite on every size
+
+    Returns:
+        dict: Environment and, per size, the stage timings
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "sizes": {},
+    }
+    for n in sizes:
+        print(f"{n} rows...", file=sys.stderr)
+        results["sizes"][str(n)] = bench_size(n, repeat, seed)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """
+    Returns the stages slower than threshold times the baseline
+
+    Returns:
+        list: (size, stage, baseline seconds, seconds) of each regression
+    """
+    regressions = []
+    for size, stages in results["sizes"].items():
+        for name, current in stages.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(name)
+            if previous is None or max(previous["seconds"], current["seconds"]) < MIN_SECONDS:
+                continue
+            if current["seconds"] > previous["seconds"] * threshold:
+                regressions.append((size, name, previous["seconds"], current["seconds"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the dashboard hot paths on synthetic data")
+    parser.add_argument("--rows", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=None, help="results file to compare with (default: the latest one)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--out", default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    previous = sorted(out.glob("*.json"))
+    baseline = Path(args.baseline) if args.baseline else (previous[-1] if previous else None)
+    results = run(args.rows, args.repeat, args.seed)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.write_text(json.dumps(results, indent=1))
+
+    for size, stages in results["sizes"].items():
+        print(f"\n{size} rows")
+        for name, stage in stages.items():
+            size_text = f"{stage['bytes'] / 1024:10.1f} KB" if "bytes" in stage else ""
+            print(f"  {name:22s} {stage['seconds'] * 1000:10.1f} ms {size_text}")
+    print(f"\nResults written to {path}")
+    if baseline is not None:
+        regressions = compare(results, json.loads(baseline.read_text()), args.threshold)
+        for size, name, before, after in regressions:
+            print(f"Regression at {size} rows: {name} {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        print(f"{len(regressions)} regressions against {baseline}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Materialized aggregate cube behind the EDA and HaploTracker count charts.
+
+Description: The cube holds, for every observed (Sex, Region, Period, mtdna) cell, the number of
+samples and the count, sum and sum of squares of their PRS_SCZ. It is built once per dataset
+version; the crosstab, the histograms and the top haplogroups of each HaploTracker mode are
+then answered by aggregating the cells instead of scanning the samples. When a release is
+refreshed incrementally (delta.py), the cube is updated by subtracting the cells of the removed
+rows and adding those of the new rows, instead of being rebuilt.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+import dataset
+
+DIMENSIONS = ["Sex", "Region", "Period", "mtdna"]
+MEASURES = ["count", "n_prs", "sum_prs", "sumsq_prs"]
+
+
+def _cells(df: pd.DataFrame, value: str) -> pd.DataFrame:
+    """Returns the MEASURES of every observed DIMENSIONS cell of df."""
+    prs = df[value].astype("float64")
+    parts = pd.DataFrame({
+        "count": 1,
+        "n_prs": prs.notna().astype("int64"),
+        "sum_prs": prs.fillna(0.0),
+        "sumsq_prs": prs.fillna(0.0) ** 2,
+    })
+    keys = [df[col] for col in DIMENSIONS]
+    return parts.groupby(keys, observed=True, dropna=False).sum().reset_index()
+
+
+class AggregateCube:
+    """
+    Count/sum/sum-of-squares cube over Sex x Region x Period x mtdna
+
+    Attributes:
+        cells (pd.DataFrame): One row per observed cell, with DIMENSIONS and MEASURES columns
+    """
+
+    def __init__(self, df: pd.DataFrame, value: str = "PRS_SCZ", cells: pd.DataFrame = None):
+        self.cells = _cells(df, value) if cells is None else cells
+        self._value = value
+        self._modes = {}
+        self._lock = threading.Lock()
+
+    def updated(self, removed: pd.DataFrame, added: pd.DataFrame) -> "AggregateCube":
+        """
+        Returns the cube after removing some samples and adding others, without rescanning the dataset
+
+        Args:
+            removed (pd.DataFrame): Deleted samples and the old values of the updated ones
+            added (pd.DataFrame): Inserted samples and the new values of the updated ones
+
+        Returns:
+            AggregateCube: Cube of the refreshed dataset
+        """
+        negative = _cells(removed, self._value)
+        negative[MEASURES] = -negative[MEASURES]
+        changes = pd.concat([negative, _cells(added, self._value)]).astype({col: object for col in DIMENSIONS})
+        changes = changes.groupby(DIMENSIONS, observed=True, dropna=False)[MEASURES].sum()
+        # Only the touched cells are combined; the others are kept as they are
+        cells = self.cells.astype({col: object for col in DIMENSIONS}).set_index(DIMENSIONS)
+        touched = cells.index.isin(changes.index)
+        merged = pd.concat([cells[touched], changes]).groupby(level=DIMENSIONS, dropna=False).sum()
+        merged = merged[merged["count"] > 0]
+        cells = pd.concat([cells[~touched], merged]).reset_index()
+        return AggregateCube(None, self._value, cells)
+
+    def mode_cells(self, mode: str = None) -> pd.DataFrame:
+        """Returns the cells of a HaploTracker mode (see dataset.MODES), summed over Sex."""
+        if mode not in self._modes:
+            with self._lock:
+                if mode not in self._modes:
+                    sex = dataset.MODES.get(mode)
+                    cells = self.cells if sex is None else self.cells[self.cells["Sex"] == sex]
+                    self._modes[mode] = (cells.groupby(DIMENSIONS[1:], observed=True, dropna=False)[MEASURES]
+                                         .sum().reset_index())
+        return self._modes[mode]
+
+    def counts(self, by: list, mode: str = None, where: dict = None) -> pd.DataFrame:
+        """
+        Returns the number of samples per combination of the given dimensions
+
+        Args:
+            by (list): Dimensions to group by (subset of Region, Period, mtdna)
+            mode (str): HaploTracker mode, None for every sample
+            where (dict): Dimension -> allowed values, applied before grouping
+
+        Returns:
+            pd.DataFrame: by columns plus a count column
+        """
+        cells = self.mode_cells(mode)
+        for col, values in (where or {}).items():
+            cells = cells[cells[col].isin(values)]
+        grouped = cells.groupby(by, observed=True, dropna=False)["count"].sum().reset_index()
+        return grouped[grouped["count"] > 0]
+
+    def crosstab(self, index: str, columns: str, mode: str = None) -> pd.DataFrame:
+        """Returns the same table as pd.crosstab(df[index], df[columns]) on the samples of a mode."""
+        counts = self.counts([index, columns], mode)
+        return counts.pivot_table(index=index, columns=columns, values="count",
+                                  aggfunc="sum", fill_value=0, observed=True)
+
+    def top(self, column: str, n: int, mode: str = None) -> pd.Index:
+        """Returns the n most frequent values of a dimension (like value_counts().nlargest(n))."""
+        counts = self.counts([column], mode).set_index(column)["count"]
+        return counts.nlargest(n).index
+
+    def summary(self, by: list, mode: str = None) -> pd.DataFrame:
+        """Returns n, mean and standard deviation of PRS_SCZ per combination of the dimensions."""
+        sums = self.mode_cells(mode).groupby(by, observed=True, dropna=False)[MEASURES].sum()
+        sums = sums[sums["n_prs"] > 0]
+        n = sums["n_prs"]
+        mean = sums["sum_prs"] / n
+        var = (sums["sumsq_prs"] - n * mean ** 2) / (n - 1).where(n > 1)
+        return pd.DataFrame({"n": n, "mean": mean, "std": np.sqrt(var.clip(lower=0))}).reset_index()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loading of the ancient DNA dataset used by the dashboard.
+
+Description: This module runs the ingest pipeline that used to live at the top of app.py
+(reading Data/data_pca.csv, selecting and renaming the columns, backfilling the regions and
+casting the coordinates) and keeps the result in a typed columnar cache (Parquet).
+The cache is only rebuilt when the source file changes, so a Streamlit rerun reads the
+prepared table instead of parsing the CSV again.
+The source can also be a raw AADR annotation release (.anno), which is streamed in chunks
+reading only the columns used by the app. A scores csv (Data/prs_scz.csv written by prs.py,
+or ADNA_SCORES) replaces the PRS of the samples it scores by Genetic ID; the other samples keep
+the PRS of the source csv (a .anno release has none, so they are NaN). The cache is keyed by
+its signature too.
+When a new release replaces the source, load_dataset(incremental=True) diffs it against the
+cached table by Genetic ID and only prepares the inserted and updated rows (delta.py); the
+delta is kept next to the cache so the derived structures can be updated instead of rebuilt.
+
+User Defined Functions:
+    load_dataset(source): Returns the prepared dataframe, reading it from the cache when it is valid.
+    load_shared_dataset(source): Returns the read-only SharedDataset used by every Streamlit session.
+    build_dataset(source): Runs the full ingest pipeline on the source file.
+    read_anno(source): Streams the used columns of an AADR .anno file with the short names.
+    source_signature(source): Returns the cheap (mtime, size) signature of the source file.
+
+Usage:
+    python dataset.py v62.0_1240k_public.anno --scores Data/data_pca.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+DATA_PATH = Path(os.environ.get("ADNA_DATA", "Data/data_pca.csv"))
+# Csv with the PRS of each Genetic ID written by prs.py, replacing the PRS of the source
+SCORES_PATH = Path("Data/prs_scz.csv")
+CACHE_DIR = Path("Data/.cache")
+# Bump when the pipeline below changes so old caches are discarded
+SCHEMA_VERSION = 2
+
+# Source column -> short name used by the app, in display order
+COLUMNS = {
+    "Genetic ID": "Genetic ID",
+    "Molecular Sex": "Sex",
+    "Lat.": "Lat",
+    "Long.": "Long",
+    "Continente": "Region",
+    "mtDNA haplogroup if >2x or published": "mtdna",
+    "Date mean in BP in years before 1950 CE [OxCal mu for a direct radiocarbon date, and average of range for a contextual date]": "Date",
+    "Political Entity": "Country",
+    "PRS_20PCs": "PRS_SCZ",
+    "Período Histórico": "Period",
+}
+# Columns that may be missing from older extracts
+OPTIONAL_COLUMNS = {"Genetic ID"}
+
+# Header prefix in the AADR annotation file -> short name. The full headers change between
+# releases (e.g. the Genetic ID header lists the suffix conventions), so they are matched by prefix.
+ANNO_COLUMNS = {
+    "Genetic ID": "Genetic ID",
+    "Molecular Sex": "Sex",
+    "Lat.": "Lat",
+    "Long.": "Long",
+    "mtDNA haplogroup": "mtdna",
+    "Date mean in BP": "Date",
+    "Political Entity": "Country",
+}
+ANNO_CHUNK_SIZE = 20000
+
+# Lower bound of each period in years BP, oldest first (same bands as the EDA plots)
+PERIOD_BINS = [(13000, 'Paleolítico'), (8000, 'Mesolítico'), (4000, 'Neolítico'), (0, 'Pós-Neolítico')]
+
+# HaploTracker mode -> molecular sex kept in its view (None keeps every sample)
+MODES = {"MtDNA": None, "MtDNA-Male": "M", "MtDNA-Female": "F", "Y-Chromosome": "M"}
+# Years between 1950 (the BP reference) and 2020, used for the "years ago" of the maps
+AGE_OFFSET = 70
+
+CATEGORICAL_COLUMNS = ["Region", "Period", "Country", "Sex", "mtdna"]
+FLOAT32_COLUMNS = ["Lat", "Long", "PRS_SCZ"]
+
+mapa_paises_continentes = {
+    'Nigeria': 'África', 'USA': 'América', 'Russia': 'Ásia', 'Puerto Rico': 'América', 'Spain': 'Europa',
+    'United Kingdom': 'Europa', 'India': 'Ásia', 'Sri Lanka': 'Ásia', 'Turkmenistan': 'Ásia', 'Uzbekistan': 'Ásia',
+    'Pakistan': 'Ásia', 'China': 'Ásia', 'Tajikistan': 'Ásia', 'Kazakhstan': 'Ásia', 'Kyrgyzstan': 'Ásia',
+    'Peru': 'América', 'Mexico': 'América', 'Bahamas': 'América', 'Finland': 'Europa', 'Venezuela': 'América',
+    'Canada': 'América', 'Iceland': 'Europa', 'Greenland': 'América', 'Nepal': 'Ásia', 'Norway': 'Europa',
+    'Cuba': 'América', 'Haiti': 'América', 'Belize': 'América', 'Dominican Republic': 'América', 'Jordan': 'Ásia',
+    'France': 'Europa', 'Chile': 'América', 'Ireland': 'Europa', 'Argentina': 'América', 'Morocco': 'África',
+    'Hungary': 'Europa', 'Guadeloupe': 'América', 'Tonga': 'Oceania', 'French Polynesia': 'Oceania', 'Sudan': 'África'
+}
+
+
+def source_signature(source=DATA_PATH) -> tuple:
+    """
+    Returns a cheap signature of the source file, used to detect changes without hashing it
+
+    Args:
+        source (str | Path): Path of the source file
+
+    Returns:
+        tuple: (mtime in ns, size in bytes)
+    """
+    stat = os.stat(source)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_hash(source, chunk_size: int = 1 << 20) -> str:
+    """Returns the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(source, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def backfill_regions(df: pd.DataFrame) -> pd.DataFrame:
+    """Fills the 'Indeterminado' regions from the country of the sample (in place)."""
+    undetermined = df["Region"] == "Indeterminado"
+    mapped = df["Country"].map(mapa_paises_continentes)
+    fill = undetermined & mapped.notna()
+    df.loc[fill, "Region"] = mapped[fill]
+    return df
+
+
+def assign_periods(dates: pd.Series) -> pd.Series:
+    """Returns the historical period of each date (years BP) using PERIOD_BINS."""
+    period = pd.Series(PERIOD_BINS[-1][1], index=dates.index, dtype=object)
+    for start, name in reversed(PERIOD_BINS[:-1]):
+        period[dates >= start] = name
+    return period
+
+
+def clean_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cleans a frame (or chunk) that already uses the short column names
+
+    Drops the samples without coordinates, casts the numeric columns and normalizes the
+    missing haplogroups.
+    """
+    df = df[df["Lat"].astype(str) != ".."].copy() #dropping the rows with missing values
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col]).astype("float32")
+    df["mtdna"] = df["mtdna"].astype(object).str.replace('n/a (<2x)', "..", regex=False)
+    return df
+
+
+def finalize_dataset(df: pd.DataFrame, cleaned: bool = False) -> pd.DataFrame:
+    """Cleans the frame (unless already done) and stores the text columns as categoricals."""
+    if not cleaned:
+        df = clean_frame(df)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df.reset_index(drop=True)
+
+
+def anno_columns(source) -> dict:
+    """
+    Resolves the full headers of an AADR annotation file
+
+    Args:
+        source (str | Path): Path of the .anno file
+
+    Returns:
+        dict: Full header -> short name, for the columns used by the app
+    """
+    header = pd.read_csv(source, sep="\t", nrows=0).columns
+    resolved = {}
+    for prefix, short in ANNO_COLUMNS.items():
+        match = next((col for col in header if col.strip().startswith(prefix)), None)
+        if match is None:
+            raise ValueError(f"Column starting with '{prefix}' not found in {source}")
+        resolved[match] = short
+    return resolved
+
+
+def read_anno(source, chunksize: int = ANNO_CHUNK_SIZE):
+    """
+    Streams an AADR annotation file, yielding cleaned chunks with the short column names
+
+    Only the columns listed in ANNO_COLUMNS are parsed. Each chunk gets its Region from the
+    country mapping and its Period from the date, since the release has neither.
+
+    Args:
+        source (str | Path): Path of the .anno file
+        chunksize (int): Number of rows parsed at a time
+
+    Yields:
+        pd.DataFrame: Cleaned chunk
+    """
+    columns = anno_columns(source)
+    reader = pd.read_csv(source, sep="\t", usecols=list(columns), dtype=str,
+                         chunksize=chunksize, na_values=[""], keep_default_na=False)
+    for chunk in reader:
+        chunk = chunk.rename(columns=columns)
+        chunk["Date"] = pd.to_numeric(chunk["Date"])
+        chunk["Region"] = chunk["Country"].map(mapa_paises_continentes).fillna("Indeterminado")
+        chunk["Period"] = assign_periods(chunk["Date"])
+        yield clean_frame(chunk)
+
+
+def scores_path():
+    """Returns the scores csv used by default: ADNA_SCORES, else SCORES_PATH when prs.py has written it."""
+    if os.environ.get("ADNA_SCORES"):
+        return Path(os.environ["ADNA_SCORES"])
+    return SCORES_PATH if SCORES_PATH.exists() else None
+
+
+def read_scores(scores) -> pd.Series:
+    """Reads the PRS of each sample (Genetic ID -> PRS_SCZ) from a csv with a PRS_20PCs or PRS_SCZ column."""
+    header = pd.read_csv(scores, nrows=0).columns
+    prs = "PRS_20PCs" if "PRS_20PCs" in header else "PRS_SCZ"
+    table = pd.read_csv(scores, usecols=["Genetic ID", prs])
+    return table.drop_duplicates("Genetic ID").set_index("Genetic ID")[prs].astype("float32")
+
+
+def build_anno_dataset(source, scores=None, chunksize: int = ANNO_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Runs the ingest pipeline on a raw AADR annotation release
+
+    Args:
+        source (str | Path): Path of the .anno file
+        scores (str | Path): Optional csv with the PRS of each Genetic ID (NaN for the samples it does not score)
+        chunksize (int): Number of rows parsed at a time
+
+    Returns:
+        pd.DataFrame: Prepared dataframe with the short column names
+    """
+    df = pd.concat(read_anno(source, chunksize), ignore_index=True)
+    if scores is not None:
+        df["PRS_SCZ"] = df["Genetic ID"].map(read_scores(scores))
+    else:
+        df["PRS_SCZ"] = pd.Series(float("nan"), index=df.index, dtype="float32")
+    df = df[list(COLUMNS.values())]
+    return finalize_dataset(df, cleaned=True)
+
+
+def build_dataset(source=DATA_PATH, scores=None, backfill: bool = True) -> pd.DataFrame:
+    """
+    Runs the ingest pipeline on the extracted CSV, or on an AADR release for .anno files
+
+    Args:
+        source (str | Path): Path of the csv or .anno file
+        scores (str | Path): Optional csv with the PRS of each Genetic ID, replacing the PRS_20PCs
+        of the samples it scores
+        backfill (bool): Fills the undetermined regions of the csv from the countries
+
+    Returns:
+        pd.DataFrame: Prepared dataframe with the short column names
+    """
+    if Path(source).suffix == ".anno":
+        return build_anno_dataset(source, scores)
+    header = pd.read_csv(source, sep=",", nrows=0).columns
+    usecols = [col for col in COLUMNS if col in header or col not in OPTIONAL_COLUMNS]
+    df = pd.read_csv(source, sep=",", usecols=usecols, dtype={"Lat.": str})
+    df = df[usecols].rename(columns=COLUMNS)
+    if scores is not None:
+        # Samples missing from the scores keep their PRS_20PCs
+        df["PRS_SCZ"] = df["Genetic ID"].map(read_scores(scores)).fillna(df["PRS_SCZ"])
+    if backfill:
+        backfill_regions(df)
+    return finalize_dataset(df)
+
+
+def _cache_paths(source, cache_dir):
+    stem = Path(source).name
+    cache_dir = Path(cache_dir)
+    return cache_dir / f"{stem}.parquet", cache_dir / f"{stem}.json"
+
+
+def version_of(meta: dict) -> str:
+    """Returns the dataset version recorded in the metadata of a cache."""
+    version = meta["sha256"][:16]
+    if meta.get("scores"):
+        version += "-%d-%d" % tuple(meta["scores"])
+    return version
+
+
+def load_dataset(source=DATA_PATH, cache_dir=CACHE_DIR, scores=None, incremental: bool = False) -> pd.DataFrame:
+    """
+    Returns the prepared dataset, using the Parquet cache when it is still valid
+
+    The cache is valid while the source keeps the same mtime and size. When those change,
+    the file is hashed and the cache is only rebuilt if the content actually changed.
+
+    Args:
+        source (str | Path): Path of the source file (csv extract or AADR .anno)
+        cache_dir (str | Path): Directory holding the Parquet cache
+        scores (str | Path): Optional csv with the PRS of each Genetic ID (see build_dataset)
+        incremental (bool): When the source changed, applies its differences with the cached
+        table (see delta.refresh) instead of preparing every row again
+
+    Returns:
+        pd.DataFrame: Prepared dataframe
+    """
+    table_path, meta_path = _cache_paths(source, cache_dir)
+    mtime_ns, size = source_signature(source)
+    scores_signature = list(source_signature(scores)) if scores is not None else None
+    digest = None
+    base = None
+    if table_path.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        if meta.get("schema") == SCHEMA_VERSION and meta.get("scores") == scores_signature:
+            if (meta.get("mtime_ns"), meta.get("size")) == (mtime_ns, size):
+                return pd.read_parquet(table_path)
+            digest = file_hash(source)
+            if meta.get("sha256") == digest:
+                # Touched but unchanged: refresh the signature only
+                meta.update(mtime_ns=mtime_ns, size=size)
+                meta_path.write_text(json.dumps(meta))
+                return pd.read_parquet(table_path)
+            base = meta
+
+    import delta   # delta builds on this module
+    change = None
+    if incremental and base is not None:
+        try:
+            df, change = delta.refresh(pd.read_parquet(table_path), build_dataset(source, scores, backfill=False),
+                                       version_of(base))
+        except ValueError:
+            change = None   # e.g. duplicated Genetic IDs: full rebuild
+    if change is None:
+        df = build_dataset(source, scores)
+    table_path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(table_path, index=False)
+    meta = {
+        "schema": SCHEMA_VERSION,
+        "source": str(source),
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "sha256": digest or file_hash(source),
+        "scores": scores_signature,
+    }
+    if change is not None:
+        meta["delta"] = change.save(table_path)
+    else:
+        delta.discard(table_path)
+    meta_path.write_text(json.dumps(meta))
+    return df
+
+
+class SharedDataset:
+    """
+    Read-only dataset shared by every session of the app
+
+    The frame and the per-mode views are built once per process. They must never be
+    modified in place; with pandas copy-on-write enabled, any change made on a view or on
+    a slice of it only copies the touched columns.
+
+    Attributes:
+        frame (pd.DataFrame): Prepared dataset, as returned by load_dataset
+        version (str): Fingerprint of the source, used to key the derived caches
+        delta (delta.Delta): Changes from the previous version when it was refreshed incrementally
+    """
+
+    def __init__(self, frame: pd.DataFrame, version: str, delta=None):
+        self.frame = frame
+        self.version = version
+        self.delta = delta
+        self._views = {}
+        self._lock = threading.Lock()
+        # Derived columns are computed once for the whole table and shared by the views
+        age = frame["Date"] + AGE_OFFSET
+        self._derived = pd.DataFrame({
+            "Age": age,
+            "hover": frame["Country"].astype(object).str.cat('\t' + age.astype(str) + ' years ago'),
+        }, index=frame.index)
+
+    def view(self, mode: str) -> pd.DataFrame:
+        """
+        Returns the samples of a HaploTracker mode, with the derived Age and hover columns
+
+        Args:
+            mode (str): One of the MODES keys
+
+        Returns:
+            pd.DataFrame: View of the mode (shared, do not modify in place)
+        """
+        if mode not in self._views:
+            with self._lock:
+                if mode not in self._views:
+                    self._views[mode] = self._build_view(MODES[mode])
+        return self._views[mode]
+
+    def _build_view(self, sex) -> pd.DataFrame:
+        view = pd.concat([self.frame, self._derived], axis=1)
+        if sex is not None:
+            view = view.loc[self.frame["Sex"] == sex]
+        return view
+
+
+def load_shared_dataset(source=DATA_PATH, cache_dir=CACHE_DIR, scores=None, incremental: bool = False) -> SharedDataset:
+    """
+    Loads the dataset (see load_dataset) and wraps it in a SharedDataset
+
+    Returns:
+        SharedDataset: Dataset versioned by the sha256 of its source, with the delta from the
+        previous version when the cache was refreshed incrementally
+    """
+    frame = load_dataset(source, cache_dir, scores, incremental)
+    table_path, meta_path = _cache_paths(source, cache_dir)
+    meta = json.loads(meta_path.read_text())
+    change = None
+    if meta.get("delta"):
+        import delta
+        change = delta.Delta.load(table_path, meta["delta"])
+    return SharedDataset(frame, version_of(meta), change)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the cached dataset from a csv extract or an AADR .anno release")
+    parser.add_argument("source", nargs="?", default=DATA_PATH)
+    parser.add_argument("--scores", default=scores_path(),
+                        help="csv with the PRS of each Genetic ID; unscored samples keep the PRS of the source csv")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--incremental", action="store_true", help="apply the changes of a new release to the cache")
+    args = parser.parse_args()
+    df = load_dataset(args.source, args.cache_dir, args.scores, args.incremental)
+    print(f"{len(df)} samples cached from {args.source}")
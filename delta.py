@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental refresh of the cached dataset when a new AADR release lands.
+
+Description: New releases mostly append samples or correct a minority of them. Instead of
+preparing the whole table again and rebuilding every derived structure, refresh diffs the
+parsed release against the cached table by Genetic ID: samples missing from the release are
+deleted, new ones are inserted and the ones with any changed column are updated. Only the
+inserted and updated rows go through the region backfill; the other rows are kept as they are,
+in their cached order, with the inserted rows appended at the end. The resulting Delta records
+which rows changed and maps every row of the new table to its unchanged row of the previous
+one, so the structures built on the previous version (the aggregate cube with its region,
+period and haplogroup counts, and the spatial indexes of the modes) are updated from the changed
+rows only (AggregateCube.updated, SpatialIndex.updated). The delta is saved next to the
+cache; DerivedCache keeps the latest version of each structure and applies it when the app
+loads the refreshed dataset.
+
+User Defined Functions:
+    refresh(base, release, base_version): Returns the refreshed table and the delta from base.
+    DerivedCache.get(name, shared, build, update): Returns a derived structure of the current version.
+
+Usage:
+    python dataset.py Data/data_pca.csv --incremental
+"""
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import dataset
+
+KEY = "Genetic ID"
+
+
+class Delta:
+    """
+    Changes between two versions of the prepared dataset
+
+    Attributes:
+        base_version (str): Version of the dataset the delta applies to
+        n_base (int): Number of rows of the base table
+        source (np.ndarray): Row of the base table each row of the new table is unchanged from,
+        -1 for inserted and updated rows
+        added (np.ndarray): Rows of the new table that were inserted or updated
+        removed (pd.DataFrame): Deleted rows and the old values of the updated rows
+        counts (dict): Number of inserted, updated and deleted samples
+    """
+
+    def __init__(self, base_version: str, n_base: int, source: np.ndarray, added: np.ndarray,
+                 removed: pd.DataFrame, counts: dict):
+        self.base_version = base_version
+        self.n_base = n_base
+        self.source = source
+        self.added = added
+        self.removed = removed
+        self.counts = counts
+
+    def save(self, table_path) -> dict:
+        """Writes the delta next to a cached table and returns its summary for the cache metadata."""
+        arrays, rows = _delta_paths(table_path)
+        np.savez(arrays, source=self.source, added=self.added)
+        self.removed.to_parquet(rows, index=False)
+        return dict(self.counts, base_version=self.base_version, n_base=self.n_base)
+
+    @classmethod
+    def load(cls, table_path, meta: dict) -> "Delta":
+        """Reads the delta saved next to a cached table, given its summary in the cache metadata."""
+        arrays, rows = _delta_paths(table_path)
+        with np.load(arrays) as stored:
+            source, added = stored["source"], stored["added"]
+        counts = {name: meta[name] for name in ("inserted", "updated", "deleted")}
+        return cls(meta["base_version"], meta["n_base"], source, added, pd.read_parquet(rows), counts)
+
+
+def _delta_paths(table_path) -> tuple:
+    table_path = Path(table_path)
+    return table_path.with_suffix(".delta.npz"), table_path.with_suffix(".delta.parquet")
+
+
+def discard(table_path):
+    """Removes the delta saved next to a cached table, after a full rebuild."""
+    for path in _delta_paths(table_path):
+        path.unlink(missing_ok=True)
+
+
+def _same(old: pd.Series, new: pd.Series) -> np.ndarray:
+    """Returns where two aligned columns are equal, missing values being equal to each other."""
+    if pd.api.types.is_numeric_dtype(old) and pd.api.types.is_numeric_dtype(new):
+        a, b = old.to_numpy(dtype=float), new.to_numpy(dtype=float)
+        return (a == b) | (np.isnan(a) & np.isnan(b))
+    a, b = old.astype(object).to_numpy(), new.astype(object).to_numpy()
+    return (a == b) | (pd.isna(a) & pd.isna(b))
+
+
+def _backfilled_regions(rows: pd.DataFrame) -> pd.Series:
+    """Returns the regions of some rows after the backfill, mapping only their undetermined ones."""
+    region = rows["Region"].astype(object)
+    undetermined = region == "Indeterminado"
+    mapped = rows.loc[undetermined, "Country"].astype(object).map(dataset.mapa_paises_continentes)
+    region[mapped.dropna().index] = mapped.dropna()
+    return region
+
+
+def refresh(base: pd.DataFrame, release: pd.DataFrame, base_version: str) -> tuple:
+    """
+    Applies a new release to the cached table by Genetic ID
+
+    Args:
+        base (pd.DataFrame): Cached table (see dataset.load_dataset)
+        release (pd.DataFrame): Prepared release before the region backfill
+        (dataset.build_dataset with backfill=False)
+        base_version (str): Version of the cached table
+
+    Returns:
+        tuple: (refreshed table, Delta from base)
+
+    Raises:
+        ValueError: When the tables have no Genetic ID column or duplicated Genetic IDs
+    """
+    if KEY not in base or KEY not in release:
+        raise ValueError(f"Both tables need a {KEY} column")
+    base_ids, release_ids = base[KEY].astype(object), release[KEY].astype(object)
+    if base_ids.duplicated().any() or release_ids.duplicated().any():
+        raise ValueError(f"{KEY} is not unique")
+
+    matched = pd.Index(base_ids).get_indexer(release_ids)
+    common = np.flatnonzero(matched >= 0)
+    old = base.iloc[matched[common]].reset_index(drop=True)
+    new = release.iloc[common].reset_index(drop=True)
+    same = np.ones(len(common), dtype=bool)
+    for column in base.columns:
+        if column != "Region" and column in release:
+            same &= _same(old[column], new[column])
+    # The cache holds the backfilled regions; the release rows are compared after the same backfill
+    same &= _same(old["Region"], _backfilled_regions(new))
+
+    updated = common[~same]
+    inserted = np.flatnonzero(matched < 0)
+    kept = np.zeros(len(base), dtype=bool)
+    kept[matched[common]] = True
+    deleted = np.flatnonzero(~kept)
+    keep = np.flatnonzero(kept)
+    replaced = np.searchsorted(keep, matched[updated])
+
+    # Only the changed rows are backfilled and merged into the kept rows
+    changed = release.iloc[np.concatenate([updated, inserted])].reset_index(drop=True)
+    changed["Region"] = _backfilled_regions(changed)
+    frame = base.iloc[keep].reset_index(drop=True)
+    for column in dataset.CATEGORICAL_COLUMNS:
+        if column in frame:
+            categories = frame[column].cat.categories.union(pd.Index(changed[column].dropna().astype(object).unique()))
+            frame[column] = frame[column].cat.set_categories(categories)
+            changed[column] = pd.Categorical(changed[column].astype(object), categories=categories)
+    for column in frame.columns:
+        frame.loc[replaced, column] = changed[column].to_numpy()[:len(updated)]
+    frame = pd.concat([frame, changed.iloc[len(updated):]], ignore_index=True)
+    for column in dataset.CATEGORICAL_COLUMNS:
+        if column in frame:
+            frame[column] = frame[column].cat.remove_unused_categories()
+
+    source = np.concatenate([keep, np.full(len(inserted), -1, dtype=np.int64)])
+    source[replaced] = -1
+    added = np.concatenate([replaced, len(keep) + np.arange(len(inserted))])
+    removed = base.iloc[np.sort(np.concatenate([deleted, matched[updated]]))]
+    counts = {"inserted": len(inserted), "updated": len(updated), "deleted": len(deleted)}
+    return frame, Delta(base_version, len(base), source, added, removed.reset_index(drop=True), counts)
+
+
+class DerivedCache:
+    """
+    Latest version of each structure derived from the shared dataset
+
+    A structure is built once per dataset version. When the dataset was refreshed
+    incrementally from the version the cached structure was built on, the structure is
+    updated with the delta instead of being built again.
+    """
+
+    def __init__(self):
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, shared, build, update):
+        """
+        Returns a derived structure of the current dataset version
+
+        Args:
+            name (hashable): Name of the structure, e.g. ("spatial", mode)
+            shared (dataset.SharedDataset): Current dataset
+            build (callable): Returns the structure built from scratch
+            update (callable): update(previous structure, delta) returns the refreshed structure
+
+        Returns:
+            The structure of shared.version
+        """
+        with self._lock:
+            version, value = self._latest.get(name, (None, None))
+            if version == shared.version:
+                return value
+            change = shared.delta
+            if change is not None and version == change.base_version:
+                value = update(value, change)
+            else:
+                value = build()
+            self._latest[name] = (shared.version, value)
+            return value
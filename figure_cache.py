@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-memory LRU cache of serialized dashboard figures.
+
+Description: Each widget change reruns the app script, which used to rebuild every chart of the
+HaploTracker tab even for a mode and selection seen seconds earlier. FigureCache keeps the
+Plotly JSON of built figures under a key such as (dataset version, figure name), where the
+figure name (render.figure_name) carries the mode, the selected haplogroups, the map type, the
+animated haplogroup and the other widget values the figure depends on. The cache is bounded by
+the total size of the stored JSON and evicts the least recently used figures first. One
+instance is shared by all the sessions of the app, so popular selections are built once.
+Stored figures were produced by Plotly itself, so they are restored without validation, which
+is several times faster than pio.from_json.
+
+User Defined Functions:
+    from_payload(payload): Returns the figure of a serialized Plotly JSON.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def from_payload(payload: str) -> go.Figure:
+    """Returns the figure of a Plotly JSON written by fig.to_json(), without validating it again."""
+    return go.Figure(json.loads(payload), _validate=False)
+
+
+class FigureCache:
+    """
+    Byte-bounded LRU cache of figures stored as Plotly JSON
+
+    Attributes:
+        max_bytes (int): Maximum total size of the stored JSON
+        size (int): Current total size of the stored JSON
+        hits (int): Number of lookups served from the cache
+        misses (int): Number of lookups that built the figure
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the figure stored under key (marking it as recently used), or None."""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                return None
+            self._entries.move_to_end(key)
+        return from_payload(payload)
+
+    def put(self, key, fig):
+        """Stores a figure, evicting the least recently used ones beyond max_bytes."""
+        payload = fig.to_json()
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = payload
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_or_build(self, key, build):
+        """
+        Returns the figure stored under key, building and storing it when missing
+
+        Args:
+            key (hashable): Cache key, e.g. (dataset version, figure name)
+            build (callable): Returns the figure when it is not cached
+
+        Returns:
+            go.Figure: Cached or built figure
+        """
+        fig = self.get(key)
+        # The counters are shared by every session, like the entries
+        with self._lock:
+            if fig is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if fig is not None:
+            return fig
+        fig = build()
+        self.put(key, fig)
+        return fig
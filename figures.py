@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Figure builders shared by the EDA and HaploTracker tabs.
+
+Description: prs_time_figure draws PRS_SCZ over time with WebGL traces. Each colour group is
+downsampled with LTTB (largest triangle three buckets) to at most max_points points inside the
+visible date window, and drawn at full resolution once the window is narrow enough; the period
+background bands are kept.
+The animated haplogroup movement map used to be built twice (Natural Earth and
+USGS branches of common_code), converting the coordinate columns to lists inside every frame
+and re-sending the whole path prefix in each frame, which is O(n^2) in time and payload.
+movement_figure converts the coordinates to arrays once and emits at most max_frames frames,
+chosen either by decimation (evenly spaced samples) or by temporal binning (one frame per
+time bin). Each frame only carries its markers and the segment of the path it adds, drawn into
+a line trace of its own while the earlier segments stay in theirs, so the figure size grows
+linearly with max_frames instead of with the square of the number of samples.
+
+The chart builders of the EDA tab and of the mode-level HaploTracker charts live here as
+well, so the same code draws the figures in the app and in the batch renderer (render.py).
+
+User Defined Functions:
+    region_period_heatmap(aggregates): Returns the Region x Period sample count heatmap.
+    period_region_bar(aggregates): Returns the samples per Period bar chart, coloured by Region.
+    period_tests_figure(df): Returns the PRS box plot per Period with the Dunn tests.
+    region_tests_figure(df): Returns the PRS box plot per Region with the pairwise Mann-Whitney tests.
+    violin_figure(df): Returns the PRS violin plot per Period.
+    top_clades_figure(counts, color): Returns the top haplogroups bar chart.
+    lttb(x, y, n_out): Returns the indices of the points kept by the LTTB downsampling.
+    prs_time_figure(df, x, y): Returns the PRS over time line chart (WebGL, downsampled).
+    frame_steps(n, max_frames): Returns the sample indices shown by each frame (decimation).
+    time_bin_steps(dates, max_frames): Returns the sample indices shown by each frame (time bins).
+    link_segments(lat, lon, predecessor): Returns the predecessor links as one line trace.
+    movement_frames(lat, lon, labels): Returns the animation frames, each adding its segment of the path.
+    movement_segments(n_frames): Returns the line traces holding the segments of the path.
+    movement_figure(animate_data, map_type, center): Returns the animated movement map.
+    cluster_map(clusters, map_type): Returns the haplogroup map with one marker per cluster.
+    pca_figure(df, color): Returns the PC1/PC2 scatter plot of the samples (see pca.py).
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import stats_cache
+
+MAPBOX_TOKEN = "pk.eyJ1IjoibmlraGlsZXNoMjMiLCJhIjoiY2xmMmJucGx6MDFxaTN5bnRpYW12cWxxeCJ9.KeccdtSz6Hc9F_vPrYoiNg"
+USGS_LAYERS = [
+    {
+        "below": 'traces',
+        "sourcetype": "raster",
+        "sourceattribution": "United States Geological Survey",
+        "source": [
+            "https://basemap.nationalmap.gov/arcgis/rest/services/USGSImageryOnly/MapServer/tile/{z}/{y}/{x}"
+        ]
+    }
+]
+MAX_FRAMES = 120
+DECIMATION = "decimation"
+TIME_BINS = "time bins"
+# Points drawn per colour group in the PRS over time chart before downsampling kicks in
+MAX_POINTS = 1500
+
+periods = ['Paleolítico', 'Mesolítico', 'Neolítico', 'Pós-Neolítico']
+regions = ['África', 'Ásia', 'Europa', 'América', 'Oceania']
+# Background bands of the periods in years BP, most recent first
+PERIOD_BANDS = [[0, 4000], [4000, 8000], [8000, 13000]]
+PERIOD_COLORS = [px.colors.qualitative.Pastel[3], px.colors.qualitative.Pastel[4],
+                 px.colors.qualitative.Pastel[5], px.colors.qualitative.Pastel[7]]
+
+
+def region_period_heatmap(aggregates) -> go.Figure:
+    """Returns the heatmap of the number of samples per Region and Period, with a Total column."""
+    df_cros = aggregates.crosstab('Region', 'Period').reindex(columns=periods, fill_value=0)
+    df_cros['Total'] = df_cros.sum(axis=1)
+    return px.imshow(df_cros, text_auto=True)
+
+
+def period_region_bar(aggregates) -> go.Figure:
+    """Returns the bar chart of the number of samples per Period, coloured by Region."""
+    fig = px.bar(aggregates.counts(["Period", "Region"]), x="Period", y="count", color="Region")
+    fig.update_xaxes(categoryorder='array', categoryarray=periods)
+    return fig
+
+
+def period_tests_figure(df: pd.DataFrame) -> go.Figure:
+    """Returns the PRS box plot per Period with the Dunn tests (Bonferroni corrected)."""
+    return stats_cache.plot_stats(df, "Period", "PRS_SCZ", order=periods, type_correction="bonferroni", type_test="dunn")
+
+
+def region_tests_figure(df: pd.DataFrame) -> go.Figure:
+    """Returns the PRS box plot per Region with the Mann-Whitney tests (Bonferroni corrected)."""
+    return stats_cache.plot_stats(df, "Region", "PRS_SCZ", type_correction="bonferroni", order=regions)
+
+
+def violin_figure(df: pd.DataFrame) -> go.Figure:
+    """Returns the violin plot of PRS_SCZ per Period."""
+    fig = go.Figure()
+    for p in periods:
+        fig.add_trace(go.Violin(x=df['Period'][df['Period'] == p],
+                                y=df['PRS_SCZ'][df['Period'] == p],
+                                name=p,
+                                box_visible=True,
+                                meanline_visible=True))
+    return fig
+
+
+def top_clades_figure(counts: pd.DataFrame, color: str) -> go.Figure:
+    """Returns the bar chart of the top haplogroups (see haplogroups.CladeTrie.top), coloured by a dimension."""
+    fig = px.bar(counts, x="mtdna", y="count", color=color)
+    fig.update_layout(xaxis={'categoryorder': 'total descending'})
+    return fig
+
+
+def lttb(x, y, n_out: int) -> np.ndarray:
+    """
+    Largest triangle three buckets downsampling
+
+    Keeps the first and last points and, in each of n_out - 2 buckets, the point forming the
+    largest triangle with the previously kept point and the mean of the next bucket, which
+    preserves the peaks and troughs of the series.
+
+    Args:
+        x, y (array-like): Coordinates of the series, sorted by x
+        n_out (int): Number of points to keep
+
+    Returns:
+        np.ndarray: Indices of the kept points
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x = x[stop:next_stop].mean()
+        mean_y = y[stop:next_stop].mean()
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[i + 1] = previous
+    return kept
+
+
+def add_period_bands(fig: go.Figure, max_date: float, y_min: float):
+    """Adds the period background bands and their labels to a figure with years BP on x."""
+    shapes = []
+    bgs = PERIOD_BANDS + [[13000, max_date + 1000]]
+    for i, b in enumerate(bgs):
+        shapes.append(dict(type="rect",
+                    xref="x",
+                    yref="paper",
+                    x0=b[0],
+                    y0=0,
+                    x1=b[1],
+                    y1=1,
+                    fillcolor=PERIOD_COLORS[i],
+                    opacity=0.3,
+                    layer="below",
+                    line_width=0))
+        fig.add_annotation(text=periods[3-i], textangle=315,
+                  x=(b[0]+b[1])/2, y=y_min, showarrow=False,)
+    fig.update_layout(shapes=shapes)
+
+
+def _rgba(color: str, alpha: float) -> str:
+    red, green, blue = px.colors.hex_to_rgb(color)
+    return f"rgba({red},{green},{blue},{alpha})"
+
+
+def add_trajectory(fig: go.Figure, trajectory: pd.DataFrame, colors: dict):
+    """Adds the rolling trend of each group (see trajectory.rolling_trajectory) with its confidence band."""
+    for group, part in trajectory.groupby("group", sort=False):
+        color = colors.get(str(group), "#444444")
+        fig.add_trace(go.Scatter(
+            x=np.concatenate([part["center"], part["center"][::-1]]),
+            y=np.concatenate([part["upper"], part["lower"][::-1]]),
+            fill="toself", fillcolor=_rgba(color, 0.2), line=dict(width=0),
+            hoverinfo="skip", showlegend=False, legendgroup=str(group)))
+        fig.add_trace(go.Scatter(
+            x=part["center"], y=part["value"], mode="lines", name=f"{group} trend",
+            line=dict(color=color, width=3), legendgroup=str(group),
+            customdata=part["n"], hovertemplate="%{y:.3f} (n=%{customdata})"))
+
+
+def prs_time_figure(df: pd.DataFrame, x: str = "Date", y: str = "PRS_SCZ", color: str = "Region",
+                    x_range: tuple = None, max_points: int = MAX_POINTS, period_bands: bool = True,
+                    trajectory: pd.DataFrame = None) -> go.Figure:
+    """
+    Returns the line chart of y over time, one WebGL trace per colour group
+
+    Args:
+        df (pd.DataFrame): Samples
+        x (str): Time column (years BP or years ago)
+        y (str): Plotted value
+        color (str): Grouping column, one trace per value
+        x_range (tuple): Visible (min, max) of x; None shows every sample
+        max_points (int): Maximum points per trace; narrower windows are drawn at full resolution
+        period_bands (bool): Draws the period background bands
+        trajectory (pd.DataFrame): Rolling trend per group to draw on top (see trajectory.py)
+
+    Returns:
+        go.Figure: Line chart with x reversed (oldest samples on the left)
+    """
+    data_sorted = df[[x, y, color]].dropna(subset=[x, y]).sort_values(by=x, kind="stable")
+    if x_range is not None:
+        data_sorted = data_sorted[data_sorted[x].between(*x_range)]
+    fig = go.Figure()
+    palette = px.colors.qualitative.Plotly
+    colors = {}
+    for i, (group, part) in enumerate(data_sorted.groupby(color, observed=True, sort=False)):
+        xs, ys = part[x].to_numpy(dtype=float), part[y].to_numpy(dtype=float)
+        kept = lttb(xs, ys, max_points)
+        colors[str(group)] = palette[i % len(palette)]
+        fig.add_trace(go.Scattergl(x=xs[kept], y=ys[kept], mode="lines+markers", name=str(group),
+                                   line=dict(color=colors[str(group)]),
+                                   legendgroup=str(group)))
+    if trajectory is not None and len(trajectory):
+        add_trajectory(fig, trajectory, colors)
+    fig.update_layout(xaxis_title=x, yaxis_title=y, legend_title_text=color)
+    if period_bands and len(data_sorted):
+        add_period_bands(fig, df[x].max(), data_sorted[y].min())
+    if x_range is not None:
+        fig.update_xaxes(range=[x_range[1], x_range[0]])
+    else:
+        fig.update_layout(xaxis = dict(autorange="reversed") )
+    return fig
+
+
+def frame_steps(n: int, max_frames: int = MAX_FRAMES) -> list:
+    """
+    Returns the samples shown by each frame, keeping at most max_frames evenly spaced frames
+
+    As in the original animation the first sample is the starting point, so frames go from
+    sample 1 to n - 1; when n - 1 <= max_frames every sample gets its own frame.
+
+    Returns:
+        list: One array of sample indices per frame
+    """
+    if n < 2:
+        return []
+    steps = np.unique(np.linspace(1, n - 1, min(max_frames, n - 1)).round().astype(int))
+    return [np.array([step]) for step in steps]
+
+
+def time_bin_steps(dates, max_frames: int = MAX_FRAMES) -> list:
+    """
+    Returns the samples shown by each frame, grouping the samples in max_frames time bins
+
+    Args:
+        dates (array-like): Date of each sample, in animation order (monotonic)
+        max_frames (int): Number of time bins
+
+    Returns:
+        list: One array of sample indices per non-empty bin (the first sample excluded)
+    """
+    dates = np.asarray(dates, dtype=float)
+    if len(dates) < 2:
+        return []
+    edges = np.linspace(dates.min(), dates.max(), max_frames + 1)
+    bins = np.clip(np.searchsorted(edges, dates, side="right") - 1, 0, max_frames - 1)
+    if dates[0] > dates[-1]:
+        # Descending dates (oldest first): walk the bins from the last one
+        bins = max_frames - 1 - bins
+    positions = np.arange(1, len(dates))
+    boundaries = np.flatnonzero(np.diff(bins[1:])) + 1
+    return np.split(positions, boundaries)
+
+
+def link_segments(lat, lon, predecessor, rows=None) -> tuple:
+    """
+    Returns the coordinates of the links from each sample to its predecessor as one line trace
+
+    Args:
+        lat, lon (np.ndarray): Coordinates of each sample
+        predecessor (np.ndarray): Index of the predecessor of each sample, -1 for none (see dispersal)
+        rows (np.ndarray): Samples whose incoming links are drawn (default: all)
+
+    Returns:
+        tuple: lat and lon arrays, with None between links
+    """
+    rows = np.arange(len(lat)) if rows is None else np.asarray(rows)
+    rows = rows[predecessor[rows] >= 0]
+    segments_lat = np.full((len(rows), 3), None, dtype=object)
+    segments_lon = np.full((len(rows), 3), None, dtype=object)
+    segments_lat[:, 0], segments_lat[:, 1] = lat[predecessor[rows]], lat[rows]
+    segments_lon[:, 0], segments_lon[:, 1] = lon[predecessor[rows]], lon[rows]
+    return segments_lat.ravel(), segments_lon.ravel()
+
+
+def movement_frames(lat, lon, labels, steps: list, predecessor=None, first_segment: int = 3) -> list:
+    """
+    Builds the animation frames: the current samples as markers and the new part of the path
+
+    The path is drawn incrementally: each frame only sends the segment it adds (from the last
+    sample of the previous frame to its own last sample, or with predecessor links the links
+    arriving at its samples) to a trace of its own, and the segments of the earlier frames stay
+    in their traces, so the payload grows linearly with the number of frames. The first frame
+    also clears every segment trace, so the animation can be replayed.
+
+    Args:
+        lat, lon, labels (array-like): Coordinates and haplogroup of each sample, in animation order
+        steps (list): Sample indices of each frame (see frame_steps and time_bin_steps)
+        predecessor (np.ndarray): Index of the predecessor of each sample (None for the date-order path)
+        first_segment (int): Index of the segment trace of the first frame in the figure
+
+    Returns:
+        list: go.Frame objects updating the first trace (markers) and the segment trace of the frame
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    labels = np.asarray(labels, dtype=object)
+    path = np.concatenate([[0], [step[-1] for step in steps]]).astype(int)
+    frames = []
+    for j, step in enumerate(steps):
+        if predecessor is None:
+            line_lat, line_lon = lat[path[j:j + 2]], lon[path[j:j + 2]]
+        else:
+            line_lat, line_lon = link_segments(lat, lon, predecessor, step)
+        markers = go.Scattermapbox(
+            lat=lat[step],
+            lon=lon[step],
+            mode="markers",
+            marker=dict(color="red", size=10),
+            text=labels[step]
+        )
+        data, traces = [markers, go.Scattermapbox(lat=line_lat, lon=line_lon)], [0, first_segment + j]
+        if j == 0:
+            data += [go.Scattermapbox(lat=[], lon=[]) for _ in steps[1:]]
+            traces += [first_segment + k for k in range(1, len(steps))]
+        frames.append(go.Frame(data=data, traces=traces, name=str(j)))
+    return frames
+
+
+def movement_segments(n_frames: int) -> list:
+    """Returns the empty line traces the frames of movement_frames draw their segments into."""
+    return [go.Scattermapbox(lat=[], lon=[], mode="lines", line=dict(width=2, color="orange"),
+                             name="Movement", legendgroup="movement", showlegend=j == 0)
+            for j in range(n_frames)]
+
+
+def movement_figure(animate_data: pd.DataFrame, map_type: str, center: dict,
+                    max_frames: int = MAX_FRAMES, sampling: str = DECIMATION, predecessor=None) -> go.Figure:
+    """
+    Returns the animated movement map of one haplogroup
+
+    Args:
+        animate_data (pd.DataFrame): Samples of the haplogroup sorted by Age (Lat, Long, mtdna, Age, hover)
+        map_type (str): "Natural Earth" (carto-positron tiles) or "USGS" (USGS imagery)
+        center (dict): lat/lon of the map center
+        max_frames (int): Maximum number of animation frames
+        sampling (str): DECIMATION or TIME_BINS
+        predecessor (np.ndarray): Row position of the predecessor of each sample (see
+            dispersal.movement_links); None joins the samples in date order
+
+    Returns:
+        go.Figure: Map with the full path, the sample markers and the animation frames
+    """
+    lat = animate_data["Lat"].to_numpy(dtype=float)
+    lon = animate_data["Long"].to_numpy(dtype=float)
+    hover = animate_data["hover"].to_numpy(dtype=object)
+    if predecessor is None:
+        line_lat, line_lon = lat, lon
+    else:
+        predecessor = np.asarray(predecessor)
+        line_lat, line_lon = link_segments(lat, lon, predecessor)
+    if sampling == TIME_BINS:
+        steps = time_bin_steps(animate_data["Age"].to_numpy(), max_frames)
+    else:
+        steps = frame_steps(len(lat), max_frames)
+
+    if map_type == "Natural Earth":
+        title = "Movement of selected Haplogroup over history"
+        style = dict(mapbox_style="carto-positron")
+    else:
+        title = "Movement of mtHaplogroups over history"
+        style = dict(mapbox_style="white-bg", mapbox_layers=USGS_LAYERS)
+
+    return go.Figure(
+        data=[
+            go.Scattermapbox(
+                lat=line_lat,
+                lon=line_lon,
+                mode="lines",
+                line=dict(width=2, color="blue"),
+                name="Haplogroup Movement",
+                hovertext=hover if predecessor is None else None
+            ),
+            go.Scattermapbox(
+                lat=line_lat,
+                lon=line_lon,
+                mode="lines",
+                line=dict(width=2, color="blue")
+            ),
+            go.Scattermapbox(
+                lat=lat,
+                lon=lon,
+                mode="markers",
+                marker=dict(
+                    size=6,
+                    color="red"
+                ),
+                name="Haplogroup locations",
+                hovertext=hover
+            ),
+            *movement_segments(len(steps))
+        ],
+        layout=go.Layout(
+            title_text=title,
+            mapbox=dict(
+                accesstoken=MAPBOX_TOKEN,
+                bearing=0,
+                center=center,
+                pitch=0,
+                zoom=1
+            ),
+            updatemenus=[
+                dict(
+                    type="buttons",
+                    buttons=[dict(label="Play", method="animate", args=[None])]
+                )
+            ],
+            **style
+        ),
+        frames=movement_frames(lat, lon, animate_data["mtdna"].to_numpy(dtype=object), steps, predecessor)
+    )
+
+
+def cluster_map(clusters: pd.DataFrame, map_type: str) -> go.Figure:
+    """
+    Returns the haplogroup map with one marker per spatial cluster (see spatial.SpatialIndex.clusters)
+
+    Markers are coloured by the dominant haplogroup of the cluster and sized by its sample count.
+
+    Args:
+        clusters (pd.DataFrame): Lat, Long, count, mtdna, PRS_SCZ and hover of each cluster
+        map_type (str): "Natural Earth" or "USGS"
+
+    Returns:
+        go.Figure: Scatter map of the clusters
+    """
+    hover_data = {"count": True, "PRS_SCZ": ":.3f", "Lat": False, "Long": False}
+    size_max = 10 if clusters["count"].max() <= 1 else 30
+    if map_type == "Natural Earth":
+        fig = px.scatter_geo(clusters, lat='Lat', lon='Long', color='mtdna', size='count', size_max=size_max,
+                             hover_name="hover", hover_data=hover_data, projection='natural earth',
+                             color_discrete_sequence=px.colors.qualitative.Set1)
+        fig.update_geos(showland=True, landcolor="LightGreen", showocean=True, oceancolor="LightBlue",
+                        showrivers=True, rivercolor="Blue",
+                        projection_type="natural earth", fitbounds="locations")
+    else:
+        fig = px.scatter_mapbox(clusters, lat='Lat', lon='Long', color='mtdna', size='count', size_max=size_max,
+                                hover_name="hover", hover_data=hover_data,
+                                color_discrete_sequence=px.colors.qualitative.Set1)
+        fig.update_layout(mapbox_style="white-bg", mapbox_layers=USGS_LAYERS)
+    return fig
+
+
+def pca_figure(df: pd.DataFrame, color: str = "Region", x: str = "PC1", y: str = "PC2") -> go.Figure:
+    """Returns the WebGL scatter plot of two principal components of the samples, coloured by Region or Period."""
+    fig = px.scatter(df, x=x, y=y, color=color, hover_name="Genetic ID", hover_data=["Country", "Date"],
+                     category_orders={color: periods if color == "Period" else regions}, render_mode="webgl")
+    fig.update_traces(marker=dict(size=4, opacity=0.7))
+    return fig
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Indexed filter engine used by filter_dataframe in app.py.
+
+Description: The engine is built once per dataset version and shared by all sessions.
+It infers the filter kind of every column once, and builds the indexes lazily the first
+time a column is filtered:
+    categorical columns (< 10 unique values): inverted index value -> row bitmap
+    numeric and datetime columns: values sorted once, with the permutation back to the rows
+    text columns: trigram index over the distinct values, used to prune the candidates
+        before the regex is verified, plus an LRU cache of the recent queries
+Each filter returns a boolean mask; the masks are combined and the frame is only
+materialized once, by apply().
+"""
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (
+    is_datetime64_any_dtype,
+    is_numeric_dtype,
+    is_object_dtype,
+)
+
+CATEGORICAL = "categorical"
+NUMERIC = "numeric"
+DATETIME = "datetime"
+TEXT = "text"
+
+# Columns with fewer unique values than this are filtered with a multiselect
+MAX_CATEGORIES = 10
+# Number of text queries kept per column
+QUERY_CACHE_SIZE = 64
+# Regex syntax that makes the literal extraction below unreliable (no pruning is done)
+_UNPRUNABLE = re.compile(r"[|\\()\[\]{}]")
+
+
+def trigrams(text: str) -> set:
+    """Returns the set of 3-character substrings of a text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern: str) -> list:
+    """
+    Returns the literal substrings that every match of a regex must contain
+
+    Only simple patterns are analysed (literals with . ^ $ * + ?); for anything else an
+    empty list is returned, meaning that no candidate can be pruned.
+    """
+    if _UNPRUNABLE.search(pattern):
+        return []
+    literals, current = [], ""
+    for char in pattern:
+        if char in "*?":
+            # The previous character is optional
+            current = current[:-1]
+        if char in ".^$*+?":
+            literals.append(current)
+            current = ""
+        else:
+            current += char
+    literals.append(current)
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+class TrigramIndex:
+    """
+    Trigram index over the distinct values of a text column
+
+    Attributes:
+        codes (np.ndarray): Position of each row in uniques (-1 for missing values)
+        uniques (list): Distinct values of the column, as strings
+    """
+
+    def __init__(self, series: pd.Series, cache_size: int = QUERY_CACHE_SIZE):
+        codes, uniques = pd.factorize(series)
+        self.codes = codes
+        self.uniques = [str(value) for value in uniques]
+        postings = {}
+        for position, value in enumerate(self.uniques):
+            for gram in trigrams(value):
+                postings.setdefault(gram, []).append(position)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def candidates(self, pattern: str):
+        """Returns the positions in uniques that may match, or None if nothing can be pruned."""
+        grams = set()
+        for literal in required_literals(pattern):
+            grams |= trigrams(literal)
+        if not grams:
+            return None
+        lists = sorted((self._postings.get(gram, np.empty(0, dtype=np.int32)) for gram in grams), key=len)
+        found = lists[0]
+        for ids in lists[1:]:
+            if not len(found):
+                break
+            found = np.intersect1d(found, ids, assume_unique=True)
+        return found
+
+    def search(self, pattern: str) -> np.ndarray:
+        """
+        Returns the rows containing a substring or regex (same semantics as str.contains)
+
+        Args:
+            pattern (str): Substring or regex
+
+        Returns:
+            np.ndarray: Read-only boolean mask over the rows
+        """
+        with self._lock:
+            if pattern in self._cache:
+                self._cache.move_to_end(pattern)
+                return self._cache[pattern]
+
+        regex = re.compile(pattern)
+        candidates = self.candidates(pattern)
+        if candidates is None:
+            candidates = range(len(self.uniques))
+        matched = np.zeros(len(self.uniques) + 1, dtype=bool)  # last slot is for missing values
+        for position in candidates:
+            if regex.search(self.uniques[position]):
+                matched[position] = True
+        mask = matched[self.codes]
+        mask.flags.writeable = False
+
+        with self._lock:
+            self._cache[pattern] = mask
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return mask
+
+
+class FilterEngine:
+    """
+    Precomputed filter indexes over a read-only dataframe
+
+    Attributes:
+        df (pd.DataFrame): Dataframe being filtered (never modified)
+        columns (pd.Index): Columns that can be filtered
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.columns = df.columns
+        self._lock = threading.RLock()
+        self._kinds = {}
+        self._converted = {}
+        self._bitmaps = {}
+        self._sorted = {}
+        self._trigrams = {}
+
+    def _column(self, column: str) -> pd.Series:
+        self.kind(column)
+        return self._converted.get(column, self.df[column])
+
+    def _memo(self, cache: dict, column: str, builder):
+        if column not in cache:
+            with self._lock:
+                if column not in cache:
+                    cache[column] = builder(column)
+        return cache[column]
+
+    def kind(self, column: str) -> str:
+        """Returns the (cached) filter kind of a column: categorical, numeric, datetime or text."""
+        return self._memo(self._kinds, column, self._infer_kind)
+
+    def _infer_kind(self, column: str) -> str:
+        series = self.df[column]
+        # Try to convert datetimes into a standard format (datetime, no timezone)
+        if is_object_dtype(series):
+            try:
+                self._converted[column] = series = pd.to_datetime(series)
+            except Exception:
+                pass
+        if is_datetime64_any_dtype(series) and getattr(series.dt, "tz", None) is not None:
+            self._converted[column] = series = series.dt.tz_localize(None)
+
+        if series.nunique() < MAX_CATEGORIES:
+            return CATEGORICAL
+        if is_numeric_dtype(series):
+            return NUMERIC
+        if is_datetime64_any_dtype(series):
+            return DATETIME
+        return TEXT
+
+    def values(self, column: str) -> list:
+        """Returns the unique values of a categorical column, in order of appearance."""
+        return list(self._memo(self._bitmaps, column, self._build_bitmaps))
+
+    def bounds(self, column: str) -> tuple:
+        """Returns the (min, max) of a numeric or datetime column."""
+        return self._memo(self._sorted, column, self._build_sorted)[2]
+
+    def _build_bitmaps(self, column: str) -> dict:
+        # Missing values get a bitmap too, so selecting them keeps their rows (as Series.isin does)
+        codes, uniques = pd.factorize(self._column(column), use_na_sentinel=False)
+        return {value: codes == code for code, value in enumerate(uniques)}
+
+    def _build_sorted(self, column: str) -> tuple:
+        series = self._column(column)
+        if is_datetime64_any_dtype(series):
+            # NaT is the smallest int64, so it sorts first and never falls inside a range
+            values = series.to_numpy().astype("datetime64[ns]").view("int64")
+        else:
+            values = series.to_numpy(dtype=float)
+        order = np.argsort(values, kind="stable")
+        return values[order], order, (series.min(), series.max())
+
+    def category_mask(self, column: str, selected) -> np.ndarray:
+        """Returns the rows whose value is one of the selected values (OR of the bitmaps)."""
+        bitmaps = self._memo(self._bitmaps, column, self._build_bitmaps)
+        missing = next((bitmap for value, bitmap in bitmaps.items() if pd.isna(value)), None)
+        mask = np.zeros(len(self.df), dtype=bool)
+        for value in selected:
+            if value in bitmaps:
+                mask |= bitmaps[value]
+            elif missing is not None and pd.isna(value):
+                # NaN is not equal to itself, so another NaN object misses the dict lookup
+                mask |= missing
+        return mask
+
+    def range_mask(self, column: str, low, high) -> np.ndarray:
+        """Returns the rows with low <= value <= high, using the sorted index."""
+        values, order, _ = self._memo(self._sorted, column, self._build_sorted)
+        if values.dtype.kind == "i":
+            low, high = pd.Timestamp(low).value, pd.Timestamp(high).value
+        start = np.searchsorted(values, low, side="left")
+        stop = np.searchsorted(values, high, side="right")
+        mask = np.zeros(len(self.df), dtype=bool)
+        mask[order[start:stop]] = True
+        return mask
+
+    def text_mask(self, column: str, pattern: str) -> np.ndarray:
+        """Returns the rows matching a substring or regex, using the trigram index of the column."""
+        index = self._memo(self._trigrams, column, lambda col: TrigramIndex(self.df[col]))
+        return index.search(pattern)
+
+    def apply(self, masks: list) -> pd.DataFrame:
+        """Combines the masks (AND) and materializes the filtered frame once."""
+        if not masks:
+            return self.df
+        return self.df[np.logical_and.reduce(masks)]
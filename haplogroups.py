@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Clade-aware index over the haplogroup labels of the HaploTracker tab.
+
+Description: Haplogroup labels follow the PhyloTree nomenclature, where letters and numbers
+alternate down the tree: H1a2b lies under H1a2, H1a, H1 and H (H10 is a sibling of H1, not a
+descendant). CladeTrie splits every distinct label into these clades and sorts the labels by
+their clade path, so the labels below any clade are contiguous. The rows are sorted once in
+the same order, which makes every clade a slice of that permutation: selecting a clade returns
+its rows in O(result) and its subtree count is known without scanning the data.
+Labels with a suffix that is not part of the nomenclature (e.g. H1+16189, L3e'i'k'x) become a
+leaf under their last clade, and labels without clade (e.g. ".." for unknown) are roots.
+
+User Defined Functions:
+    clade_path(label): Returns the clades a haplogroup label belongs to, from the root.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+_SEGMENT = re.compile(r"[A-Za-z]+|\d+")
+# Clade depth of the HaploTracker selector and top-N charts by default
+DEFAULT_DEPTH = 2
+
+
+def clade_path(label: str) -> tuple:
+    """
+    Returns the clades containing a haplogroup label, from the root down to the label itself
+
+    Example: clade_path("H1a2") -> ("H", "H1", "H1a", "H1a2")
+    """
+    path, end = [], 0
+    for match in _SEGMENT.finditer(label):
+        if match.start() != end:
+            break
+        end = match.end()
+        path.append(label[:end])
+    if end < len(label):
+        path.append(label)
+    return tuple(path)
+
+
+def _sort_key(path: tuple) -> tuple:
+    # Numbers compare as numbers (H2 before H10), the parent before its children
+    key, start = [], 0
+    for clade in path:
+        segment = clade[start:]
+        key.append((0, int(segment), "") if segment.isdigit() else (1, 0, segment))
+        start = len(clade)
+    return tuple(key)
+
+
+class CladeTrie:
+    """
+    Prefix trie of the haplogroup clades of a column, with the rows below every clade
+
+    Attributes:
+        max_depth (int): Depth of the deepest label
+    """
+
+    def __init__(self, labels: pd.Series):
+        codes, uniques = pd.factorize(labels.astype(object), sort=False)
+        uniques = [str(label) for label in uniques]
+        paths = [clade_path(label) for label in uniques]
+        order = sorted(range(len(uniques)), key=lambda i: _sort_key(paths[i]))
+
+        # Rows sorted by label, in clade order; ranks of missing labels (-1) sort last
+        rank = np.empty(len(uniques) + 1, dtype=np.int64)
+        rank[order] = np.arange(len(uniques))
+        rank[-1] = len(uniques)
+        self._positions = np.argsort(rank[codes], kind="stable")
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        offsets = np.concatenate([[0], np.cumsum(counts[order])])
+
+        self._ranges = {}
+        self._children = {None: []}
+        self._depth = {}
+        self.max_depth = 0
+        for sorted_index, label_index in enumerate(order):
+            parent = None
+            for depth, clade in enumerate(paths[label_index], start=1):
+                if clade not in self._ranges:
+                    self._ranges[clade] = [offsets[sorted_index], offsets[sorted_index + 1]]
+                    self._children[parent].append(clade)
+                    self._children[clade] = []
+                    self._depth[clade] = depth
+                else:
+                    self._ranges[clade][1] = offsets[sorted_index + 1]
+                parent = clade
+            self.max_depth = max(self.max_depth, len(paths[label_index]))
+        self._paths = dict(zip(uniques, paths))
+
+    def __contains__(self, clade: str) -> bool:
+        return clade in self._ranges
+
+    def children(self, clade: str = None) -> list:
+        """Returns the child clades of a clade (the roots when clade is None), in tree order."""
+        return list(self._children[clade])
+
+    def nodes(self, depth: int) -> list:
+        """Returns the clades down to the given depth that have no child at that depth, in tree order."""
+        nodes, stack = [], list(reversed(self._children[None]))
+        while stack:
+            clade = stack.pop()
+            if self._depth[clade] == depth or not self._children[clade]:
+                nodes.append(clade)
+            else:
+                stack.extend(reversed(self._children[clade]))
+        return nodes
+
+    def count(self, clade: str) -> int:
+        """Returns the number of rows in the subtree of a clade."""
+        start, stop = self._ranges[clade]
+        return int(stop - start)
+
+    def positions(self, clades: list) -> np.ndarray:
+        """
+        Returns the row positions of the samples below any of the given clades
+
+        Args:
+            clades (list): Selected clades (a clade and its descendant may both be selected)
+
+        Returns:
+            np.ndarray: Row positions in clade order (ascending within each label), usable with DataFrame.iloc
+        """
+        # Clade ranges are either nested or disjoint; a clade sorts before the descendants it starts with
+        ranges = sorted((self._ranges[clade] for clade in clades), key=lambda bounds: (bounds[0], -bounds[1]))
+        slices, stop = [], -1
+        for start, end in ranges:
+            if end <= stop:
+                continue # inside a clade already selected
+            slices.append(self._positions[start:end])
+            stop = end
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def ancestor(self, label: str, depth: int) -> str:
+        """Returns the clade containing a label at the given depth (the label itself if shallower)."""
+        path = self._paths.get(label) or clade_path(label)
+        return path[min(depth, len(path)) - 1]
+
+    def rollup(self, labels: pd.Series, depth: int) -> pd.Series:
+        """Maps every label to its clade at the given depth."""
+        uniques = pd.unique(labels.astype(object))
+        mapping = {label: self.ancestor(str(label), depth) for label in uniques if pd.notna(label)}
+        return labels.astype(object).map(mapping)
+
+    def top(self, counts: pd.DataFrame, depth: int, n: int, column: str = "mtdna") -> pd.DataFrame:
+        """
+        Rolls count rows up to the clades at a depth and keeps the n most frequent clades
+
+        Args:
+            counts (pd.DataFrame): Rows with a label column and a count column (e.g. AggregateCube.counts)
+            depth (int): Clade depth of the roll-up
+            n (int): Number of clades kept
+            column (str): Label column
+
+        Returns:
+            pd.DataFrame: counts summed per clade and per the other columns, for the top n clades
+        """
+        rolled = counts.assign(**{column: self.rollup(counts[column], depth)})
+        others = [col for col in rolled.columns if col not in (column, "count")]
+        rolled = rolled.groupby([column] + others, observed=True, sort=False)["count"].sum().reset_index()
+        totals = rolled.groupby(column, sort=False)["count"].sum()
+        return rolled[rolled[column].isin(totals.nlargest(n).index)]
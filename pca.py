@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Randomized out-of-core PCA of EIGENSTRAT genotypes.
+
+Description: Computes the principal components used as ancestry covariates of the PRS (see
+prs.py) from an AADR genotype release, instead of reading them from an external smartpca run.
+The .geno file is memory-mapped (prs.GenoMatrix) and streamed in blocks of SNPs; the
+standardized genotype matrix X (SNPs x samples, (g - 2p) / sqrt(2p(1 - p)), missing genotypes
+set to 0, i.e. mean-imputed) is never held in memory. The top components come from a randomized
+truncated SVD run in sample space: a random sample basis Q goes through block power
+iterations Q <- orth(X'X Q), where every X'X Q is accumulated block by block as B'(B Q) over a
+thread pool (NumPy releases the GIL in the products), followed by a Rayleigh-Ritz step on
+Q'X'X Q. Each iteration is one pass over the file, so 20 PCs of a full release take a few
+passes of a few minutes each. The SNP loadings are kept in a basis file with the allele
+frequencies, so new (e.g. low-coverage ancient) samples can be projected onto the reference
+axes by least squares over their observed SNPs only, as smartpca's lsqproject does.
+
+User Defined Functions:
+    fit(prefix, n_components, samples): Returns the PCs of the samples and the fitted basis.
+    project(prefix, basis, samples): Returns the PCs of samples projected onto a basis.
+    Basis.save(path), Basis.load(path): Write and read a fitted basis.
+    load_pcs(path): Returns the PCs of a csv written by this module.
+
+Usage:
+    python pca.py v62.0_1240k_public --reference Data/reference_ids.txt --out Data/pcs.csv
+    python pca.py new_samples --basis Data/.cache/pca_basis.npz --project --out Data/pcs_new.csv
+"""
+import argparse
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import dataset
+import prs
+
+PCS_PATH = Path(os.environ.get("ADNA_PCS", "Data/pcs.csv"))
+BASIS_PATH = dataset.CACHE_DIR / "pca_basis.npz"
+N_COMPONENTS = prs.N_PCS
+# Extra random directions and power iterations of the randomized SVD
+OVERSAMPLING = 10
+POWER_ITERATIONS = 5
+# Memory of the standardized genotypes of one block, per worker
+BLOCK_BYTES = 64 * 1024 * 1024
+# SNPs kept in the fit: minor allele frequency and fraction of called samples
+MIN_MAF = 0.01
+MIN_CALLED = 0.5
+
+
+class Basis:
+    """
+    SNP loadings of a fitted PCA, with the standardization of each SNP
+
+    Attributes:
+        snps (np.ndarray): SNP ids
+        ref, alt (np.ndarray): Alleles the genotypes of the fit counted (ref) against
+        mean (np.ndarray): Mean reference allele count (2p) of each SNP in the reference samples
+        scale (np.ndarray): Standard deviation sqrt(2p(1 - p)) of each SNP
+        loadings (np.ndarray): Left singular vectors, SNPs x components
+        singular_values (np.ndarray): Singular values of the standardized matrix
+    """
+
+    def __init__(self, snps, ref, alt, mean, scale, loadings, singular_values):
+        self.snps, self.ref, self.alt = np.asarray(snps), np.asarray(ref), np.asarray(alt)
+        self.mean, self.scale = np.asarray(mean, dtype=np.float32), np.asarray(scale, dtype=np.float32)
+        self.loadings = np.asarray(loadings, dtype=np.float32)
+        self.singular_values = np.asarray(singular_values)
+
+    @property
+    def n_components(self) -> int:
+        return self.loadings.shape[1]
+
+    @property
+    def explained(self) -> np.ndarray:
+        """Eigenvalues of the components, per SNP (as reported by smartpca)."""
+        return self.singular_values ** 2 / len(self.snps)
+
+    def save(self, path=BASIS_PATH) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, snps=self.snps.astype(str), ref=self.ref.astype(str), alt=self.alt.astype(str),
+                 mean=self.mean, scale=self.scale, loadings=self.loadings, singular_values=self.singular_values)
+        return path
+
+    @classmethod
+    def load(cls, path=BASIS_PATH) -> "Basis":
+        with np.load(path) as stored:
+            return cls(**{name: stored[name] for name in stored.files})
+
+
+def _standardize(genotypes: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """Returns (g - mean) / scale as float32, with 0 for the missing genotypes."""
+    block = genotypes.astype(np.float32)
+    block -= mean[:, None]
+    block /= scale[:, None]
+    block[genotypes == prs.MISSING] = 0
+    return block
+
+
+def _blocks(n_rows: int, n_cols: int, block_bytes: int) -> list:
+    size = max(1, block_bytes // (6 * max(n_cols, 1)))
+    return [slice(start, min(start + size, n_rows)) for start in range(0, n_rows, size)]
+
+
+def _map_blocks(function, blocks: list, workers: int) -> list:
+    if workers == 1:
+        return [function(block) for block in blocks]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, blocks))
+
+
+def _sum_blocks(function, blocks: list, workers: int) -> np.ndarray:
+    """Returns the sum of function over the blocks, each thread adding its results into its own total."""
+    def total(share):
+        return functools.reduce(lambda running, part: np.add(running, part, out=running), map(function, share))
+
+    shares = [blocks[start::workers] for start in range(min(workers, len(blocks)))]
+    if len(shares) == 1:
+        return total(shares[0])
+    with ThreadPoolExecutor(max_workers=len(shares)) as pool:
+        return functools.reduce(np.add, pool.map(total, shares))
+
+
+def allele_stats(geno: prs.GenoMatrix, rows: np.ndarray, keep: np.ndarray, workers: int = None,
+                 block_bytes: int = BLOCK_BYTES) -> tuple:
+    """
+    Returns the mean reference allele count and the fraction of called samples of each SNP
+
+    Args:
+        geno (prs.GenoMatrix): Genotypes
+        rows (np.ndarray): Sorted SNP indexes
+        keep (np.ndarray): Sample indexes
+        workers (int): Threads (default: one per CPU)
+        block_bytes (int): Memory of one block
+
+    Returns:
+        tuple: (mean, called) arrays aligned with rows
+    """
+    def stats(block):
+        genotypes = geno.block(rows[block])[:, keep]
+        called = genotypes != prs.MISSING
+        counts = called.sum(axis=1)
+        total = np.where(called, genotypes, 0).sum(axis=1, dtype=np.int64)
+        return np.divide(total, counts, out=np.zeros(len(counts)), where=counts > 0), counts / max(len(keep), 1)
+
+    parts = _map_blocks(stats, _blocks(len(rows), geno.n_ind, block_bytes), workers or os.cpu_count() or 1)
+    return np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+
+
+def fit(prefix, n_components: int = N_COMPONENTS, samples=None, oversampling: int = OVERSAMPLING,
+        iterations: int = POWER_ITERATIONS, workers: int = None, seed: int = 0,
+        block_bytes: int = BLOCK_BYTES) -> tuple:
+    """
+    Computes the top principal components of a genotype release with a randomized SVD
+
+    Args:
+        prefix (str | Path): Path of the release without extension (prefix.geno, .snp and .ind)
+        n_components (int): Number of components
+        samples (list): Genetic IDs of the reference samples (default: every sample)
+        oversampling (int): Extra random directions of the sample basis
+        iterations (int): Power iterations (passes over the file)
+        workers (int): Threads (default: one per CPU)
+        seed (int): Seed of the random starting basis
+        block_bytes (int): Memory of one block per worker
+
+    Returns:
+        tuple: (pd.DataFrame of PC1..PCn indexed by Genetic ID, Basis)
+    """
+    prefix = str(prefix)
+    individuals, snps = prs.read_ind(prefix + ".ind"), prs.read_snp(prefix + ".snp")
+    geno = prs.GenoMatrix(prefix + ".geno", len(individuals), len(snps))
+    workers = workers or os.cpu_count() or 1
+    keep = np.arange(len(individuals))
+    if samples is not None:
+        keep = np.flatnonzero(individuals["Genetic ID"].isin(set(samples)).to_numpy())
+
+    # Polymorphic and well-called SNPs only
+    rows = np.arange(len(snps))
+    mean, called = allele_stats(geno, rows, keep, workers, block_bytes)
+    frequency = mean / 2
+    used = (np.minimum(frequency, 1 - frequency) >= MIN_MAF) & (called >= MIN_CALLED)
+    rows, mean = rows[used], mean[used].astype(np.float32)
+    scale = np.sqrt(2 * frequency[used] * (1 - frequency[used])).astype(np.float32)
+    blocks = _blocks(len(rows), geno.n_ind, block_bytes)
+    rank = min(n_components + oversampling, len(keep), len(rows))
+
+    def gram(basis):
+        def product(block):
+            standardized = _standardize(geno.block(rows[block])[:, keep], mean[block], scale[block])
+            return standardized.T @ (standardized @ basis)
+        return _sum_blocks(product, blocks, workers)
+
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(rng.standard_normal((len(keep), rank)).astype(np.float32))
+    for iteration in range(iterations):
+        z = gram(q)
+        if iteration < iterations - 1:
+            q, _ = np.linalg.qr(z)
+    # Rayleigh-Ritz: eigenvectors of X'X restricted to the span of q
+    eigenvalues, vectors = np.linalg.eigh(q.T @ z)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    singular_values = np.sqrt(np.clip(eigenvalues[order], 0, None))
+    v = q @ vectors[:, order]
+
+    # Loadings u = X v / sigma, one block at a time
+    def loadings(block):
+        standardized = _standardize(geno.block(rows[block])[:, keep], mean[block], scale[block])
+        return standardized @ v
+    u = np.concatenate(_map_blocks(loadings, blocks, workers)) / np.where(singular_values > 0, singular_values, 1)
+    basis = Basis(snps["SNP"].to_numpy()[rows], snps["ref"].to_numpy()[rows], snps["alt"].to_numpy()[rows],
+                  mean, scale, u, singular_values)
+    pcs = pd.DataFrame(v * singular_values / np.sqrt(len(rows)),
+                       index=pd.Index(individuals["Genetic ID"].to_numpy()[keep], name="Genetic ID"),
+                       columns=[f"PC{i}" for i in range(1, len(order) + 1)])
+    return pcs, basis
+
+
+def project(prefix, basis: Basis, samples=None, workers: int = None, block_bytes: int = BLOCK_BYTES) -> pd.DataFrame:
+    """
+    Projects samples onto the axes of a fitted basis by least squares over their called SNPs
+
+    Each sample solves (U_o'U_o) s = U_o'x_o, where U_o are the loadings of the SNPs it has a
+    genotype for, so missing SNPs do not pull it towards the origin. SNPs are matched on id;
+    genotypes counted against the other allele are flipped.
+
+    Args:
+        prefix (str | Path): Path of the release without extension
+        basis (Basis): Fitted basis (see fit)
+        samples (list): Genetic IDs to project (default: every sample)
+        workers (int): Threads (default: one per CPU)
+        block_bytes (int): Memory of one block per worker
+
+    Returns:
+        pd.DataFrame: PC1..PCn indexed by Genetic ID, NaN for samples without enough SNPs
+    """
+    prefix = str(prefix)
+    individuals, snps = prs.read_ind(prefix + ".ind"), prs.read_snp(prefix + ".snp")
+    geno = prs.GenoMatrix(prefix + ".geno", len(individuals), len(snps))
+    keep = np.arange(len(individuals))
+    if samples is not None:
+        keep = np.flatnonzero(individuals["Genetic ID"].isin(set(samples)).to_numpy())
+
+    position = pd.Series(np.arange(len(basis.snps)), index=basis.snps)
+    matched = snps.reset_index(names="row").assign(position=snps["SNP"].map(position)).dropna(subset=["position"])
+    matched = matched.astype({"position": np.int64})
+    same = matched["ref"].to_numpy() == basis.ref[matched["position"]]
+    swapped = matched["ref"].to_numpy() == basis.alt[matched["position"]]
+    matched = matched[same | swapped].assign(swapped=swapped[same | swapped])
+    rows, positions = matched["row"].to_numpy(), matched["position"].to_numpy()
+    flip = matched["swapped"].to_numpy()
+    k = basis.n_components
+
+    def normal_equations(block):
+        loadings = basis.loadings[positions[block]]
+        outer = (loadings[:, :, None] * loadings[:, None, :]).reshape(len(loadings), k * k)
+        genotypes = geno.block(rows[block])[:, keep]
+        flipped = flip[block][:, None] & (genotypes != prs.MISSING)
+        genotypes = np.where(flipped, 2 - genotypes, genotypes)
+        standardized = _standardize(genotypes, basis.mean[positions[block]], basis.scale[positions[block]])
+        called = (genotypes != prs.MISSING).astype(np.float32)
+        # Both sides of the normal equations of every sample, summed over the blocks
+        return np.hstack([called.T @ outer, standardized.T @ loadings])
+
+    total = _sum_blocks(normal_equations, _blocks(len(rows), geno.n_ind, block_bytes), workers or os.cpu_count() or 1)
+    gram = total[:, :k * k].reshape(len(keep), k, k).astype(np.float64)
+    right = total[:, k * k:].astype(np.float64)
+    solvable = np.linalg.matrix_rank(gram) == k
+    scores = np.full((len(keep), k), np.nan)
+    if solvable.any():
+        scores[solvable] = np.linalg.solve(gram[solvable], right[solvable][:, :, None])[:, :, 0]
+    return pd.DataFrame(scores / np.sqrt(len(basis.snps)),
+                        index=pd.Index(individuals["Genetic ID"].to_numpy()[keep], name="Genetic ID"),
+                        columns=[f"PC{i}" for i in range(1, k + 1)])
+
+
+def load_pcs(path=PCS_PATH) -> pd.DataFrame:
+    """Returns the PCs of each sample written by this module (Genetic ID, PC1..PCn)."""
+    return pd.read_csv(path, dtype={"Genetic ID": str})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes the principal components of an EIGENSTRAT genotype release")
+    parser.add_argument("prefix", help="genotype release without extension (prefix.geno, .snp, .ind)")
+    parser.add_argument("--components", type=int, default=N_COMPONENTS)
+    parser.add_argument("--reference", default=None, help="file with the Genetic IDs of the reference samples, one per line")
+    parser.add_argument("--basis", default=BASIS_PATH, help="basis written by the fit and read by --project")
+    parser.add_argument("--project", action="store_true", help="only project the samples onto an existing --basis")
+    parser.add_argument("--iterations", type=int, default=POWER_ITERATIONS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--block-mb", type=int, default=BLOCK_BYTES // 1024 ** 2)
+    parser.add_argument("--out", default=PCS_PATH)
+    args = parser.parse_args()
+
+    block_bytes = args.block_mb * 1024 ** 2
+    if args.project:
+        pcs = project(args.prefix, Basis.load(args.basis), workers=args.workers, block_bytes=block_bytes)
+    else:
+        reference = None
+        if args.reference is not None:
+            reference = Path(args.reference).read_text().split()
+        pcs, basis = fit(args.prefix, args.components, reference, iterations=args.iterations,
+                         workers=args.workers, block_bytes=block_bytes)
+        basis.save(args.basis)
+        print(f"Eigenvalues: {np.round(basis.explained, 3).tolist()}")
+        if reference is not None:
+            # Samples outside the reference are projected onto its axes
+            others = prs.read_ind(args.prefix + ".ind")["Genetic ID"]
+            others = others[~others.isin(set(reference))]
+            if len(others):
+                pcs = pd.concat([pcs, project(args.prefix, basis, others, args.workers, block_bytes)])
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    pcs.reset_index().to_csv(out, index=False)
+    print(f"{pcs.notna().all(axis=1).sum()} samples with {pcs.shape[1]} PCs written to {out}")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-rerun stage timing and payload instrumentation of the dashboard.
+
+Description: A Profiler belongs to one session of the app and records spans around the stages
+of each rerun (dataset load, filter_dataframe, each tab body, the common_code sections, figure
+construction and each st.plotly_chart call). A span records its wall time, the peak memory
+allocated above its starting point (tracemalloc) and, for charts, the size of the serialized
+figure sent to the browser. Spans nest: a span opened inside another one is recorded under its
+path ("tab:HaploTracker/common_code/top"). A full rerun is bracketed by start_rerun and
+end_rerun; a fragment rerun (st.fragment) only runs the fragment, so its outermost span starts
+and ends a rerun of its own. The spans of a rerun are appended as JSON lines to a local log
+when it ends, and the latest ones are kept in memory for the debug panel of the app.
+Profiling is opt-in: a disabled profiler does nothing but yield, and tracemalloc only runs
+while at least one profiler is enabled (it is stopped when the last one is disabled or its
+session ends). tracemalloc counts the allocations of the whole process and its peak is reset
+process-wide, so peaks are only recorded while a single profiler is enabled; with several
+profiled sessions their spans have no peak_bytes.
+
+User Defined Functions:
+    Profiler.span(name, figure): Context manager recording one stage.
+    Profiler.trace(name): Decorator recording each call of a function as a span.
+    read_log(path): Returns the logged spans as a dataframe.
+
+Usage:
+    HAPLO_PROFILE=1 streamlit run app.py      (or open the app with ?profile=1)
+    python profiling.py Data/.cache/profile/spans.jsonl
+"""
+import argparse
+import functools
+import json
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+import dataset
+
+LOG_PATH = dataset.CACHE_DIR / "profile" / "spans.jsonl"
+# Environment variable enabling the profiler of every session
+ENV_VAR = "HAPLO_PROFILE"
+# Spans kept in memory per session for the debug panel
+MAX_SPANS = 2000
+
+_log_lock = threading.Lock()
+# Enabled profilers; tracemalloc runs while there is one
+_tracing = 0
+_tracing_lock = threading.Lock()
+
+
+def _trace_memory(enable: bool):
+    """Counts the enabled profilers, starting tracemalloc with the first and stopping it with the last."""
+    global _tracing
+    with _tracing_lock:
+        _tracing += 1 if enable else -1
+        if enable and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not _tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class Profiler:
+    """
+    Records the stages of the reruns of one session
+
+    Attributes:
+        enabled (bool): Whether spans are recorded
+        session (str): Identifier of the session in the log
+        log_path (Path): JSON lines log the spans are appended to (None to keep them in memory only)
+        spans (deque): Latest recorded spans
+    """
+
+    def __init__(self, enabled: bool = False, log_path=LOG_PATH, max_spans: int = MAX_SPANS):
+        self._enabled = False
+        self.enabled = enabled
+        self.session = uuid.uuid4().hex[:12]
+        self.log_path = Path(log_path) if log_path is not None else None
+        self.spans = deque(maxlen=max_spans)
+        self.rerun = 0
+        self._kind = None
+        self._stack = []
+        self._pending = []
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        value = bool(value)
+        if value != self._enabled:
+            _trace_memory(value)
+            self._enabled = value
+
+    def __del__(self):
+        # A session closed with its profiler enabled releases its hold on tracemalloc
+        if getattr(self, "_enabled", False):
+            _trace_memory(False)
+
+    def start_rerun(self):
+        """Starts a full rerun: spans until end_rerun belong to it."""
+        self._flush()
+        self._stack = []
+        if self.enabled:
+            self._begin("full")
+            self._open("")
+
+    def end_rerun(self, **fields):
+        """Ends the full rerun, records its total time (with extra fields) and writes its spans."""
+        if self._stack and self._kind == "full":
+            while len(self._stack) > 1:
+                self._close(self._stack[-1], {})
+            self._close(self._stack[-1], dict(fields, name="rerun"))
+        self._flush()
+
+    @contextmanager
+    def span(self, name: str, figure=None, **fields):
+        """
+        Records the stage run inside the with block
+
+        Args:
+            name (str): Name of the stage
+            figure (go.Figure): Figure shown by the stage; the size of its JSON is recorded
+            **fields: Extra values recorded with the span
+
+        Yields:
+            dict: The record of the span, to which the block can add values (e.g. rows)
+        """
+        if not self.enabled:
+            yield {}
+            return
+        if not self._stack:
+            self._begin("fragment")
+        frame = self._open(name)
+        try:
+            yield frame["record"]
+        finally:
+            if figure is not None:
+                fields["bytes"] = len(figure.to_json())
+            self._close(frame, fields)
+            if not self._stack:
+                self._flush()
+
+    def trace(self, name: str = None):
+        """Decorator recording each call of a function as a span (named after the function by default)."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def table(self, reruns: int = 5) -> pd.DataFrame:
+        """Returns the spans of the latest reruns, most recent first."""
+        spans = pd.DataFrame(list(self.spans))
+        if spans.empty:
+            return spans
+        latest = sorted(spans["rerun"].unique())[-reruns:]
+        spans = spans[spans["rerun"].isin(latest)].iloc[::-1]
+        columns = ["rerun", "kind", "path", "seconds", "peak_bytes", "bytes"]
+        return spans[[column for column in columns if column in spans] +
+                     [column for column in spans if column not in columns and column not in ("session", "time", "name", "depth")]]
+
+    def _begin(self, kind: str):
+        self.rerun += 1
+        self._kind = kind
+
+    def _open(self, name: str) -> dict:
+        # Another enabled profiler would reset the peak under this one (and this one under it)
+        exclusive = _tracing == 1
+        current, peak = tracemalloc.get_traced_memory()
+        if exclusive:
+            if self._stack:
+                parent = self._stack[-1]
+                parent["peak"] = max(parent["peak"], peak)
+            tracemalloc.reset_peak()
+        path = "/".join(frame["name"] for frame in self._stack if frame["name"])
+        frame = {
+            "name": name,
+            "start": time.perf_counter(),
+            "memory": current,
+            "peak": current,
+            "exclusive": exclusive,
+            "record": {
+                "session": self.session,
+                "rerun": self.rerun,
+                "kind": self._kind,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "name": name,
+                "path": f"{path}/{name}" if path and name else path or name,
+                "depth": len(self._stack),
+            },
+        }
+        self._stack.append(frame)
+        return frame
+
+    def _close(self, frame: dict, fields: dict):
+        seconds = time.perf_counter() - frame["start"]
+        exclusive = frame["exclusive"] and _tracing == 1
+        frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+        self._stack.pop()
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak"] = max(parent["peak"], frame["peak"])
+            parent["exclusive"] = parent["exclusive"] and exclusive
+        peak_bytes = frame["peak"] - frame["memory"] if exclusive else None
+        record = dict(frame["record"], seconds=round(seconds, 6), peak_bytes=peak_bytes)
+        record.update(fields)
+        if not record["path"]:
+            record["path"] = record["name"]
+        self.spans.append(record)
+        self._pending.append(record)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        if self.log_path is None:
+            return
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in pending)
+        with _log_lock:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as log:
+                log.write(lines)
+
+
+def read_log(path=LOG_PATH) -> pd.DataFrame:
+    """
+    Returns the spans appended to a log by the profilers of the app
+
+    Returns:
+        pd.DataFrame: One row per span (session, rerun, kind, path, seconds, peak_bytes, bytes, ...)
+    """
+    return pd.read_json(path, lines=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarizes the spans logged by the app profiler")
+    parser.add_argument("log", nargs="?", default=LOG_PATH)
+    args = parser.parse_args()
+    spans = read_log(args.log)
+    summary = spans.groupby("path").agg(count=("seconds", "size"), median_seconds=("seconds", "median"),
+                                        max_seconds=("seconds", "max"), peak_mb=("peak_bytes", "max"))
+    summary["peak_mb"] = summary["peak_mb"] / 1024 ** 2
+    if "bytes" in spans:
+        summary["median_kb"] = spans.groupby("path")["bytes"].median() / 1024
+    print(summary.sort_values("median_seconds", ascending=False).to_string())
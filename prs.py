@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Out-of-core polygenic risk scoring over EIGENSTRAT genotypes.
+
+Description: Recomputes the schizophrenia PRS of the samples from an AADR genotype release
+(prefix.geno, prefix.snp, prefix.ind) and a summary-statistics weight file, instead of reading
+the precomputed PRS_20PCs column. The .geno file is memory-mapped (packed GENO format, 2 bits
+per genotype, or the text EIGENSTRAT format) and only the records of the weighted SNPs are read,
+one block of SNPs at a time, so the genotype matrix never has to fit in memory. Each block is
+unpacked with a lookup table into counts of the reference allele, missing genotypes are
+replaced by the mean count of the SNP over the scored samples, and the block is added to the
+scores with a single weights @ dosages product. Weights are aligned on the .snp alleles: an
+effect allele equal to the alternative allele (directly or on the other strand) flips the sign
+of the weight, and SNPs whose alleles do not match are dropped. The raw score can then be
+adjusted for ancestry by regressing out the principal components (e.g. PC1-PC20) and
+standardized. The output csv (Genetic ID, PRS_SCZ) is read by dataset.load_dataset as its
+scores file, so the cached dataset is rebuilt with the new PRS.
+
+User Defined Functions:
+    read_ind(path): Returns the samples of an .ind file.
+    read_snp(path): Returns the SNPs and alleles of a .snp file.
+    read_weights(path): Returns the SNP, effect allele and weight of a summary-statistics file.
+    read_pcs(path): Returns the principal components of each sample (.evec or csv).
+    score(prefix, weights, samples): Returns the raw score and the number of observed SNPs of each sample.
+    regress_pcs(scores, pcs): Returns the standardized residuals of the scores on the PCs.
+    compute_prs(prefix, weights, pcs): Returns the PRS_SCZ of each sample.
+
+Usage:
+    python prs.py v62.0_1240k_public --weights Data/scz_weights.tsv --pcs Data/pcs.csv --out Data/prs_scz.csv --dataset Data/data_pca.csv
+"""
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import dataset
+
+SCORES_PATH = dataset.SCORES_PATH
+# Memory used by the unpacked dosages of one block of SNPs
+BLOCK_BYTES = 256 * 1024 * 1024
+N_PCS = 20
+MISSING = 3
+# Packed GENO records are at least 48 bytes long
+MIN_RECORD = 48
+
+# Byte -> the 4 genotypes it packs, most significant bits first
+_UNPACK = np.array([[(byte >> shift) & 3 for shift in (6, 4, 2, 0)] for byte in range(256)], dtype=np.uint8)
+_COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+# Accepted column names of a summary-statistics file, first match wins
+WEIGHT_COLUMNS = {
+    "snp": ["SNP", "rsid", "RSID", "ID", "MarkerName", "variant_id"],
+    "effect": ["A1", "EffectAllele", "effect_allele", "EA", "ALT"],
+    "beta": ["BETA", "beta", "Beta", "weight", "EFFECT"],
+    "or": ["OR", "or"],
+}
+
+
+def read_ind(path) -> pd.DataFrame:
+    """Returns the id, sex and population of each sample of an .ind file, in genotype order."""
+    return pd.read_csv(path, sep=r"\s+", header=None, names=["Genetic ID", "Sex", "Population"],
+                       usecols=[0, 1, 2], dtype=str)
+
+
+def read_snp(path) -> pd.DataFrame:
+    """Returns the id, reference and alternative allele of each SNP of a .snp file, in genotype order."""
+    return pd.read_csv(path, sep=r"\s+", header=None, names=["SNP", "ref", "alt"], usecols=[0, 4, 5], dtype=str)
+
+
+def _column(header, kind: str):
+    return next((name for name in WEIGHT_COLUMNS[kind] if name in header), None)
+
+
+def read_weights(path) -> pd.DataFrame:
+    """
+    Reads a summary-statistics weight file (csv, or tab or space separated)
+
+    The weight is the BETA column, or the log of the OR column when there is no BETA.
+
+    Returns:
+        pd.DataFrame: SNP, effect (allele) and weight of each SNP
+    """
+    sep = "," if Path(path).suffix == ".csv" else r"\s+"
+    table = pd.read_csv(path, sep=sep, dtype=str)
+    snp, effect = _column(table.columns, "snp"), _column(table.columns, "effect")
+    beta, odds = _column(table.columns, "beta"), _column(table.columns, "or")
+    if snp is None or effect is None or (beta is None and odds is None):
+        raise ValueError(f"{path} needs a SNP id, an effect allele and a BETA or OR column")
+    weight = pd.to_numeric(table[beta]) if beta is not None else np.log(pd.to_numeric(table[odds]))
+    weights = pd.DataFrame({"SNP": table[snp], "effect": table[effect].str.upper(), "weight": weight})
+    return weights.dropna().drop_duplicates("SNP")
+
+
+def read_pcs(path, n_pcs: int = N_PCS) -> pd.DataFrame:
+    """
+    Reads the principal components of each sample
+
+    Args:
+        path (str | Path): smartpca .evec file (id, PCs, population) or csv with Genetic ID and PC1..PCn
+        n_pcs (int): Number of components kept
+
+    Returns:
+        pd.DataFrame: PC1..PCn indexed by Genetic ID
+    """
+    if Path(path).suffix == ".csv":
+        table = pd.read_csv(path).set_index("Genetic ID")
+        columns = [f"PC{i}" for i in range(1, n_pcs + 1) if f"PC{i}" in table.columns]
+        return table[columns].astype(float)
+    table = pd.read_csv(path, sep=r"\s+", header=None, comment="#")
+    pcs = table.iloc[:, 1:-1].iloc[:, :n_pcs].astype(float)
+    pcs.columns = [f"PC{i}" for i in range(1, pcs.shape[1] + 1)]
+    pcs.index = table.iloc[:, 0].rename("Genetic ID")
+    return pcs
+
+
+class GenoMatrix:
+    """
+    Memory-mapped genotypes of an EIGENSTRAT .geno file (packed GENO or text)
+
+    Attributes:
+        n_ind (int): Number of samples
+        n_snp (int): Number of SNPs
+        packed (bool): Whether the file uses the packed 2-bit format
+    """
+
+    def __init__(self, path, n_ind: int, n_snp: int):
+        self.n_ind, self.n_snp = n_ind, n_snp
+        with open(path, "rb") as handle:
+            magic = handle.read(5)
+        if magic.startswith(b"TGENO"):
+            raise ValueError(f"{path} is transposed (TGENO); convert it to GENO with convertf first")
+        self.packed = magic.startswith(b"GENO")
+        if self.packed:
+            record = max(MIN_RECORD, -(-n_ind // 4))
+            self._records = np.memmap(path, dtype=np.uint8, mode="r", offset=record, shape=(n_snp, record))
+            header = bytes(np.memmap(path, dtype=np.uint8, mode="r", shape=(record,))).split(b"\0")[0].split()
+            if (int(header[1]), int(header[2])) != (n_ind, n_snp):
+                raise ValueError(f"{path} has {header[1].decode()} samples x {header[2].decode()} SNPs, "
+                                 f"expected {n_ind} x {n_snp}")
+        else:
+            self._records = np.memmap(path, dtype=np.uint8, mode="r", shape=(n_snp, n_ind + 1))
+
+    def block(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the reference allele counts of some SNPs
+
+        Args:
+            rows (np.ndarray): Sorted SNP indexes
+
+        Returns:
+            np.ndarray: uint8 array (len(rows), n_ind) of counts 0-2, MISSING when not called
+        """
+        records = self._records[rows]
+        if self.packed:
+            return _UNPACK[records].reshape(len(rows), -1)[:, :self.n_ind]
+        genotypes = records[:, :self.n_ind] - np.uint8(ord("0"))
+        genotypes[genotypes > 2] = MISSING
+        return genotypes
+
+
+def align_weights(snps: pd.DataFrame, weights: pd.DataFrame) -> tuple:
+    """
+    Aligns the weights on the reference alleles of the .snp file
+
+    The genotypes count the reference allele, so a weight on the alternative allele w * (2 - g)
+    becomes -w * g plus a constant 2w. Strand-ambiguous SNPs (A/T, C/G) are only matched directly.
+
+    Returns:
+        tuple: (sorted SNP rows, weight on the reference allele count, constant of the score)
+    """
+    joined = snps.reset_index(names="row").merge(weights, on="SNP")
+    ref, alt, effect = joined["ref"].str.upper(), joined["alt"].str.upper(), joined["effect"]
+    flipped = effect.str.translate(_COMPLEMENT)
+    ambiguous = ref.str.translate(_COMPLEMENT) == alt
+    on_ref = (effect == ref) | (~ambiguous & (flipped == ref))
+    on_alt = (effect == alt) | (~ambiguous & (flipped == alt))
+    joined = joined[on_ref | on_alt].assign(on_alt=on_alt[on_ref | on_alt]).sort_values("row")
+    sign = np.where(joined["on_alt"], -1.0, 1.0)
+    weight = joined["weight"].to_numpy(dtype=np.float64)
+    constant = 2 * weight[joined["on_alt"].to_numpy()].sum()
+    return joined["row"].to_numpy(), (sign * weight).astype(np.float32), constant
+
+
+def score(prefix, weights: pd.DataFrame, samples=None, block_bytes: int = BLOCK_BYTES) -> pd.DataFrame:
+    """
+    Scores the samples of a genotype release, streaming over blocks of SNPs
+
+    Args:
+        prefix (str | Path): Path of the release without extension (prefix.geno, .snp and .ind)
+        weights (pd.DataFrame): SNP, effect and weight (see read_weights)
+        samples (list): Genetic IDs to score (default: every sample); also the set the
+        missing genotypes are imputed from
+        block_bytes (int): Memory budget of the unpacked dosages of a block
+
+    Returns:
+        pd.DataFrame: score and n_snps (observed weighted SNPs) indexed by Genetic ID
+    """
+    prefix = str(prefix)
+    individuals = read_ind(prefix + ".ind")
+    snps = read_snp(prefix + ".snp")
+    geno = GenoMatrix(prefix + ".geno", len(individuals), len(snps))
+    rows, weight, constant = align_weights(snps, weights)
+    if not len(rows):
+        raise ValueError("None of the weighted SNPs matches the .snp alleles")
+
+    keep = np.arange(len(individuals))
+    if samples is not None:
+        keep = np.flatnonzero(individuals["Genetic ID"].isin(set(samples)).to_numpy())
+    scores = np.full(len(keep), constant, dtype=np.float64)
+    observed = np.zeros(len(keep), dtype=np.int64)
+    # Per sample and SNP of a block: the unpacked and selected uint8 genotypes and two float32 dosages
+    size = max(1, block_bytes // (10 * max(geno.n_ind, 1)))
+    for start in range(0, len(rows), size):
+        genotypes = geno.block(rows[start:start + size])[:, keep]
+        called = genotypes != MISSING
+        dosage = genotypes.astype(np.float32)
+        dosage[~called] = 0
+        counts = called.sum(axis=1)
+        mean = np.divide(dosage.sum(axis=1), counts, out=np.zeros(len(counts), dtype=np.float32), where=counts > 0)
+        dosage = np.where(called, dosage, mean[:, None])
+        scores += weight[start:start + size] @ dosage
+        observed += called.sum(axis=0)
+    return pd.DataFrame({"score": scores, "n_snps": observed},
+                        index=pd.Index(individuals["Genetic ID"].to_numpy()[keep], name="Genetic ID"))
+
+
+def regress_pcs(scores: pd.Series, pcs: pd.DataFrame) -> pd.Series:
+    """
+    Regresses the principal components out of the scores (least squares with an intercept)
+
+    Returns:
+        pd.Series: Standardized residuals, NaN for the samples without PCs
+    """
+    pcs = pcs.reindex(scores.index)
+    rows = pcs.notna().all(axis=1).to_numpy() & scores.notna().to_numpy()
+    design = np.column_stack([np.ones(rows.sum()), pcs.to_numpy()[rows]])
+    y = scores.to_numpy(dtype=np.float64)[rows]
+    coefficients, *_ = np.linalg.lstsq(design, y, rcond=None)
+    residuals = y - design @ coefficients
+    adjusted = pd.Series(np.nan, index=scores.index, name=scores.name)
+    adjusted[rows] = (residuals - residuals.mean()) / residuals.std()
+    return adjusted
+
+
+def compute_prs(prefix, weights, pcs=None, samples=None, n_pcs: int = N_PCS,
+                block_bytes: int = BLOCK_BYTES) -> pd.Series:
+    """
+    Returns the PRS of each sample: the raw score adjusted for the PCs, or standardized without PCs
+
+    Args:
+        prefix (str | Path): Path of the genotype release without extension
+        weights (str | Path | pd.DataFrame): Summary-statistics file or read_weights table
+        pcs (str | Path | pd.DataFrame): Optional .evec/csv file or read_pcs table
+        samples (list): Genetic IDs to score (default: every sample)
+        n_pcs (int): Number of components regressed out
+        block_bytes (int): Memory budget of a block of SNPs
+
+    Returns:
+        pd.Series: float32 PRS_SCZ indexed by Genetic ID
+    """
+    if not isinstance(weights, pd.DataFrame):
+        weights = read_weights(weights)
+    raw = score(prefix, weights, samples, block_bytes)["score"]
+    if pcs is None:
+        prs = (raw - raw.mean()) / raw.std()
+    else:
+        if not isinstance(pcs, pd.DataFrame):
+            pcs = read_pcs(pcs, n_pcs)
+        prs = regress_pcs(raw, pcs.iloc[:, :n_pcs])
+    return prs.astype("float32").rename("PRS_SCZ")
+
+
+def write_scores(prs: pd.Series, path=SCORES_PATH) -> Path:
+    """Writes the scores as a csv readable by dataset.read_scores and returns its path."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    prs.rename("PRS_SCZ").reset_index().to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes the PRS of the samples of an EIGENSTRAT genotype release")
+    parser.add_argument("prefix", help="genotype release without extension (prefix.geno, .snp, .ind)")
+    parser.add_argument("--weights", required=True, help="summary statistics with SNP, A1 and BETA or OR columns")
+    parser.add_argument("--pcs", default=None, help="smartpca .evec, or csv with the PCs of each Genetic ID (see pca.py)")
+    parser.add_argument("--n-pcs", type=int, default=N_PCS)
+    parser.add_argument("--samples", default=None, help="dataset source whose Genetic IDs are scored (default: all)")
+    parser.add_argument("--block-mb", type=int, default=BLOCK_BYTES // 1024 ** 2)
+    parser.add_argument("--out", default=SCORES_PATH)
+    parser.add_argument("--dataset", default=None, help="dataset source whose cache is rebuilt with these scores")
+    args = parser.parse_args()
+    # The cache is only reused by the app when it reads the same scores file
+    expected = Path(os.environ.get("ADNA_SCORES") or dataset.SCORES_PATH)
+    if args.dataset is not None and expected.resolve() != Path(args.out).resolve():
+        parser.error(f"the app reads its scores from {expected}; set ADNA_SCORES={args.out} to cache the dataset with them")
+
+    samples = None
+    if args.samples is not None:
+        samples = dataset.build_dataset(args.samples)["Genetic ID"].astype(str)
+    prs = compute_prs(args.prefix, args.weights, args.pcs, samples, args.n_pcs, args.block_mb * 1024 ** 2)
+    path = write_scores(prs, args.out)
+    print(f"{prs.notna().sum()} samples scored, written to {path}")
+    if args.dataset is not None:
+        df = dataset.load_dataset(args.dataset, scores=path)
+        print(f"{len(df)} samples cached from {args.dataset} with the new scores")
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless batch renderer of the dashboard figures.
+
+Description: Renders, outside Streamlit, the figures of the default views of the app with the
+same builders (figures.py): the EDA charts, the mode-level HaploTracker charts of every mode,
+and the map, movement and PRS charts of every top-level clade of every mode. Figures are
+rendered in parallel across a process pool, each worker loading the shared dataset once, and
+written as Plotly JSON (optionally HTML) under a directory per dataset version, with a
+manifest mapping figure names to files. The app looks a figure up by the same name
+(figure_name) and reads it from disk instead of building it; any view not in the manifest
+is built live as before.
+
+User Defined Functions:
+    figure_name(chart, mode, **params): Returns the name of a figure in the manifest.
+    jobs(depth): Returns the figures to render for the loaded dataset.
+    render_all(source): Renders every figure and writes the manifest.
+    load_figure(version, name): Returns a prerendered figure, or None when it is not rendered.
+
+Usage:
+    python render.py --workers 4 --html
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cube
+import dataset
+import dispersal
+import figure_cache
+import figures
+import haplogroups
+import spatial
+import trajectory
+
+OUTPUT_DIR = dataset.CACHE_DIR / "figures"
+MANIFEST = "manifest.json"
+# Defaults of the HaploTracker widgets
+MAP_TYPE = "USGS"
+PATH_TYPE = "nearest predecessor"
+
+_state = {}
+_manifests = {}
+
+
+def figure_name(chart: str, mode: str = None, **params) -> str:
+    """
+    Returns the name of a figure: its chart, its mode (None for the EDA tab) and its parameters
+
+    Example: figure_name("map", "MtDNA", selection=["H"], zoom=3) -> "MtDNA/map?selection=H&zoom=3"
+    """
+    values = []
+    for key, value in sorted(params.items()):
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(item) for item in value)
+        values.append(f"{key}={value}")
+    return f"{mode or 'EDA'}/{chart}" + ("?" + "&".join(values) if values else "")
+
+
+def _init(source, scores=None):
+    """Loads the dataset and its indexes in a worker (pool initializer)."""
+    shared = dataset.load_shared_dataset(source, scores=scores)
+    _state.update(shared=shared, cube=cube.AggregateCube(shared.frame), modes={})
+
+
+def _mode(mode: str) -> tuple:
+    """Returns the view, clade trie and spatial index of a mode, built once per process."""
+    if mode not in _state["modes"]:
+        view = _state["shared"].view(mode)
+        _state["modes"][mode] = (view, haplogroups.CladeTrie(view["mtdna"]), spatial.SpatialIndex(view))
+    return _state["modes"][mode]
+
+
+def jobs(depth: int = None) -> list:
+    """
+    Returns the figures of the default views: EDA charts, mode charts, and clade charts per mode
+
+    Args:
+        depth (int): Clade depth of the per-clade charts (default: the default depth of the clade selector)
+
+    Returns:
+        list: (name, chart, mode, params) of each figure
+    """
+    found = [
+        (figure_name("heatmap"), "heatmap", None, {}),
+        (figure_name("period_bar"), "period_bar", None, {}),
+        (figure_name("period_tests"), "period_tests", None, {}),
+        (figure_name("region_tests"), "region_tests", None, {}),
+    ]
+    trend = dict(x_range=None, trend=True, window=trajectory.WINDOW, stat="mean")
+    found.append((figure_name("prs_time", **trend), "prs_time", None, trend))
+    for mode in dataset.MODES:
+        view, clades, spatial_index = _mode(mode)
+        default_depth = min(haplogroups.DEFAULT_DEPTH, clades.max_depth)
+        found.append((figure_name("violin", mode), "violin", mode, {}))
+        for color in ("Region", "Period"):
+            params = dict(color=color, depth=default_depth)
+            found.append((figure_name("top", mode, **params), "top", mode, params))
+        for clade in clades.nodes(depth or default_depth):
+            selection = [clade]
+            zoom = spatial_index.auto_zoom(clades.positions(selection))
+            params = dict(selection=selection, map_type=MAP_TYPE, zoom=zoom)
+            found.append((figure_name("map", mode, **params), "map", mode, params))
+            params = dict(selection=selection, animate=clade, map_type=MAP_TYPE, max_frames=figures.MAX_FRAMES,
+                          sampling=figures.DECIMATION, path=PATH_TYPE, max_gap=dispersal.MAX_GAP)
+            found.append((figure_name("movement", mode, **params), "movement", mode, params))
+            params = dict(selection=selection)
+            found.append((figure_name("prs_time", mode, **params), "prs_time", mode, params))
+    return found
+
+
+def build_figure(chart: str, mode: str = None, params: dict = None):
+    """Builds one figure of jobs() in the current process (see _init)."""
+    params = params or {}
+    data, aggregates = _state["shared"].frame, _state["cube"]
+    if mode is None:
+        if chart == "heatmap":
+            return figures.region_period_heatmap(aggregates)
+        if chart == "period_bar":
+            return figures.period_region_bar(aggregates)
+        if chart == "period_tests":
+            return figures.period_tests_figure(data)
+        if chart == "region_tests":
+            return figures.region_tests_figure(data)
+        if chart == "prs_time":
+            trend = trajectory.rolling_trajectory(data, x="Date", window=params["window"], stat=params["stat"])
+            return figures.prs_time_figure(data, x='Date', y='PRS_SCZ', color='Region', trajectory=trend)
+        raise ValueError(f"Unknown chart {chart}")
+
+    view, clades, spatial_index = _mode(mode)
+    if chart == "violin":
+        return figures.violin_figure(view)
+    if chart == "top":
+        counts = aggregates.counts(['mtdna', params["color"]], mode)
+        return figures.top_clades_figure(clades.top(counts, params["depth"], 20), params["color"])
+    positions = clades.positions(params["selection"])
+    select = view.iloc[positions].sort_values(by="Age", ascending=False)
+    if chart == "map":
+        return figures.cluster_map(spatial_index.clusters(positions, params["zoom"]), params["map_type"])
+    if chart == "movement":
+        animate_data = view.iloc[clades.positions([params["animate"]])].sort_values(by="Age", ascending=False)
+        center = dict(lat=select["Lat"].mean(), lon=select["Long"].mean())
+        predecessor = None
+        if params["path"] == PATH_TYPE:
+            predecessor = dispersal.movement_links(animate_data, max_gap=params["max_gap"])["predecessor"].to_numpy()
+        return figures.movement_figure(animate_data, params["map_type"], center, params["max_frames"],
+                                       params["sampling"], predecessor)
+    if chart == "prs_time":
+        trend = trajectory.rolling_trajectory(select, x='Age', window=trajectory.WINDOW, stat="mean")
+        return figures.prs_time_figure(select, x='Age', y='PRS_SCZ', color='Region', period_bands=False, trajectory=trend)
+    raise ValueError(f"Unknown chart {chart}")
+
+
+def _render(job: tuple, directory: Path, html: bool) -> tuple:
+    """Builds a figure and writes it; returns its manifest entry."""
+    name, chart, mode, params = job
+    start = time.perf_counter()
+    fig = build_figure(chart, mode, params)
+    stem = hashlib.sha256(name.encode()).hexdigest()[:24]
+    payload = fig.to_json()
+    (directory / f"{stem}.json").write_text(payload)
+    entry = {"json": f"{stem}.json", "bytes": len(payload)}
+    if html:
+        fig.write_html(directory / f"{stem}.html", include_plotlyjs="cdn")
+        entry["html"] = f"{stem}.html"
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return name, entry
+
+
+def render_all(source=dataset.DATA_PATH, scores=None, out_dir=OUTPUT_DIR, workers: int = None,
+               html: bool = False, depth: int = None) -> Path:
+    """
+    Renders every figure of jobs() and writes the manifest
+
+    Args:
+        source (str | Path): Dataset source (see dataset.load_dataset)
+        scores (str | Path): Optional PRS scores replacing those of the source (default: dataset.scores_path(),
+        as in the app)
+        out_dir (str | Path): Output directory; figures go to a subdirectory per dataset version
+        workers (int): Number of processes (default: one per CPU)
+        html (bool): Also write standalone HTML files
+        depth (int): Clade depth of the per-clade charts (default: the default depth of the clade selector)
+
+    Returns:
+        Path: Path of the manifest
+    """
+    scores = scores if scores is not None else dataset.scores_path()
+    _init(source, scores)
+    shared = _state["shared"]
+    directory = Path(out_dir) / shared.version
+    directory.mkdir(parents=True, exist_ok=True)
+    todo = jobs(depth)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        rendered = [_render(job, directory, html) for job in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(source, scores)) as pool:
+            rendered = list(pool.map(_render, todo, [directory] * len(todo), [html] * len(todo)))
+
+    manifest = {
+        "version": shared.version,
+        "source": str(source),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seconds": round(time.perf_counter() - start, 3),
+        "figures": dict(rendered),
+    }
+    path = directory / MANIFEST
+    path.write_text(json.dumps(manifest, indent=1, ensure_ascii=False))
+    return path
+
+
+def load_figure(version: str, name: str, out_dir=OUTPUT_DIR):
+    """
+    Returns a figure rendered by render_all for a dataset version
+
+    Returns:
+        go.Figure: The figure, or None when it is not in the manifest
+    """
+    path = Path(out_dir) / version / MANIFEST
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    # The manifest is re-read only when the renderer rewrites it
+    if _manifests.get(path, (None,))[0] != mtime:
+        _manifests[path] = (mtime, json.loads(path.read_text())["figures"])
+    entry = _manifests[path][1].get(name)
+    if entry is None:
+        return None
+    return figure_cache.from_payload((path.parent / entry["json"]).read_text())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renders the dashboard figures of the default views to Plotly JSON")
+    parser.add_argument("source", nargs="?", default=dataset.DATA_PATH)
+    parser.add_argument("--scores", default=dataset.scores_path(), help="csv with the PRS of each Genetic ID")
+    parser.add_argument("--out", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--html", action="store_true", help="also write standalone HTML files")
+    parser.add_argument("--depth", type=int, default=None,
+                        help="clade depth of the map and movement charts (default: that of the clade selector)")
+    args = parser.parse_args()
+    manifest = render_all(args.source, args.scores, args.out, args.workers, args.html, args.depth)
+    figures_count = len(json.loads(manifest.read_text())["figures"])
+    print(f"{figures_count} figures rendered, manifest written to {manifest}")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Permutation tests and bootstrap effect sizes for PRS differences between groups.
+
+Description: Complements the Dunn tests of the EDA tab with, for every pair of periods or
+regions, a two-sided permutation test on the difference of mean PRS and a bootstrap
+confidence interval of Hedges' g. Resamples are generated in vectorized blocks (one matrix of
+permutations or resampled indices per block), and the blocks run across a process pool.
+Every block has its own seed spawned from the base seed, so the results are reproducible
+and do not depend on the number of workers. Tables are cached on disk per dataset fingerprint
+(see stats_cache.cached_table).
+
+User Defined Functions:
+    permutation_test(a, b): Returns the mean difference and its permutation p-value.
+    bootstrap_effect_size(a, b): Returns Hedges' g and its bootstrap confidence interval.
+    compare_groups(df, x, y): Runs both for every pair of groups, with the disk cache.
+
+Usage:
+    python resampling.py Period --resamples 100000
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import dataset
+
+N_RESAMPLES = 100000
+# Matrix elements (resamples x samples) generated per block, about 32 MB of float64
+BLOCK_ELEMENTS = 4000000
+
+
+def _blocks(n_resamples: int, n_values: int, seed: int) -> list:
+    """Splits the resamples in blocks and gives each block its own seed."""
+    size = max(1, min(n_resamples, BLOCK_ELEMENTS // max(n_values, 1)))
+    sizes = [min(size, n_resamples - start) for start in range(0, n_resamples, size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return list(zip(sizes, seeds))
+
+
+def make_pool(workers: int = None):
+    """
+    Returns a process pool for the resampling blocks, or None to run them in-process
+
+    The pool uses spawn, which is safe to start from the threads of a Streamlit server. The
+    workers only import this module, numpy and pandas.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _run_blocks(worker, arguments: list, pool=None) -> list:
+    """Runs worker over the blocks, in the pool if one is given."""
+    if pool is None or len(arguments) == 1:
+        return [worker(*args) for args in arguments]
+    return list(pool.map(worker, *zip(*arguments)))
+
+
+def _permutation_block(pooled: np.ndarray, n_a: int, observed: float, size: int, seed) -> int:
+    """Counts the permutations of a block whose mean difference is at least as extreme as observed."""
+    rng = np.random.default_rng(seed)
+    permuted = rng.permuted(np.broadcast_to(pooled, (size, len(pooled))), axis=1)
+    differences = permuted[:, :n_a].mean(axis=1) - permuted[:, n_a:].mean(axis=1)
+    return int(np.count_nonzero(np.abs(differences) >= abs(observed) - 1e-12))
+
+
+def _hedges_g(a: np.ndarray, b: np.ndarray, axis: int = -1) -> np.ndarray:
+    n_a, n_b = a.shape[axis], b.shape[axis]
+    pooled_var = ((n_a - 1) * a.var(axis=axis, ddof=1) + (n_b - 1) * b.var(axis=axis, ddof=1)) / (n_a + n_b - 2)
+    correction = 1 - 3 / (4 * (n_a + n_b) - 9)
+    return correction * (a.mean(axis=axis) - b.mean(axis=axis)) / np.sqrt(pooled_var)
+
+
+def _bootstrap_block(a: np.ndarray, b: np.ndarray, size: int, seed) -> np.ndarray:
+    """Returns Hedges' g of a block of resamples (each group resampled with replacement)."""
+    rng = np.random.default_rng(seed)
+    resampled_a = a[rng.integers(0, len(a), size=(size, len(a)))]
+    resampled_b = b[rng.integers(0, len(b), size=(size, len(b)))]
+    return _hedges_g(resampled_a, resampled_b)
+
+
+def permutation_test(a, b, n_resamples: int = N_RESAMPLES, seed: int = 0, pool=None) -> dict:
+    """
+    Two-sided permutation test on the difference of means
+
+    Args:
+        a, b (array-like): Values of the two groups
+        n_resamples (int): Number of permutations
+        seed (int): Base seed
+        pool (ProcessPoolExecutor): Pool running the blocks (see make_pool); None runs them in-process
+
+    Returns:
+        dict: mean_diff, p_value (with the +1 correction) and n_resamples
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    observed = a.mean() - b.mean()
+    pooled = np.concatenate([a, b])
+    arguments = [(pooled, len(a), observed, size, block_seed)
+                 for size, block_seed in _blocks(n_resamples, len(pooled), seed)]
+    extreme = sum(_run_blocks(_permutation_block, arguments, pool))
+    return {"mean_diff": observed, "p_value": (extreme + 1) / (n_resamples + 1), "n_resamples": n_resamples}
+
+
+def bootstrap_effect_size(a, b, n_resamples: int = N_RESAMPLES, confidence: float = 0.95,
+                          seed: int = 0, pool=None) -> dict:
+    """
+    Hedges' g between two groups with a percentile bootstrap confidence interval
+
+    Returns:
+        dict: hedges_g, g_lower and g_upper
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    arguments = [(a, b, size, block_seed)
+                 for size, block_seed in _blocks(n_resamples, len(a) + len(b), seed)]
+    resampled = np.concatenate(_run_blocks(_bootstrap_block, arguments, pool))
+    alpha = 1 - confidence
+    lower, upper = np.nanpercentile(resampled, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return {"hedges_g": float(_hedges_g(a, b)), "g_lower": lower, "g_upper": upper}
+
+
+def compare_groups(df: pd.DataFrame, x: str, y: str = "PRS_SCZ", order: list = None,
+                   n_resamples: int = N_RESAMPLES, seed: int = 0, workers: int = None,
+                   cache_dir=dataset.CACHE_DIR / "stats", pool=None) -> pd.DataFrame:
+    """
+    Runs the permutation test and the bootstrap effect size for every pair of groups of x
+
+    Args:
+        df (pd.DataFrame): Samples
+        x (str): Grouping column (e.g. Period or Region)
+        y (str): Compared value
+        order (list): Groups to compare, in order (default: every group, in order of appearance)
+        n_resamples (int): Number of permutations and of bootstrap resamples
+        seed (int): Base seed
+        workers (int): Number of processes of the pool started for this call (default: one per CPU)
+        cache_dir (str | Path): Directory of the disk cache (None disables it)
+        pool (ProcessPoolExecutor): Long-lived pool running the blocks (see make_pool); when given,
+        no pool is started and it is left running
+
+    Returns:
+        pd.DataFrame: One row per pair with n1, n2, mean_diff, p_value, hedges_g, g_lower and g_upper
+    """
+    # Imported here so that the pool workers do not load the plotting and test libraries
+    import stats_cache
+
+    samples = df[[x, y]].dropna()
+    groups = order if order is not None else list(samples[x].unique())
+    values = {group: part[y].to_numpy(dtype=float) for group, part in samples.groupby(x, observed=True)}
+
+    def compute():
+        rows = []
+        own_pool = make_pool(workers) if pool is None else None
+        try:
+            for pair_seed, (group1, group2) in enumerate(itertools.combinations(groups, 2)):
+                a, b = values.get(group1, np.empty(0)), values.get(group2, np.empty(0))
+                if len(a) < 2 or len(b) < 2:
+                    continue
+                row = {"group1": group1, "group2": group2, "n1": len(a), "n2": len(b)}
+                row.update(permutation_test(a, b, n_resamples, seed + pair_seed, pool or own_pool))
+                row.update(bootstrap_effect_size(a, b, n_resamples, seed=seed + pair_seed, pool=pool or own_pool))
+                rows.append(row)
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown()
+        return pd.DataFrame(rows)
+
+    key = ["resampling", stats_cache.fingerprint(df, [x, y]), x, y, groups, n_resamples, seed]
+    return stats_cache.cached_table(key, compute, cache_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Permutation tests and bootstrap effect sizes of PRS_SCZ between groups")
+    parser.add_argument("column", choices=["Period", "Region"])
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    table = compare_groups(dataset.load_dataset(), args.column, n_resamples=args.resamples,
+                           seed=args.seed, workers=args.workers)
+    print(table.to_string(index=False))
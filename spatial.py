@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spatial grid index and zoom-level clustering of the samples drawn on the HaploTracker maps.
+
+Description: SpatialIndex assigns every sample, once per dataset version and mode, to a cell of a
+regular latitude/longitude grid at each zoom level. Cell sizes halve from one level to the next
+(like map tiles), so the cells of a level nest inside those of the previous one. Clustering a
+selection then only groups the precomputed integer cell codes of the selected rows: each
+cluster carries its sample count, dominant haplogroup, mean PRS and centroid (mean of the unit
+vectors, so clusters across the antimeridian are placed correctly). The map draws one marker
+per cluster, which bounds the payload by the number of cells instead of the number of samples.
+
+User Defined Functions:
+    unit_vectors(lat, lon): Returns the 3-D unit vectors of coordinates given in degrees.
+    to_lat_lon(xyz): Returns the latitude and longitude of 3-D vectors.
+    great_circle_km(lat1, lon1, lat2, lon2): Returns the great-circle distances between coordinates.
+    grid_codes(lat, lon): Returns the cell code of each coordinate at every zoom level.
+    SpatialIndex.updated(df, change): Returns the index of a refreshed view, recomputing only the changed rows.
+"""
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0
+MAX_ZOOM = 10
+# Grid cells per map tile side: a level-z cell spans 360 / (2^z * CELLS_PER_TILE) degrees
+CELLS_PER_TILE = 8
+# Markers drawn at most when the zoom level is chosen automatically
+MAX_MARKERS = 500
+
+
+def unit_vectors(lat, lon) -> np.ndarray:
+    """Returns the (n, 3) unit vectors of latitudes and longitudes in degrees."""
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def to_lat_lon(xyz: np.ndarray) -> tuple:
+    """Returns the latitudes and longitudes (degrees) of (n, 3) vectors, which need not be unit."""
+    lat = np.degrees(np.arctan2(xyz[:, 2], np.hypot(xyz[:, 0], xyz[:, 1])))
+    lon = np.degrees(np.arctan2(xyz[:, 1], xyz[:, 0]))
+    return lat, lon
+
+
+def great_circle_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Returns the great-circle (haversine) distances in km between coordinates in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def grid_codes(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Returns the (MAX_ZOOM + 1, n) cell code of each coordinate at each zoom level (-1 without coordinates)."""
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    # Finest level first, each coarser level halves the cell indices
+    cols = CELLS_PER_TILE << MAX_ZOOM
+    ix = np.clip(np.floor((np.where(valid, lon, 0) + 180) / 360 * cols), 0, cols - 1).astype(np.int64)
+    iy = np.clip(np.floor((np.where(valid, lat, 0) + 90) / 360 * cols), 0, cols // 2 - 1).astype(np.int64)
+    codes = np.empty((MAX_ZOOM + 1, len(lat)), dtype=np.int64)
+    for zoom in range(MAX_ZOOM, -1, -1):
+        codes[zoom] = np.where(valid, iy * (CELLS_PER_TILE << zoom) + ix, -1)
+        ix, iy = ix >> 1, iy >> 1
+    return codes
+
+
+class SpatialIndex:
+    """
+    Grid cells of every sample at zoom levels 0 to MAX_ZOOM
+
+    Attributes:
+        codes (np.ndarray): (MAX_ZOOM + 1, n) cell code of each row at each level (-1 without coordinates)
+        rows (np.ndarray): Index label of each row in the indexed frame (its position in the full dataset)
+    """
+
+    def __init__(self, df: pd.DataFrame, label: str = "mtdna", value: str = "PRS_SCZ"):
+        lat = df["Lat"].to_numpy(dtype=float)
+        lon = df["Long"].to_numpy(dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        self.codes = grid_codes(lat, lon)
+        self.rows = df.index.to_numpy()
+        self._xyz = unit_vectors(np.where(valid, lat, 0), np.where(valid, lon, 0))
+        self._labels, self._label_names = pd.factorize(df[label].astype(object))
+        self._label = label
+        self._set_values(df, value)
+
+    def _set_values(self, df: pd.DataFrame, value: str):
+        self._value = value
+        self._values = df[value].to_numpy(dtype=float)
+        self._hover = df["hover"].to_numpy(dtype=object) if "hover" in df else None
+
+    def updated(self, df: pd.DataFrame, change) -> "SpatialIndex":
+        """
+        Returns the index of the view df of a refreshed dataset, reusing the cells of the unchanged rows
+
+        Args:
+            df (pd.DataFrame): View of the refreshed dataset (same mode as this index)
+            change (delta.Delta): Delta from the dataset version of this index
+
+        Returns:
+            SpatialIndex: Index of df; only the inserted and updated rows are placed on the grid
+        """
+        # Row of this index each row of df is unchanged from, -1 when it has to be computed
+        previous = np.full(change.n_base, -1, dtype=np.int64)
+        previous[self.rows] = np.arange(len(self.rows))
+        base = change.source[df.index.to_numpy()]
+        reused = np.where(base >= 0, previous[np.maximum(base, 0)], -1)
+        fresh = np.flatnonzero(reused < 0)
+        kept = reused >= 0
+
+        index = SpatialIndex.__new__(SpatialIndex)
+        index.rows = df.index.to_numpy()
+        index.codes = np.empty((MAX_ZOOM + 1, len(df)), dtype=np.int64)
+        index.codes[:, kept] = self.codes[:, reused[kept]]
+        index._xyz = np.empty((len(df), 3))
+        index._xyz[kept] = self._xyz[reused[kept]]
+        lat = df["Lat"].to_numpy(dtype=float)[fresh]
+        lon = df["Long"].to_numpy(dtype=float)[fresh]
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        index.codes[:, fresh] = grid_codes(lat, lon)
+        index._xyz[fresh] = unit_vectors(np.where(valid, lat, 0), np.where(valid, lon, 0))
+
+        # New labels are appended to the label names, the codes of the unchanged rows stay valid
+        labels = df[self._label].astype(object).to_numpy()[fresh]
+        new_names = pd.Index(pd.unique(labels[pd.notna(labels)])).difference(self._label_names, sort=False)
+        index._label_names = self._label_names.append(new_names)
+        index._labels = np.empty(len(df), dtype=np.int64)
+        index._labels[kept] = self._labels[reused[kept]]
+        index._labels[fresh] = index._label_names.get_indexer(labels)
+        index._label = self._label
+        index._set_values(df, self._value)
+        return index
+
+    def n_clusters(self, positions: np.ndarray, zoom: int) -> int:
+        """Returns the number of clusters of the selected rows at a zoom level."""
+        codes = self.codes[zoom, positions]
+        return len(np.unique(codes[codes >= 0]))
+
+    def auto_zoom(self, positions: np.ndarray, max_markers: int = MAX_MARKERS) -> int:
+        """Returns the finest zoom level at which the selected rows form at most max_markers clusters."""
+        for zoom in range(MAX_ZOOM, 0, -1):
+            if self.n_clusters(positions, zoom) <= max_markers:
+                return zoom
+        return 0
+
+    def clusters(self, positions: np.ndarray, zoom: int) -> pd.DataFrame:
+        """
+        Groups the selected rows by grid cell at a zoom level
+
+        Args:
+            positions (np.ndarray): Row positions of the selection (e.g. CladeTrie.positions)
+            zoom (int): Zoom level, 0 (coarsest) to MAX_ZOOM
+
+        Returns:
+            pd.DataFrame: One row per cluster with Lat, Long, count, mtdna (dominant haplogroup),
+            PRS_SCZ (mean) and hover
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        positions = positions[self.codes[zoom, positions] >= 0]
+        cells, inverse = np.unique(self.codes[zoom, positions], return_inverse=True)
+        n = len(cells)
+        count = np.bincount(inverse, minlength=n)
+        xyz = np.column_stack([np.bincount(inverse, self._xyz[positions, axis], n) for axis in range(3)])
+        lat, lon = to_lat_lon(xyz)
+
+        values = self._values[positions]
+        has_value = ~np.isnan(values)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_value = (np.bincount(inverse[has_value], values[has_value], n)
+                          / np.bincount(inverse[has_value], minlength=n))
+
+        # Dominant label: most frequent (cluster, label) pair of each cluster
+        labels = self._labels[positions]
+        n_labels = len(self._label_names) + 1
+        pairs, pair_count = np.unique(inverse * n_labels + (labels + 1), return_counts=True)
+        # Ties go to the first label by name (missing last), whatever the order of the label codes
+        name_rank = np.argsort(np.argsort(np.asarray(self._label_names, dtype=str), kind="stable"))
+        rank = np.append(name_rank, len(name_rank))[pairs % n_labels - 1]
+        best = np.lexsort((rank, -pair_count, pairs // n_labels))
+        first = np.flatnonzero(np.r_[True, np.diff(pairs[best] // n_labels) > 0])
+        dominant = np.asarray(list(self._label_names) + [None], dtype=object)[pairs[best][first] % n_labels - 1]
+
+        # Single samples keep their own hover text
+        first_row = positions[np.unique(inverse, return_index=True)[1]]
+        hover = np.char.add(count.astype(str), " samples").astype(object)
+        if self._hover is not None:
+            hover[count == 1] = self._hover[first_row[count == 1]]
+        return pd.DataFrame({"Lat": lat, "Long": lon, "count": count, "mtdna": dominant,
+                             "PRS_SCZ": mean_value, "hover": hover})
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cached pairwise statistical tests for the EDA tab.
+
+Description: plot_stats draws the same figure as tap.plot_stats (box plot with the pairwise
+p-value brackets), but the pairwise test table is computed once and kept in an on-disk cache.
+The cache key is a fingerprint of the tested columns plus the grouping column, the order of
+the groups, the pairs, the test and the correction, so a reload only reads a small JSON file.
+The cache directory is bounded in size; the least recently used tables are evicted first.
+
+User Defined Functions:
+    cached_table(key, compute): Returns a table from the disk cache, computing it when missing.
+    pairwise_tests(df, x, y): Returns the pairwise test table, from the cache when possible.
+    plot_stats(df, x, y): Builds the tap.plot_stats figure from the cached table.
+"""
+import hashlib
+import itertools
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import scikit_posthocs as sp
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+
+import dataset
+
+CACHE_DIR = dataset.CACHE_DIR / "stats"
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+# Bump when the table format changes
+CACHE_VERSION = 1
+
+TESTS = {
+    "mann-whitney": stats.mannwhitneyu,
+    "t-test": stats.ttest_ind,
+    "t-test-related": stats.ttest_rel,
+    "wilcoxon": stats.wilcoxon,
+    "kruskal-wallis": stats.kruskal,
+    "levene": stats.levene,
+    "brunner-munzel": stats.brunnermunzel,
+    "ansari-bradley": stats.ansari,
+    "cramervon-mises": stats.cramervonmises_2samp,
+    "kolmogorov-smirnov": stats.kstest,
+    "alexander-govern": stats.alexandergovern,
+    "fligner-killeen": stats.fligner,
+    "bartlett": stats.bartlett,
+}
+CORRECTIONS = {
+    "bonferroni": "bonferroni",
+    "sidak": "sidak",
+    "holm-sidak": "holm-sidak",
+    "benjamini-hochberg": "fdr_bh",
+}
+
+
+def fingerprint(df: pd.DataFrame, columns: list) -> str:
+    """Returns a content hash of the given columns (row order included)."""
+    hashed = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    return hashlib.sha256(hashed.tobytes()).hexdigest()[:32]
+
+
+def _group_order(df: pd.DataFrame, x: str, order: list = None) -> list:
+    all_x = list(df[x].unique())
+    if order is None:
+        return all_x
+    # Same checks as tap.plot_stats
+    for _element in order:
+        if _element not in all_x:
+            raise NameError(f"Element '{_element}' not found inside dataframe: {all_x}")
+    if len(set(order)) != len(all_x):
+        raise NameError(f"Expected all entries, {list(set(all_x).difference(order))} not found")
+    return list(order)
+
+
+def compute_pairwise(df: pd.DataFrame, x: str, y: str, pairs: list, type_test: str, type_correction: str = None) -> pd.DataFrame:
+    """
+    Runs the pairwise tests of y between the groups of x
+
+    Returns:
+        pd.DataFrame: One row per pair with group1, group2, statistic, p_value and p_adjusted
+    """
+    values = {group: part[y].to_numpy() for group, part in df.groupby(x, observed=True)}
+    if type_test == "dunn":
+        dunn = sp.posthoc_dunn(df, y, x)
+    elif type_test not in TESTS:
+        raise ValueError(f"Type test {type_test} does not exist, use one of {['dunn'] + list(TESTS)}")
+    rows = []
+    for group1, group2 in pairs:
+        if type_test == "dunn":
+            statistic, p_value = 0.0, float(dunn.loc[group1, group2])
+        else:
+            result = TESTS[type_test](values[group1], values[group2])
+            statistic, p_value = float(result[0]), float(result[1])
+        rows.append({"group1": group1, "group2": group2, "statistic": statistic, "p_value": p_value})
+    table = pd.DataFrame(rows, columns=["group1", "group2", "statistic", "p_value"])
+    if type_correction is None or table.empty:
+        table["p_adjusted"] = table["p_value"]
+    elif type_correction in CORRECTIONS:
+        table["p_adjusted"] = multipletests(table["p_value"], method=CORRECTIONS[type_correction])[1]
+    else:
+        raise ValueError(f"Type correction {type_correction} does not exist, use one of {list(CORRECTIONS)}")
+    return table
+
+
+def _evict(cache_dir: Path, max_bytes: int):
+    """Removes the least recently used tables until the directory fits in max_bytes."""
+    entries = sorted(cache_dir.glob("*.json"), key=lambda path: path.stat().st_mtime)
+    total = sum(path.stat().st_size for path in entries)
+    for path in entries:
+        if total <= max_bytes:
+            break
+        total -= path.stat().st_size
+        path.unlink(missing_ok=True)
+
+
+def cached_table(key: list, compute, cache_dir=CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES) -> pd.DataFrame:
+    """
+    Returns the table stored under key in the disk cache, computing and storing it if missing
+
+    Args:
+        key (list): JSON-serializable parts of the key (fingerprints, parameters)
+        compute (callable): Returns the table when it is not cached
+        cache_dir (str | Path): Directory of the cache (None disables it)
+        max_bytes (int): Size limit of the cache directory
+
+    Returns:
+        pd.DataFrame: Cached or computed table
+    """
+    if cache_dir is None:
+        return compute()
+    key = json.dumps([CACHE_VERSION] + list(key), default=str)
+    path = Path(cache_dir) / (hashlib.sha256(key.encode()).hexdigest()[:32] + ".json")
+    if path.exists():
+        os.utime(path) # marks the entry as recently used
+        return pd.DataFrame(json.loads(path.read_text()))
+
+    table = compute()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(table.to_dict(orient="records")))
+    _evict(path.parent, max_bytes)
+    return table
+
+
+def pairwise_tests(df: pd.DataFrame, x: str, y: str, pairs: list = None, order: list = None,
+                   type_test: str = "mann-whitney", type_correction: str = None,
+                   cache_dir=CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES) -> pd.DataFrame:
+    """
+    Returns the pairwise test table, computing it only when it is not in the disk cache
+
+    Args:
+        df (pd.DataFrame): Samples
+        x (str): Grouping column
+        y (str): Tested column
+        pairs (list): Pairs of groups to test (default: every pair, in order)
+        order (list): Order of the groups (default: order of appearance)
+        type_test (str): Test name, as in tap.plot_stats
+        type_correction (str): Multiple testing correction, as in tap.plot_stats
+        cache_dir (str | Path): Directory of the cache (None disables it)
+        max_bytes (int): Size limit of the cache directory
+
+    Returns:
+        pd.DataFrame: One row per pair with group1, group2, statistic, p_value and p_adjusted
+    """
+    type_test = type_test.lower()
+    if type_correction is not None:
+        type_correction = type_correction.lower()
+    all_x = _group_order(df, x, order)
+    if pairs is None:
+        pairs = list(itertools.combinations(all_x, 2))
+    pairs = [tuple(pair) for pair in pairs]
+    key = [fingerprint(df, [x, y]), x, y, pairs, type_test, type_correction]
+    return cached_table(key, lambda: compute_pairwise(df, x, y, pairs, type_test, type_correction),
+                        cache_dir, max_bytes)
+
+
+def plot_stats(df: pd.DataFrame, x: str, y: str, pairs: list = None, order: list = None,
+               type_test: str = "mann-whitney", type_correction: str = None,
+               cutoff_pvalue: float = 0.05, cache_dir=CACHE_DIR):
+    """
+    Builds the tap.plot_stats figure (box plot with p-value brackets) from the cached test table
+
+    Returns:
+        go.Figure: Box plot of y per group of x with the pairwise annotations
+    """
+    all_x = _group_order(df, x, order)
+    table = pairwise_tests(df, x, y, pairs, order, type_test, type_correction, cache_dir)
+    p_values = {(row.group1, row.group2): (row.p_adjusted, row.statistic) for row in table.itertuples()}
+
+    v_min, v_max = np.nanmin(df[y].values), np.nanmax(df[y].values)
+    v_unit = (v_max - v_min) * 0.1
+    maxima = df.groupby(x, observed=True)[y].max()
+    info_data = {group: {"max": maxima[group], "index": index}
+                 for index, group in enumerate(all_x) if group in maxima.index}
+
+    fig = px.box(df, x=x, y=y, color=x, category_orders={x: all_x})
+    annotations = []
+    # Brackets are stacked from the closest pairs to the farthest ones, as in tap.plot_stats
+    for distance in range(1, len(all_x)):
+        pair_gaps = {pair: abs(info_data[pair[0]]["max"] - info_data[pair[1]]["max"])
+                     for pair in p_values
+                     if abs(info_data[pair[0]]["index"] - info_data[pair[1]]["index"]) == distance}
+        for pair in sorted(pair_gaps, key=pair_gaps.get):
+            index0, index1 = info_data[pair[0]]["index"], info_data[pair[1]]["index"]
+            spanned = all_x[min(index0, index1):max(index0, index1) + 1]
+            line_y = max([0] + [info["max"] for group, info in info_data.items() if group in spanned])
+            for group in spanned:
+                if group in info_data:
+                    info_data[group]["max"] = line_y + v_unit * 1.5
+            line_y += v_unit
+            fig.add_shape(type="path",
+                path=f"M {index0},{line_y - (v_unit * 0.5)} L{index0},{line_y} L{index1},{line_y} L{index1},{line_y - (v_unit * 0.5)}",
+                line=dict(color="Black", width=1.5)
+            )
+            p_value, statistic = p_values[pair]
+            annotations.append(((index0 + index1) * 0.5, line_y + (v_unit * 0.5), p_value, statistic))
+
+    for ann_x, ann_y, p_value, statistic in annotations:
+        _color = "Green" if p_value <= cutoff_pvalue else "Black"
+        _pvalue = round(p_value, 3) if p_value >= 0.001 else "< 0.001"
+        fig.add_annotation(
+            x=ann_x, y=ann_y,
+            text=f'p-value {_pvalue}',
+            showarrow=False,
+            font=dict(color=_color),
+            hovertext=f'p-value: {p_value}<br>statistic: {statistic}'
+        )
+    fig['layout']['yaxis'].update(autorange=True)
+    return fig
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic AADR-like dataset generator for benchmarks.
+
+Description: Writes tables with the same columns as Data/data_pca.csv at any size (10k, 100k or
+1M rows for the benchmark suite). Samples are spread over the countries of the regions with
+jittered coordinates, dated with a log-normal bulk of recent samples plus older tails, and
+given an mtDNA haplogroup drawn from a region-specific PhyloTree-like label pool: each label
+is a random walk down the tree (H -> H1 -> H1a -> H1a2 ...) with Zipf-distributed branch
+choices, so a few clades are very common and most leaves are rare, as in the AADR. Some
+values are missing or undetermined the same way as in the release ("..", "n/a (<2x)",
+"Indeterminado" regions).
+
+User Defined Functions:
+    generate(n, seed): Returns a synthetic table with the source column names.
+    write(n, path, seed): Writes a synthetic table to a csv file.
+
+Usage:
+    python synthetic.py 100000 Data/synthetic_100k.csv
+"""
+import argparse
+import string
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import dataset
+
+# Country -> (region, latitude, longitude) of the sampled sites
+COUNTRIES = {
+    'Spain': ('Europa', 40.4, -3.7), 'United Kingdom': ('Europa', 52.5, -1.5), 'France': ('Europa', 46.6, 2.4),
+    'Hungary': ('Europa', 47.2, 19.5), 'Finland': ('Europa', 62.0, 25.7), 'Norway': ('Europa', 61.0, 9.0),
+    'Ireland': ('Europa', 53.2, -8.0), 'Iceland': ('Europa', 64.9, -18.6), 'Russia': ('Ásia', 56.0, 60.0),
+    'China': ('Ásia', 35.0, 104.0), 'India': ('Ásia', 22.0, 79.0), 'Kazakhstan': ('Ásia', 48.0, 67.0),
+    'Pakistan': ('Ásia', 30.0, 70.0), 'Jordan': ('Ásia', 31.0, 36.0), 'Nepal': ('Ásia', 28.4, 84.1),
+    'Nigeria': ('África', 9.1, 8.7), 'Morocco': ('África', 31.8, -7.1), 'Sudan': ('África', 15.5, 30.2),
+    'USA': ('América', 39.8, -98.6), 'Mexico': ('América', 23.6, -102.5), 'Peru': ('América', -9.2, -75.0),
+    'Chile': ('América', -35.7, -71.5), 'Argentina': ('América', -38.4, -63.6), 'Canada': ('América', 56.1, -106.3),
+    'Tonga': ('Oceania', -21.2, -175.2), 'French Polynesia': ('Oceania', -17.7, -149.4),
+}
+# Region -> top-level mtDNA haplogroups of its label pool
+REGION_HAPLOGROUPS = {
+    'Europa': ['H', 'U', 'K', 'J', 'T', 'V', 'W', 'X', 'I', 'HV'],
+    'Ásia': ['D', 'M', 'C', 'G', 'F', 'B', 'A', 'N', 'R', 'Z'],
+    'África': ['L0', 'L1', 'L2', 'L3', 'M1', 'U6'],
+    'América': ['A', 'B', 'C', 'D', 'X'],
+    'Oceania': ['P', 'Q', 'M', 'B', 'E'],
+}
+# Distinct random walks drawn per region; samples pick labels from this pool
+POOL_SIZE = 5000
+MAX_DEPTH = 6
+MISSING_LAT = 0.03
+LOW_COVERAGE = 0.05
+UNDETERMINED_REGION = 0.10
+
+
+def _label_pool(roots: list, rng: np.random.Generator) -> np.ndarray:
+    """Returns POOL_SIZE haplogroup labels, each a random walk down the tree from a root."""
+    labels = []
+    for _ in range(POOL_SIZE):
+        label = roots[min(rng.zipf(1.6), len(roots)) - 1]
+        for _ in range(rng.integers(1, MAX_DEPTH)):
+            branch = min(rng.zipf(2.0), 9)
+            # Letters and numbers alternate down the tree
+            label += string.ascii_lowercase[branch - 1] if label[-1].isdigit() else str(branch)
+        labels.append(label)
+    return np.asarray(labels, dtype=object)
+
+
+def generate(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns a synthetic AADR-like table
+
+    Args:
+        n (int): Number of samples
+        seed (int): Seed of the generator
+
+    Returns:
+        pd.DataFrame: n rows with the source columns of Data/data_pca.csv (see dataset.COLUMNS)
+    """
+    rng = np.random.default_rng(seed)
+    names = list(COUNTRIES)
+    # Europe is over-represented in the AADR
+    weights = np.array([3.0 if COUNTRIES[name][0] == 'Europa' else 1.0 for name in names])
+    country = rng.choice(len(names), size=n, p=weights / weights.sum())
+    region = np.array([COUNTRIES[name][0] for name in names], dtype=object)[country]
+    lat = np.array([COUNTRIES[name][1] for name in names])[country] + rng.normal(0, 3, n)
+    lon = np.array([COUNTRIES[name][2] for name in names])[country] + rng.normal(0, 4, n)
+    lat, lon = np.clip(lat, -89, 89).round(3), ((lon + 180) % 360 - 180).round(3)
+
+    # Mostly recent samples, with Neolithic and Paleolithic tails
+    kind = rng.random(n)
+    date = np.where(kind < 0.7, rng.lognormal(np.log(3000), 0.7, n),
+                    np.where(kind < 0.9, rng.uniform(4000, 13000, n), rng.uniform(13000, 45000, n)))
+    date = np.clip(date, 0, 45000).astype(np.int64)
+    period = dataset.assign_periods(pd.Series(date)).astype(object).to_numpy()
+
+    mtdna = np.empty(n, dtype=object)
+    for name, roots in REGION_HAPLOGROUPS.items():
+        rows = np.flatnonzero(region == name)
+        mtdna[rows] = _label_pool(roots, rng)[rng.integers(0, POOL_SIZE, len(rows))]
+    mtdna[rng.random(n) < LOW_COVERAGE] = 'n/a (<2x)'
+
+    prs = rng.normal(0, 1, n) + np.where(period == 'Pós-Neolítico', 0.1, 0.0)
+    lat_text = lat.astype(str).astype(object)
+    lat_text[rng.random(n) < MISSING_LAT] = '..'
+    continent = region.copy()
+    continent[rng.random(n) < UNDETERMINED_REGION] = 'Indeterminado'
+
+    short = {
+        "Genetic ID": [f"SYN{i:07d}" for i in range(n)],
+        "Sex": rng.choice(['M', 'F', 'U'], size=n, p=[0.45, 0.45, 0.10]),
+        "Lat": lat_text,
+        "Long": lon,
+        "Region": continent,
+        "mtdna": mtdna,
+        "Date": date,
+        "Country": np.asarray(names, dtype=object)[country],
+        "PRS_SCZ": prs,
+        "Period": period,
+    }
+    return pd.DataFrame({source: short[name] for source, name in dataset.COLUMNS.items()})
+
+
+def write(n: int, path, seed: int = 0) -> Path:
+    """Writes a synthetic table of n rows to a csv file and returns its path."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    generate(n, seed).to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic AADR-like table with the columns of Data/data_pca.csv")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"{args.rows} samples written to {write(args.rows, args.path, args.seed)}")
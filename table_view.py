@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server-side paginated view of the dataset for the Home tab.
+
+Description: Instead of sending the whole (filtered) table to the browser, the app keeps the
+rows on the server and only sends the visible page. Sorting is done once per column and
+direction over the full dataset and kept as a permutation; a filtered subset is ordered by
+walking that permutation, without sorting again. Exports are written in batches so the
+encoder never holds more than one batch of rows as text at a time.
+"""
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PAGE_SIZES = [25, 50, 100, 250]
+# Number of sort permutations kept in memory
+PERMUTATION_CACHE_SIZE = 16
+EXPORT_BATCH_SIZE = 10000
+
+
+class TableView:
+    """
+    Sort permutations and page extraction over a read-only dataframe
+
+    Attributes:
+        df (pd.DataFrame): Full dataset (never modified)
+    """
+
+    def __init__(self, df: pd.DataFrame, cache_size: int = PERMUTATION_CACHE_SIZE):
+        self.df = df
+        self._permutations = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def positions(self, subset: pd.DataFrame) -> np.ndarray:
+        """Returns the row positions in df of a subset of it (e.g. the output of filter_dataframe)."""
+        if subset is self.df:
+            return np.arange(len(self.df))
+        return self.df.index.get_indexer(subset.index)
+
+    def permutation(self, column: str, ascending: bool = True) -> np.ndarray:
+        """
+        Returns the row positions of df sorted by a column (missing values last)
+
+        The permutation is computed once per (column, direction) and kept in an LRU cache.
+        """
+        key = (column, ascending)
+        with self._lock:
+            if key in self._permutations:
+                self._permutations.move_to_end(key)
+                return self._permutations[key]
+        values = self.df[column].reset_index(drop=True)
+        order = values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+        order.flags.writeable = False
+        with self._lock:
+            self._permutations[key] = order
+            if len(self._permutations) > self._cache_size:
+                self._permutations.popitem(last=False)
+        return order
+
+    def order(self, rows: np.ndarray, column: str = None, ascending: bool = True) -> np.ndarray:
+        """
+        Orders a subset of rows by a column, using the cached permutation of the full table
+
+        Args:
+            rows (np.ndarray): Row positions of the subset
+            column (str): Column to sort by (None keeps the dataset order)
+            ascending (bool): Sort direction
+
+        Returns:
+            np.ndarray: Row positions in display order
+        """
+        if column is None:
+            return np.sort(rows)
+        permutation = self.permutation(column, ascending)
+        keep = np.zeros(len(self.df), dtype=bool)
+        keep[rows] = True
+        return permutation[keep[permutation]]
+
+    def page(self, ordered: np.ndarray, page: int, page_size: int) -> pd.DataFrame:
+        """Returns the rows of a page (pages start at 1)."""
+        start = (page - 1) * page_size
+        return self.df.iloc[ordered[start:start + page_size]]
+
+    def iter_batches(self, ordered: np.ndarray, batch_size: int = EXPORT_BATCH_SIZE):
+        """Yields the ordered rows as dataframes of at most batch_size rows."""
+        for start in range(0, len(ordered), batch_size):
+            yield self.df.iloc[ordered[start:start + batch_size]]
+
+    def export_csv(self, ordered: np.ndarray, batch_size: int = EXPORT_BATCH_SIZE):
+        """Yields the ordered rows encoded as csv, one batch at a time (only the header for no rows)."""
+        if not len(ordered):
+            yield self.df.head(0).to_csv(index=False).encode("utf-8")
+        for number, batch in enumerate(self.iter_batches(ordered, batch_size)):
+            yield batch.to_csv(index=False, header=number == 0).encode("utf-8")
+
+    def export_parquet(self, ordered: np.ndarray, batch_size: int = EXPORT_BATCH_SIZE) -> bytes:
+        """Returns the ordered rows as a Parquet file, written one record batch at a time."""
+        sink = io.BytesIO()
+        # The schema comes from a sample of the full table, so text columns are not typed as null
+        schema = pa.Schema.from_pandas(self.df.head(1000), preserve_index=False)
+        with pq.ParquetWriter(sink, schema) as writer:
+            for batch in self.iter_batches(ordered, batch_size):
+                writer.write_table(pa.Table.from_pandas(batch, schema=schema, preserve_index=False))
+        return sink.getvalue()
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the app live at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def write_geno(tmp_path):
+    """Returns a function writing a packed EIGENSTRAT release (SNPs x samples counts, 3 = missing)."""
+    def write(genotypes, ref=None, alt=None, name="release"):
+        genotypes = np.asarray(genotypes, dtype=np.uint8)
+        n_snp, n_ind = genotypes.shape
+        prefix = tmp_path / name
+        ids = [f"S{i}" for i in range(n_ind)]
+        pd.DataFrame({"id": ids, "sex": "U", "pop": "P"}).to_csv(f"{prefix}.ind", sep=" ", header=False, index=False)
+        pd.DataFrame({"id": [f"rs{j}" for j in range(n_snp)], "chr": 1, "gp": 0.0, "pos": np.arange(n_snp),
+                      "ref": ref if ref is not None else "A", "alt": alt if alt is not None else "G"}
+                     ).to_csv(f"{prefix}.snp", sep=" ", header=False, index=False)
+        record = max(48, -(-n_ind // 4))
+        padded = np.zeros((n_snp, record * 4), dtype=np.uint8)
+        padded[:, :n_ind] = genotypes
+        padded = padded.reshape(n_snp, record, 4)
+        packed = (padded[:, :, 0] << 6) | (padded[:, :, 1] << 4) | (padded[:, :, 2] << 2) | padded[:, :, 3]
+        header = f"GENO {n_ind} {n_snp} 0 0".encode()
+        with open(f"{prefix}.geno", "wb") as handle:
+            handle.write(header + b"\0" * (record - len(header)))
+            handle.write(packed.astype(np.uint8).tobytes())
+        return prefix
+    return write
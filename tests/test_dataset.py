@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+import dataset
+
+
+def test_partial_scores_keep_the_source_prs(tmp_path):
+    source = pd.DataFrame({
+        "Genetic ID": ["I1", "I2", "I3"],
+        "Molecular Sex": ["M", "F", "F"],
+        "Lat.": ["40.1", "50.2", "60.3"],
+        "Long.": ["1.0", "2.0", "3.0"],
+        "Continente": ["Europe", "Europe", "Asia"],
+        "mtDNA haplogroup if >2x or published": ["H1", "J1", "U5"],
+        "Date mean in BP in years before 1950 CE [OxCal mu for a direct radiocarbon date, and average of range for a contextual date]": [5000, 3000, 9000],
+        "Political Entity": ["Spain", "France", "Russia"],
+        "PRS_20PCs": [0.5, -0.25, 1.5],
+        "Período Histórico": ["Neolítico", "Pós-Neolítico", "Mesolítico"],
+    })
+    source.to_csv(tmp_path / "data.csv", index=False)
+    pd.DataFrame({"Genetic ID": ["I2"], "PRS_SCZ": [2.0]}).to_csv(tmp_path / "scores.csv", index=False)
+
+    df = dataset.build_dataset(tmp_path / "data.csv", scores=tmp_path / "scores.csv")
+    np.testing.assert_allclose(df.set_index("Genetic ID").loc[["I1", "I2", "I3"], "PRS_SCZ"], [0.5, 2.0, 1.5])
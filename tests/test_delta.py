@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import cube
+import dataset
+import delta
+import spatial
+import synthetic
+
+
+def _sorted_counts(aggregates, by, mode):
+    counts = aggregates.counts(by, mode).astype({column: object for column in by})
+    return counts.sort_values(by).reset_index(drop=True)
+
+
+def test_incremental_refresh_matches_a_rebuild(tmp_path):
+    source = tmp_path / "data.csv"
+    base = synthetic.generate(400, seed=1)
+    base.to_csv(source, index=False)
+    old = dataset.load_shared_dataset(source, tmp_path / "cache", incremental=True)
+
+    # Delete, update and insert samples by Genetic ID; the inserted rows come last, as in the refreshed cache
+    rng = np.random.default_rng(0)
+    located = base.index[base["Lat."].astype(str) != ".."]
+    release = base.drop(index=rng.choice(located, 20, replace=False))
+    updated = rng.choice(release.index.intersection(located), 40, replace=False)
+    release.loc[updated[:10], "PRS_20PCs"] += 1
+    release.loc[updated[10:20], "mtDNA haplogroup if >2x or published"] = "ZZ9z"
+    release.loc[updated[20:30], "Political Entity"] = "Atlantis"
+    release.loc[updated[30:], "Long."] = release.loc[updated[30:], "Long."].astype(float) + 5
+    inserted = synthetic.generate(30, seed=2)
+    inserted = inserted[inserted["Lat."].astype(str) != ".."].head(15)
+    inserted["Genetic ID"] = [f"NEW{i}" for i in range(len(inserted))]
+    # Their undetermined regions are backfilled from the countries, as in a full build
+    inserted.iloc[:5, inserted.columns.get_loc("Continente")] = "Indeterminado"
+    release = pd.concat([release, inserted], ignore_index=True)
+    release.to_csv(source, index=False)
+    os.utime(source, ns=(os.stat(source).st_atime_ns, os.stat(source).st_mtime_ns + 10 ** 9))
+
+    current = dataset.load_shared_dataset(source, tmp_path / "cache", incremental=True)
+    assert current.delta is not None and current.delta.base_version == old.version
+    assert current.delta.counts == {"inserted": 15, "updated": 40, "deleted": 20}
+    rebuilt = dataset.load_dataset(source, tmp_path / "cold")
+    pd.testing.assert_frame_equal(current.frame, rebuilt)
+
+    refreshed = cube.AggregateCube(old.frame).updated(current.delta.removed, current.frame.iloc[current.delta.added])
+    fresh = cube.AggregateCube(rebuilt)
+    for by, mode in [(["Region", "Period"], None), (["mtdna", "Region"], "MtDNA-Female"), (["mtdna"], "MtDNA")]:
+        pd.testing.assert_frame_equal(_sorted_counts(refreshed, by, mode), _sorted_counts(fresh, by, mode))
+
+    for mode in ("MtDNA", "MtDNA-Male"):
+        view = current.view(mode)
+        index = spatial.SpatialIndex(old.view(mode)).updated(view, current.delta)
+        built = spatial.SpatialIndex(view)
+        np.testing.assert_array_equal(index.codes, built.codes)
+        for zoom in (2, 6, 10):
+            pd.testing.assert_frame_equal(index.clusters(np.arange(len(view)), zoom),
+                                          built.clusters(np.arange(len(view)), zoom))
+
+    # The derived cache updates the structure of the previous version instead of building it again
+    derived, calls = delta.DerivedCache(), []
+    derived.get("cube", old, lambda: calls.append("build") or cube.AggregateCube(old.frame), None)
+    derived.get("cube", current, None, lambda previous, change: calls.append("update") or previous)
+    assert calls == ["build", "update"]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import dispersal
+import spatial
+
+
+def _brute_force(lat, lon, age, max_gap, km_per_year=dispersal.KM_PER_YEAR):
+    points = np.column_stack([spatial.unit_vectors(lat, lon) * spatial.EARTH_RADIUS_KM, age * km_per_year])
+    predecessor = np.full(len(age), -1)
+    for i in range(len(age)):
+        gaps = age - age[i]
+        candidates = np.flatnonzero((gaps > 0) & (gaps <= max_gap) & np.isfinite(lat))
+        if np.isfinite(lat[i]) and len(candidates):
+            predecessor[i] = candidates[np.argmin(((points[candidates] - points[i]) ** 2).sum(axis=1))]
+    return predecessor
+
+
+@pytest.mark.parametrize("first_k, max_k", [(dispersal.FIRST_K, dispersal.MAX_K), (2, 2)])
+def test_predecessor_links_match_brute_force(monkeypatch, first_k, max_k):
+    # (2, 2) sends most samples to the direct scan of their time window
+    monkeypatch.setattr(dispersal, "FIRST_K", first_k)
+    monkeypatch.setattr(dispersal, "MAX_K", max_k)
+    rng = np.random.default_rng(0)
+    n = 300
+    lat, lon = rng.uniform(30, 60, n), rng.uniform(-10, 40, n)
+    age = rng.uniform(0, 20000, n)
+    lat[:3] = np.nan   # without coordinates: no link either way
+    age[3] = 50000     # far older than every other sample: no predecessor
+    max_gap = 1500
+    expected = _brute_force(lat, lon, age, max_gap)
+    links = dispersal.predecessor_links(lat, lon, age, max_gap=max_gap)
+    np.testing.assert_array_equal(links, expected)
+    assert (links[:4] == -1).all() and (links[np.argmax(np.where(np.isfinite(lat), age, -1))] == -1)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import filters
+
+LABELS = ["H1a", "H1b2", "H2", "J1c", "U5a1", "U5b", "K1a4", "T2b", "HV0", "L3", "H", "X2b", "N1a1a", "R0a"]
+
+
+@pytest.fixture(scope="module")
+def engine():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Period": pd.Series(rng.choice(["Mesolithic", "Neolithic", ""], 500)).replace("", np.nan),
+        "Region": pd.Series(rng.choice(["Europe", "Asia", "Africa", None], 500)).astype("category"),
+        "mtdna": pd.Series(rng.choice(LABELS + [None], 500)),
+    })
+    return filters.FilterEngine(df)
+
+
+@pytest.mark.parametrize("column", ["Period", "Region"])
+def test_category_mask_keeps_missing_values(engine, column):
+    series = engine.df[column]
+    assert engine.kind(column) == filters.CATEGORICAL
+    assert any(pd.isna(value) for value in engine.values(column))
+    # The multiselect offers the unique values of the column, missing one included
+    uniques = list(series.unique())
+    missing = [value for value in uniques if pd.isna(value)]
+    present = [value for value in uniques if not pd.isna(value)]
+    for selected in (uniques, missing, present[:1], present[:1] + missing):
+        np.testing.assert_array_equal(engine.category_mask(column, selected), series.isin(selected).to_numpy())
+    np.testing.assert_array_equal(engine.category_mask(column, engine.values(column)), np.ones(len(series), dtype=bool))
+
+
+@pytest.mark.parametrize("pattern", [
+    "H1", "H", "U5a", "H1a|J1", "(U5|K1)a", "H1(a|b2)?", "U5(a1)?", "[HJ]1", "H[0-9]b", r"\d", "X2b{1}",
+    "^H", "a$", "H.b", "U5a?1", "N1a1*", "K1a+4", "H1b?2", "HV0?", "T2b.*", "1a", "a", "^L3$", "^$",
+])
+@pytest.mark.filterwarnings("ignore:This pattern is interpreted as a regular expression")
+def test_text_mask_matches_str_contains(engine, pattern):
+    expected = engine.df["mtdna"].str.contains(pattern, regex=True, na=False).to_numpy()
+    np.testing.assert_array_equal(engine.text_mask("mtdna", pattern), expected)
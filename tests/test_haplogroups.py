@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+import haplogroups
+
+
+def test_positions_parent_and_child_starting_together():
+    # H has no sample of its own, so its range starts where H1 starts
+    trie = haplogroups.CladeTrie(pd.Series(["H1a", "H1b", "H2", "J1"]))
+    np.testing.assert_array_equal(np.sort(trie.positions(["H", "H1"])), [0, 1, 2])
+    np.testing.assert_array_equal(np.sort(trie.positions(["H1", "H"])), [0, 1, 2])
+    np.testing.assert_array_equal(np.sort(trie.positions(["H1", "J"])), [0, 1, 3])
+
+
+def test_positions_are_the_rows_below_the_clades():
+    labels = pd.Series(["J1", "H2", "H1a", None, "H1b", "H1a", "J2"])
+    trie = haplogroups.CladeTrie(labels)
+    positions = trie.positions(["H1", "J"])
+    assert len(positions) == len(np.unique(positions))
+    expected = np.flatnonzero(labels.str.match(r"^(H1|J)", na=False).to_numpy())
+    np.testing.assert_array_equal(np.sort(positions), expected)
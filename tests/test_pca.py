@@ -0,0 +1,51 @@
+import numpy as np
+
+import pca
+
+
+def _structured(rng, n_ind=120, n_snp=2000, missing=0.0):
+    """
+    Genotypes of three populations, SNPs x samples
+
+    The populations drift apart by different amounts, so PC1 and PC2 both come from the planted
+    structure and have distinct eigenvalues.
+    """
+    population = np.arange(n_ind) % 3
+    base = rng.uniform(0.1, 0.9, n_snp)
+    # The third population keeps the ancestral frequencies, the other two drift by different amounts
+    drift = rng.normal(0, 1, (3, n_snp)) * np.array([[0.35], [0.2], [0.0]])
+    frequency = np.clip(base[None, :] + drift, 0.02, 0.98)[population].T
+    genotypes = (rng.random((n_snp, n_ind)) < frequency).astype(np.uint8) + (rng.random((n_snp, n_ind)) < frequency)
+    genotypes[rng.random(genotypes.shape) < missing] = 3
+    return genotypes
+
+
+def _dense_pcs(genotypes, n_components):
+    """PCs of the standardized matrix computed with a dense SVD, scaled as pca.fit scales them."""
+    called = genotypes != 3
+    mean = np.where(called, genotypes, 0).sum(axis=1) / called.sum(axis=1)
+    frequency = mean / 2
+    used = (np.minimum(frequency, 1 - frequency) >= pca.MIN_MAF) & (called.mean(axis=1) >= pca.MIN_CALLED)
+    scale = np.sqrt(2 * frequency[used] * (1 - frequency[used]))
+    x = np.where(called[used], (genotypes[used] - mean[used, None]) / scale[:, None], 0)
+    _, singular_values, vt = np.linalg.svd(x, full_matrices=False)
+    return (vt[:n_components] * singular_values[:n_components, None]).T / np.sqrt(used.sum())
+
+
+def test_fit_matches_dense_svd(write_geno):
+    genotypes = _structured(np.random.default_rng(0), missing=0.02)
+    prefix = write_geno(genotypes)
+    pcs, basis = pca.fit(prefix, n_components=2, workers=2, block_bytes=64 * 1024)
+    expected = _dense_pcs(genotypes, 2)
+    for component in range(2):
+        fitted = pcs[f"PC{component + 1}"].to_numpy()
+        sign = np.sign(fitted @ expected[:, component])
+        np.testing.assert_allclose(sign * fitted, expected[:, component], atol=5e-3)
+    assert basis.loadings.shape == (basis.snps.size, 2)
+
+
+def test_project_returns_the_fitted_pcs(write_geno):
+    prefix = write_geno(_structured(np.random.default_rng(1)))
+    pcs, basis = pca.fit(prefix, n_components=2, workers=1)
+    projected = pca.project(prefix, basis, workers=2, block_bytes=64 * 1024)
+    np.testing.assert_allclose(projected.loc[pcs.index].to_numpy(), pcs.to_numpy(), atol=1e-3)
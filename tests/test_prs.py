@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+import prs
+
+
+def test_score_aligns_weights_and_imputes_missing(write_geno):
+    genotypes = [
+        [0, 1, 2, 3],  # A/G, effect A: reference allele, missing genotype imputed with the mean 1
+        [2, 1, 0, 0],  # A/G, effect G: alternative allele
+        [1, 2, 0, 1],  # A/G, effect T: reference allele on the other strand
+        [2, 0, 1, 1],  # A/T, effect A: ambiguous, only matched directly on the reference
+        [1, 1, 1, 1],  # A/G, effect D (a deletion): alleles do not match, dropped
+    ]
+    prefix = write_geno(genotypes, ref=["A", "A", "A", "A", "A"], alt=["G", "G", "G", "T", "G"])
+    weights = pd.DataFrame({"SNP": [f"rs{j}" for j in range(5)], "effect": ["A", "G", "T", "A", "D"],
+                            "weight": [1.0, 10.0, 100.0, 1000.0, 10000.0]})
+
+    rows, weight, constant = prs.align_weights(prs.read_snp(f"{prefix}.snp"), weights)
+    np.testing.assert_array_equal(rows, [0, 1, 2, 3])
+    np.testing.assert_allclose(weight, [1, -10, 100, 1000])
+    assert constant == 20
+
+    scores = prs.score(prefix, weights, block_bytes=1)
+    # Effect allele counts: rs0 (0, 1, 2, 1), rs1 (2 - g), rs2 g, rs3 g
+    expected = np.array([0, 1, 2, 1]) + 10 * np.array([0, 1, 2, 2]) + 100 * np.array([1, 2, 0, 1]) \
+        + 1000 * np.array([2, 0, 1, 1])
+    np.testing.assert_allclose(scores["score"], expected, rtol=1e-6)
+    np.testing.assert_array_equal(scores["n_snps"], [4, 4, 4, 3])
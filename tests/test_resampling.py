@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import resampling
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = resampling.make_pool(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_permutation_test_is_the_same_on_a_pool(pool, monkeypatch):
+    # Small blocks, so the permutations run over several blocks
+    monkeypatch.setattr(resampling, "BLOCK_ELEMENTS", 20000)
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(0, 1, 60), rng.normal(0.4, 1, 80)
+    local = resampling.permutation_test(a, b, n_resamples=2000, seed=3)
+    pooled = resampling.permutation_test(a, b, n_resamples=2000, seed=3, pool=pool)
+    assert local["p_value"] == pooled["p_value"]
+
+
+def test_permutation_test_of_identical_groups():
+    values = np.random.default_rng(1).normal(0, 1, 50)
+    result = resampling.permutation_test(values, values.copy(), n_resamples=2000)
+    assert result["mean_diff"] == 0
+    assert result["p_value"] > 0.99
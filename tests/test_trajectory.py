@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import trajectory
+
+
+def _samples(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"Date": rng.uniform(0, 10000, n), "PRS_SCZ": rng.normal(0, 1, n),
+                         "Region": rng.choice(["Europe", "Asia"], n)})
+
+
+def test_rolling_mean_matches_windows():
+    df = _samples()
+    result = trajectory.rolling_trajectory(df, window=1500, points=40, n_boot=20)
+    for row in result.itertuples():
+        part = df[df["Region"] == row.group]
+        inside = part["PRS_SCZ"][(part["Date"] >= row.center - 750) & (part["Date"] <= row.center + 750)]
+        assert row.n == len(inside)
+        assert row.value == pytest.approx(inside.mean())
+
+
+@pytest.mark.parametrize("stat", ["mean", "median"])
+def test_bands_are_reproducible(stat, monkeypatch):
+    # Small blocks, so the resamples are drawn over several blocks
+    monkeypatch.setattr(trajectory, "BLOCK_ELEMENTS", 1000)
+    df = _samples()
+    first = trajectory.rolling_trajectory(df, window=1500, points=40, n_boot=50, stat=stat, seed=7)
+    second = trajectory.rolling_trajectory(df, window=1500, points=40, n_boot=50, stat=stat, seed=7)
+    pd.testing.assert_frame_equal(first, second)
+    assert (first["lower"] <= first["value"]).all() and (first["value"] <= first["upper"]).all()
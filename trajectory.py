@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sliding-window PRS trajectories with bootstrap confidence bands.
+
+Description: For each group (Region by default) the samples are sorted by date once, and the
+rolling statistic is evaluated on a regular grid of window centres. Window bounds come from
+searchsorted on the sorted dates, and the rolling mean from prefix sums, so the whole
+trajectory costs O(n log n) regardless of the window size.
+Confidence bands use a Poisson bootstrap: a (resamples x samples) matrix of Poisson(1)
+weights is drawn in blocks, and the weighted window means of every resample are read from
+prefix sums of that matrix, so no Python loop runs over resamples. The rolling median has no
+prefix-sum form; it is computed per window centre, with the resamples drawn as index matrices
+per window. Blocks of both are sized by element count, so their memory does not grow with
+the size of the group or of the window.
+
+User Defined Functions:
+    rolling_trajectory(df, x, y, group): Returns the rolling statistic and its confidence band per group.
+"""
+import numpy as np
+import pandas as pd
+
+WINDOW = 2000
+POINTS = 200
+N_BOOT = 200
+# Windows with fewer samples are left out of the trajectory
+MIN_SAMPLES = 5
+# Matrix elements (resamples x samples) drawn per block, about 32 MB of float64
+BLOCK_ELEMENTS = 4000000
+
+
+def _window_bounds(xs: np.ndarray, grid: np.ndarray, window: float) -> tuple:
+    lo = np.searchsorted(xs, grid - window / 2, side="left")
+    hi = np.searchsorted(xs, grid + window / 2, side="right")
+    return lo, hi
+
+
+def _prefix(values: np.ndarray) -> np.ndarray:
+    """Prefix sums along the last axis, with a leading zero."""
+    shape = values.shape[:-1] + (1,)
+    return np.concatenate([np.zeros(shape), np.cumsum(values, axis=-1)], axis=-1)
+
+
+def _rolling_mean(ys, lo, hi, n_boot, alpha, rng):
+    sums = _prefix(ys)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        value = (sums[hi] - sums[lo]) / (hi - lo)
+        boot = []
+        block = max(1, BLOCK_ELEMENTS // max(len(ys), 1))
+        for start in range(0, n_boot, block):
+            weights = rng.poisson(1.0, size=(min(block, n_boot - start), len(ys))).astype(float)
+            sum_w, sum_wy = _prefix(weights), _prefix(weights * ys)
+            boot.append((sum_wy[:, hi] - sum_wy[:, lo]) / (sum_w[:, hi] - sum_w[:, lo]))
+    boot = np.concatenate(boot)
+    lower, upper = np.nanpercentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return value, lower, upper
+
+
+def _rolling_median(ys, lo, hi, n_boot, alpha, rng):
+    value, lower, upper = (np.full(len(lo), np.nan) for _ in range(3))
+    for i, (start, stop) in enumerate(zip(lo, hi)):
+        window = ys[start:stop]
+        if not len(window):
+            continue
+        value[i] = np.median(window)
+        block = max(1, BLOCK_ELEMENTS // len(window))
+        medians = np.concatenate([
+            np.median(window[rng.integers(0, len(window), size=(min(block, n_boot - first), len(window)))], axis=1)
+            for first in range(0, n_boot, block)
+        ])
+        lower[i], upper[i] = np.percentile(medians, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return value, lower, upper
+
+
+def rolling_trajectory(df: pd.DataFrame, x: str = "Date", y: str = "PRS_SCZ", group: str = "Region",
+                       window: float = WINDOW, points: int = POINTS, stat: str = "mean",
+                       n_boot: int = N_BOOT, confidence: float = 0.95, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns the rolling mean or median of y along x for each group, with bootstrap confidence bands
+
+    Args:
+        df (pd.DataFrame): Samples
+        x (str): Time column (years BP or years ago)
+        y (str): Value column
+        group (str): Grouping column (None for a single trajectory)
+        window (float): Width of the window, in units of x
+        points (int): Number of window centres, evenly spaced over the range of x
+        stat (str): "mean" or "median"
+        n_boot (int): Number of bootstrap resamples
+        confidence (float): Coverage of the band
+        seed (int): Seed of the resampling, for reproducible bands
+
+    Returns:
+        pd.DataFrame: group, center, n, value, lower and upper for each window with enough samples
+    """
+    if stat not in ("mean", "median"):
+        raise ValueError(f"Unknown statistic {stat}, use 'mean' or 'median'")
+    rng = np.random.default_rng(seed)
+    alpha = 1 - confidence
+    samples = df[[x, y] + ([group] if group else [])].dropna(subset=[x, y])
+    if samples.empty:
+        return pd.DataFrame(columns=["group", "center", "n", "value", "lower", "upper"])
+    grid = np.linspace(samples[x].min(), samples[x].max(), points)
+    groups = samples.groupby(group, observed=True, sort=False) if group else [(None, samples)]
+
+    parts = []
+    for name, part in groups:
+        part = part.sort_values(by=x, kind="stable")
+        xs, ys = part[x].to_numpy(dtype=float), part[y].to_numpy(dtype=float)
+        lo, hi = _window_bounds(xs, grid, window)
+        rolling = _rolling_mean if stat == "mean" else _rolling_median
+        value, lower, upper = rolling(ys, lo, hi, n_boot, alpha, rng)
+        result = pd.DataFrame({"group": name, "center": grid, "n": hi - lo,
+                               "value": value, "lower": lower, "upper": upper})
+        parts.append(result[result["n"] >= MIN_SAMPLES])
+    return pd.concat(parts, ignore_index=True)